@@ -1,46 +1,164 @@
 #!/usr/bin/env python3
-import sys, argparse, io, re
+import sys, os, argparse, io, re, time, array, mmap
 
 MEMSIZE = 0x10000
+BUFSIZE = 0x10000
+MAX_NESTING = 15
 
-def run(source, run_length=False, debug=False, newline_conv=False,
-        eof_nochange=False):
+def tokenize(source, run_length=False, debug=False):
     commands = '><+-.,[]' + ('dDpi' if debug else '')
     pattern = '[{}]'.format(''.join(map(re.escape, commands)))
     if run_length:
         pattern += r'|\d+'
-    code = []
-    brackets = []
+    tokens = []
     repeat = 1
     for c in re.findall(pattern, source):
         if c.isdecimal():
             repeat=int(c)
         else:
-            code.extend(c*repeat)
+            tokens.append((c, repeat))
             repeat = 1
-            if c == '[':
-                brackets.append(len(code))
-                code.append(-1)
-            elif c == ']':
-                match = brackets.pop()
-                code[match] = len(code)
-                code.append(match)
-
-    array = [0] * MEMSIZE
+    return tokens
+
+class BufferedIO:
+    def __init__(self, infile=None, outfile=None, newline_conv=False,
+                 eof_nochange=False, bufsize=BUFSIZE):
+        if infile is None:
+            infile = sys.stdin.buffer
+        if outfile is None:
+            outfile = sys.stdout.buffer
+        self.infile = infile
+        self.outfile = outfile
+        self.newline_conv = newline_conv
+        self.eof_nochange = eof_nochange
+        self.bufsize = bufsize
+        self.linesep = os.linesep.encode() if newline_conv else b'\n'
+        try:
+            self.line_buffered = outfile.isatty()
+        except (AttributeError, ValueError):
+            self.line_buffered = False
+        if newline_conv:
+            self.textin = io.TextIOWrapper(infile, 'latin-1')
+        self.outbuf = bytearray()
+        self.inbuf = b''
+        self.inpos = 0
+
+    def write(self, x):
+        outbuf = self.outbuf
+        outbuf.append(x)
+        if len(outbuf) >= self.bufsize or x == 10 and self.line_buffered:
+            self.flush()
+
+    def read(self, x):
+        if self.inpos >= len(self.inbuf):
+            # Only block on input once all pending output is visible
+            self.flush()
+            self.inbuf = self.fill()
+            self.inpos = 0
+            if not self.inbuf:
+                return x if self.eof_nochange else 0
+        b = self.inbuf[self.inpos]
+        self.inpos += 1
+        return b
+
+    def fill(self):
+        if self.newline_conv:
+            return self.textin.readline(self.bufsize).encode('latin-1')
+        read1 = getattr(self.infile, 'read1', self.infile.read)
+        return read1(self.bufsize)
+
+    def flush(self):
+        if self.outbuf:
+            data = bytes(self.outbuf)
+            self.outbuf.clear()
+            if self.linesep != b'\n':
+                data = data.replace(b'\n', self.linesep)
+            self.outfile.write(data)
+        self.outfile.flush()
+
+def make_tape(kind='bytearray', size=MEMSIZE, path=None):
+    if kind == 'list':
+        return [0] * size
+    elif kind == 'bytearray':
+        return bytearray(size)
+    elif kind == 'array':
+        return array.array('B', bytes(size))
+    elif kind == 'mmap':
+        # Pages are only allocated once touched, so a huge fixed-size tape
+        # costs nothing up front; a file-backed tape can exceed RAM
+        if path is None:
+            return mmap.mmap(-1, size)
+        with open(path, 'w+b') as f:
+            f.truncate(size)
+            return mmap.mmap(f.fileno(), size)
+    raise ValueError(f'unknown tape kind: {kind}')
+
+def tape_funcs(tape):
+    def grow(n):
+        if isinstance(tape, mmap.mmap):
+            raise IndexError('tape overflow')
+        size = max(len(tape) * 2, n + 1)
+        tape.extend(bytes(size - len(tape)) if not isinstance(tape, list)
+                    else [0] * (size - len(tape)))
+        return len(tape)
+    if isinstance(tape, (bytearray, mmap.mmap)):
+        def find(p):
+            while True:
+                i = tape.find(b'\0', p)
+                if i >= 0:
+                    return i
+                p = len(tape)
+                grow(p)
+    else:
+        def find(p):
+            while True:
+                try:
+                    return tape.index(0, p)
+                except ValueError:
+                    p = len(tape)
+                    grow(p)
+    return grow, find
+
+def run(source, run_length=False, debug=False, newline_conv=False,
+        eof_nochange=False, compiled=False, infile=None, outfile=None,
+        tape='bytearray', memsize=MEMSIZE, tape_path=None):
+    tokens = tokenize(source, run_length, debug)
+    bio = BufferedIO(infile, outfile, newline_conv, eof_nochange)
+    if isinstance(tape, str):
+        tape = make_tape(tape, memsize, tape_path)
+    try:
+        if compiled and not debug:
+            func = compile_bf(tokens)
+            func(tape, 0, bio.read, bio.write, *tape_funcs(tape))
+        else:
+            interpret(tokens, tape, bio, debug)
+    finally:
+        bio.flush()
+
+def interpret(tokens, array, bio, debug=False):
+    read, write = bio.read, bio.write
+    grow = tape_funcs(array)[0]
+    size = len(array)
+    code = []
+    brackets = []
+    for c, repeat in tokens:
+        code.extend(c*repeat)
+        if c == '[':
+            brackets.append(len(code))
+            code.append(-1)
+        elif c == ']':
+            match = brackets.pop()
+            code[match] = len(code)
+            code.append(match)
+
     p = 0
     i = 0
-    if newline_conv:
-        stdin = io.TextIOWrapper(sys.stdin.buffer, 'latin-1')
-        stdout = io.TextIOWrapper(sys.stdout.buffer.raw, 'latin-1',
-                                  write_through=True)
-        chr_ = chr
-    else:
-        stdin, stdout = sys.stdin.buffer, sys.stdout.buffer.raw
-        chr_ = lambda i: bytes([i])
     while i < len(code):
         c = code[i]
         if c == '>':
             p += 1
+            if p >= size:
+                size = grow(p)
         elif c == '<':
             p -= 1
         elif c == '+':
@@ -48,12 +166,9 @@ def run(source, run_length=False, debug=False, newline_conv=False,
         elif c == '-':
             array[p] = (array[p] - 1) & 0xff
         elif c == '.':
-            stdout.write(chr_(array[p]))
-            # stdout.flush()
+            write(array[p])
         elif c == ',':
-            b = stdin.read(1)
-            if b or not eof_nochange:
-                array[p] = ord(b) & 0xff if b else 0
+            array[p] = read(array[p])
         elif c == '[':
             i += 1
             if not array[p]:
@@ -66,17 +181,195 @@ def run(source, run_length=False, debug=False, newline_conv=False,
             if c in ('d', 'D'):
                 imax = next((i for i in range(256)[::-1] if array[i]), 0)
                 end = max(imax + 1, 20)
-                x = array[p]
-                array[p] = Highlighter(x)
+                cells = list(array[:end])
+                if 0 <= p < end:
+                    cells[p] = Highlighter(cells[p])
+                bio.flush()
                 func = input if c == 'D' else print
-                func(f'{p} {array[:end]}')
-                array[p] = x
+                func(f'{p} {cells}')
             elif c == 'p':
+                bio.flush()
                 print(array[p])
             elif c == 'i':
+                bio.flush()
                 array[p] = int(input('i ')) & 0xff
         i += 1
 
+# IR ops:
+#   ('add', n)          add n to the current cell
+#   ('move', n)         move the pointer by n
+#   ('out',) ('in',)    I/O on the current cell
+#   ('loop', body)      generic loop
+#   ('clear',)          [-] or [+]
+#   ('mul', [(d, f)])   [->+++>+<<] style loops: cell[d] += cell*f; cell = 0
+#   ('scan', n)         [>] or [<<] style loops: move by n until a zero cell
+
+def lower(tokens):
+    stack = [[]]
+    for c, n in tokens:
+        ops = stack[-1]
+        if c in '+-':
+            n = n if c == '+' else -n
+            if ops and ops[-1][0] == 'add':
+                n += ops.pop()[1]
+            if n & 0xff:
+                ops.append(('add', n & 0xff))
+        elif c in '><':
+            n = n if c == '>' else -n
+            if ops and ops[-1][0] == 'move':
+                n += ops.pop()[1]
+            if n:
+                ops.append(('move', n))
+        elif c in '.,':
+            ops.extend([('out',) if c == '.' else ('in',)] * n)
+        elif c == '[':
+            for _ in range(n):
+                stack.append([])
+        elif c == ']':
+            for _ in range(n):
+                body = stack.pop()
+                stack[-1].append(optimize_loop(body))
+    if len(stack) != 1:
+        raise SyntaxError('unmatched [')
+    return stack[0]
+
+def optimize_loop(body):
+    if len(body) == 1 and body[0][0] == 'move':
+        return ('scan', body[0][1])
+    if any(op[0] not in ('add', 'move') for op in body):
+        return ('loop', body)
+    deltas = {}
+    off = 0
+    for op, n in body:
+        if op == 'move':
+            off += n
+        else:
+            deltas[off] = (deltas.get(off, 0) + n) & 0xff
+    d0 = deltas.pop(0, 0)
+    if off != 0 or d0 not in (1, 0xff):
+        return ('loop', body)
+    if not any(deltas.values()):
+        return ('clear',)
+    # After k = -cell*d0 iterations each target gains k*f
+    d0 = 1 if d0 == 1 else -1
+    return ('mul', [(d, (-d0 * f) & 0xff) for d, f in deltas.items() if f])
+
+def _cell(off):
+    return f'a[p+{off}]' if off > 0 else f'a[p-{-off}]' if off else 'a[p]'
+
+def max_offset(ops):
+    # Largest positive offset from p accessed between pointer updates
+    off = top = 0
+    for op in ops:
+        if op[0] == 'move':
+            off += op[1]
+        elif op[0] in ('loop', 'scan'):
+            top = max(top, off, max_offset(op[1]) if op[0] == 'loop' else 0)
+            off = 0
+        elif op[0] == 'mul':
+            top = max(top, off, *(off + d for d, f in op[1]))
+        else:
+            top = max(top, off)
+    return max(top, off)
+
+def _move(lines, pad, n, margin):
+    lines.append(f'{pad}p += {n}' if n > 0 else f'{pad}p -= {-n}')
+    if n > 0:
+        lines.append(f'{pad}if p > lim: lim = grow(p + {margin}) - {margin}')
+
+def _gen(ops, lines, indent, depth, funcs, margin):
+    off = 0
+    pad = '    ' * indent
+    for op in ops:
+        kind = op[0]
+        if kind == 'move':
+            off += op[1]
+            continue
+        cell = _cell(off)
+        if kind == 'add':
+            lines.append(f'{pad}{cell} = ({cell} + {op[1]}) & 255')
+        elif kind == 'out':
+            lines.append(f'{pad}write({cell})')
+        elif kind == 'in':
+            lines.append(f'{pad}{cell} = read({cell})')
+        elif kind == 'clear':
+            lines.append(f'{pad}{cell} = 0')
+        elif kind == 'mul':
+            lines.append(f'{pad}v = {cell}')
+            lines.append(f'{pad}if v:')
+            for d, f in op[1]:
+                dst = _cell(off + d)
+                mul = 'v' if f == 1 else f'v*{f}'
+                lines.append(f'{pad}    {dst} = ({dst} + {mul}) & 255')
+            lines.append(f'{pad}    {cell} = 0')
+        else:
+            if off:
+                _move(lines, pad, off, margin)
+                off = 0
+            if kind == 'scan':
+                step = op[1]
+                if step == 1:
+                    lines.append(f'{pad}p = find(p)')
+                    lines.append(f'{pad}if p > lim: '
+                                 f'lim = grow(p + {margin}) - {margin}')
+                else:
+                    lines.append(f'{pad}while a[p]:')
+                    _move(lines, pad + '    ', step, margin)
+            elif depth >= MAX_NESTING:
+                # Python limits statically nested blocks, so hoist deep
+                # loops into their own functions
+                idx = len(funcs)
+                name = f'_loop{idx}'
+                funcs.append(None)
+                flines = [f'def {name}(a, p, read, write, grow, find):',
+                          f'    lim = len(a) - {margin}']
+                _gen([op], flines, 1, 1, funcs, margin)
+                flines.append('    return p')
+                funcs[idx] = '\n'.join(flines)
+                lines.append(f'{pad}p = {name}(a, p, read, write, grow, find)')
+                lines.append(f'{pad}lim = len(a) - {margin}')
+            else:
+                lines.append(f'{pad}while a[p]:')
+                _gen(op[1], lines, indent + 1, depth + 1, funcs, margin)
+    if off:
+        _move(lines, pad, off, margin)
+    if not lines or lines[-1].endswith(':'):
+        lines.append(f'{pad}pass')
+
+def compile_bf(tokens):
+    ops = lower(tokens)
+    # Pointer bounds are only checked when p advances, so keep enough
+    # slack past p for every offset accessed before the next check
+    margin = max_offset(ops) + 1
+    funcs = []
+    lines = ['def _run(a, p, read, write, grow, find):',
+             f'    lim = len(a) - {margin}',
+             f'    if p > lim: lim = grow(p + {margin}) - {margin}']
+    _gen(ops, lines, 1, 1, funcs, margin)
+    lines.append('    return p')
+    ns = {}
+    exec('\n\n'.join(funcs + ['\n'.join(lines)]), ns)
+    return ns['_run']
+
+def bench(source, input=b'', repeat=1, **kwargs):
+    results = {}
+    for compiled in (False, True):
+        best = float('inf')
+        for _ in range(repeat):
+            out = io.BytesIO()
+            start = time.perf_counter()
+            run(source, compiled=compiled, infile=io.BytesIO(input),
+                outfile=out, **kwargs)
+            best = min(best, time.perf_counter() - start)
+        results['compiled' if compiled else 'naive'] = best, out.getvalue()
+    (tn, outn), (tc, outc) = results['naive'], results['compiled']
+    print(f'naive:    {tn:.4f}s')
+    print(f'compiled: {tc:.4f}s')
+    print(f'speedup:  {tn / tc:.1f}x')
+    if outn != outc:
+        print('warning: outputs differ')
+    return results
+
 class Highlighter:
     def __init__(self, x):
         self.x = x
@@ -89,13 +382,29 @@ if __name__ == '__main__':
     p.add_argument('-r', '--run-length', action='store_true')
     p.add_argument('-n', '--newline-conv', action='store_true')
     p.add_argument('-e', '--eof-nochange', action='store_true')
+    p.add_argument('-O', '--compiled', action='store_true')
+    p.add_argument('-t', '--tape', default='bytearray',
+                   choices=['list', 'bytearray', 'array', 'mmap'])
+    p.add_argument('-m', '--memsize', type=lambda s: int(s, 0),
+                   default=MEMSIZE)
+    p.add_argument('--tape-file')
+    p.add_argument('-b', '--bench', action='store_true')
+    p.add_argument('--repeat', type=int, default=1)
     p.add_argument('-c', '--cmd')
     p.add_argument('file', nargs='?', type=argparse.FileType(), default='-')
     args = p.parse_args()
     code = args.cmd or args.file.read()
+    if args.bench:
+        input = b'' if sys.stdin.isatty() else sys.stdin.buffer.read()
+        bench(code, input, args.repeat, run_length=args.run_length,
+              newline_conv=args.newline_conv, eof_nochange=args.eof_nochange,
+              tape=args.tape, memsize=args.memsize, tape_path=args.tape_file)
+        sys.exit()
     try:
         run(code, debug=args.debug, run_length=args.run_length,
-            newline_conv=args.newline_conv, eof_nochange=args.eof_nochange)
+            newline_conv=args.newline_conv, eof_nochange=args.eof_nochange,
+            compiled=args.compiled, tape=args.tape, memsize=args.memsize,
+            tape_path=args.tape_file)
     except (KeyboardInterrupt, BrokenPipeError):
         pass
     except OSError as e:
@@ -1,10 +1,9 @@
 #!/usr/bin/python3
-"""Usage: chess2.pyw [WHITE_CPU=0] [BLACK_CPU=1] [MINIMAX_DEPTH=4]"""
+"""Usage: chess2.pyw [WHITE_CPU=0] [BLACK_CPU=1] [MINIMAX_DEPTH=6]"""
 
-import sys, os, random, threading
+import sys, os, threading
 import pygame as pg
-
-inf = float('inf')
+import chessengine
 
 DEBUG = False
 
@@ -13,10 +12,13 @@ DEBUG = False
 WHITE_CPU = False
 BLACK_CPU = True
 
-### If you set MINIMAX_DEPTH to 5, it will get harder in theory. It will
+### If you set MINIMAX_DEPTH to 7, it will get harder in theory. It will
 ### also get a lot slower.
-### Warning: don't set it higher than 5 or it will take forever. 
-MINIMAX_DEPTH = 4
+### The cpu stops deepening after CPU_THINK_TIME seconds regardless.
+MINIMAX_DEPTH = 6
+CPU_THINK_TIME = 5
+# Search processes, None for one per cpu
+CPU_WORKERS = None
 
 # PyInstaller
 if getattr(sys, 'frozen', False):
@@ -96,6 +98,7 @@ class Game:
         self.font2 = pg.font.Font(FONTFILE, 40)
         self.is_cpu = [white_cpu, black_cpu]
         self.minimax_depth = minimax_depth
+        self.searcher = chessengine.make_searcher(CPU_WORKERS)
         self.title()
         self.running = False
         # self.run()
@@ -117,6 +120,7 @@ class Game:
                 self.draw()
                 pg.display.flip()
             pg.time.wait(TICK)
+        self.searcher.close()
 
     def setup_board(self):
         self.board = board = [[None] * 8 for i in range(8)]
@@ -405,60 +409,16 @@ class Game:
             self.cpu_thread = None
 
     def cpu_move_compute(self):
-        board = [row[:] for row in self.board]
-        max_move, max_score = self.minimax(board, self.turn, self.minimax_depth)
+        pos = chessengine.Position.from_pieces(
+            ((src, piece.side, piece.type)
+             for src, piece in self.enum_pieces()), self.turn)
+        max_move, max_score = self.searcher.search(
+            pos, self.minimax_depth, CPU_THINK_TIME, verbose=DEBUG)
+        max_move = chessengine.move_coords(max_move)
         if DEBUG: print('max move: %s -> %s: %s' % (*max_move, max_score))
         self.cpu_move_result = max_move
         self.cpu_move_complete = True
 
-    def minimax(self, board, turn, depth, alpha=-inf, beta=inf):
-        if depth == 0:
-            return None, self.score_board(board, turn)
-        max_move = None
-        max_score = -inf
-        for src, piece in self.enum_pieces(turn, board):
-            for dest in piece.enum_moves(src, board):
-                if DEBUG and depth == self.minimax_depth:
-                    print('minimax d=%s, %s -> %s: ' % (depth, src, dest), end='', flush=True)
-                score = self.minimax_move(
-                    board, turn, src, dest, depth, alpha, beta)
-                if DEBUG and depth == self.minimax_depth:
-                    print(score)
-                if score > max_score:
-                    max_score = score
-                    max_move = (src, dest)
-                    if max_score > alpha:
-                        alpha = max_score
-                        if alpha >= beta:
-                            return max_move, max_score
-        return max_move, max_score
-
-    def minimax_move(self, board, turn, src, dest, depth, alpha, beta):
-        (sx, sy), (dx, dy) = src, dest
-        src_piece = board[sx][sy]
-        dest_piece = board[dx][dy]
-        if dest_piece and dest_piece.type == KING:
-            # Multiply by depth to weight sooner checks higher
-            return self.score_board(board, turn) + PIECE_VALUES[KING]*depth
-        board[sx][sy] = None
-        board[dx][dy] = src_piece
-        if src_piece.type == PAWN and dy in (0, 7):
-            board[dx][dy] = Piece(src_piece.side, QUEEN)
-        move, score = self.minimax(board, 1 - turn, depth - 1, -beta, -alpha)
-        board[sx][sy] = src_piece
-        board[dx][dy] = dest_piece
-        return -score
-
-    def score_board(self, board, side):
-        score = 0
-        for x in range(8):
-            for y in range(8):
-                piece = board[x][y]
-                if piece:
-                    value = PIECE_VALUES[piece.type]
-                    score += value if piece.side == side else -value
-        return score + random.uniform(-1, 1)
-
     def cpu_promote(self):
         self.promote(QUEEN)
 
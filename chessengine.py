@@ -0,0 +1,640 @@
+#!/usr/bin/env python3
+"""Bitboard move generation and search for chess2.pyw.
+
+Plays by chess2's rules: no castling or en passant, pawns always promote to
+queens, and moves aren't tested for check - the search just scores capturing
+the king as a win.
+"""
+import os, time, random, argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+inf = float('inf')
+
+WHITE = 0
+BLACK = 1
+
+PAWN = 0
+ROOK = 1
+KNIGHT = 2
+BISHOP = 3
+QUEEN = 4
+KING = 5
+
+PIECE_VALUES = [1, 5, 3, 3, 9, 100]
+
+# Transposition table slots (a power of 2)
+TT_SIZE = 1 << 20
+
+# How many nodes between checks of the clock
+CHECK_NODES = 4096
+
+# Entry bounds
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Squares are y*8 + x, rank 0 being white's back rank
+def square(x, y):
+    return y*8 + x
+
+def coords(sq):
+    return sq & 7, sq >> 3
+
+def _targets(deltas):
+    table = []
+    for sq in range(64):
+        x, y = coords(sq)
+        bb = 0
+        for dx, dy in deltas:
+            if 0 <= x + dx < 8 and 0 <= y + dy < 8:
+                bb |= 1 << square(x + dx, y + dy)
+        table.append(bb)
+    return table
+
+KNIGHT_MOVES = _targets([(-1, 2), (1, 2), (2, 1), (2, -1),
+                         (1, -2), (-1, -2), (-2, -1), (-2, 1)])
+KING_MOVES = _targets([(0, 1), (1, 1), (1, 0), (1, -1),
+                       (0, -1), (-1, -1), (-1, 0), (-1, 1)])
+PAWN_CAPTURES = [_targets([(-1, 1), (1, 1)]), _targets([(-1, -1), (1, -1)])]
+
+# The first four directions increase the square index, so the nearest
+# blocker along them is the lowest bit; along the rest it's the highest.
+DIRECTIONS = [(0, 1), (1, 0), (1, 1), (-1, 1),
+              (0, -1), (-1, 0), (-1, -1), (1, -1)]
+ROOK_DIRS = (0, 1, 4, 5)
+BISHOP_DIRS = (2, 3, 6, 7)
+QUEEN_DIRS = tuple(range(8))
+
+def _rays(dx, dy):
+    table = []
+    for sq in range(64):
+        x, y = coords(sq)
+        bb = 0
+        x, y = x + dx, y + dy
+        while 0 <= x < 8 and 0 <= y < 8:
+            bb |= 1 << square(x, y)
+            x, y = x + dx, y + dy
+        table.append(bb)
+    return table
+
+RAYS = [_rays(dx, dy) for dx, dy in DIRECTIONS]
+
+def slide(sq, occ, dirs):
+    attacks = 0
+    for d in dirs:
+        ray = RAYS[d][sq]
+        blockers = ray & occ
+        if blockers:
+            if d < 4:
+                b = (blockers & -blockers).bit_length() - 1
+            else:
+                b = blockers.bit_length() - 1
+            ray ^= RAYS[d][b]
+        attacks |= ray
+    return attacks
+
+SLIDE_DIRS = {ROOK: ROOK_DIRS, BISHOP: BISHOP_DIRS, QUEEN: QUEEN_DIRS}
+
+def bits(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+# Zobrist keys, indexed by side*6 + type then square
+_rng = random.Random(0x5eed)
+ZOBRIST = [[_rng.getrandbits(64) for sq in range(64)] for code in range(12)]
+ZOBRIST_TURN = _rng.getrandbits(64)
+del _rng
+
+
+class Position:
+    """Board as one bitboard per side and piece type, plus a mailbox of
+    piece codes (side*6 + type, or None) for looking up captures."""
+    def __init__(self, turn=WHITE):
+        self.pieces = [[0] * 6, [0] * 6]
+        self.occ = [0, 0]
+        self.squares = [None] * 64
+        self.material = [0, 0]
+        self.turn = turn
+        self.hash = ZOBRIST_TURN if turn else 0
+        self.history = []
+
+    @classmethod
+    def from_pieces(cls, pieces, turn=WHITE):
+        """Build from an iterable of ((x, y), side, type)."""
+        pos = cls(turn)
+        for (x, y), side, typ in pieces:
+            pos.put(square(x, y), side, typ)
+        return pos
+
+    @classmethod
+    def initial(cls):
+        order = [ROOK, KNIGHT, BISHOP, QUEEN, KING, BISHOP, KNIGHT, ROOK]
+        pieces = []
+        for x, typ in enumerate(order):
+            pieces += [((x, 0), WHITE, typ), ((x, 1), WHITE, PAWN),
+                       ((x, 6), BLACK, PAWN), ((x, 7), BLACK, typ)]
+        return cls.from_pieces(pieces)
+
+    def put(self, sq, side, typ):
+        bit = 1 << sq
+        self.pieces[side][typ] |= bit
+        self.occ[side] |= bit
+        self.squares[sq] = side*6 + typ
+        self.material[side] += PIECE_VALUES[typ]
+        self.hash ^= ZOBRIST[side*6 + typ][sq]
+
+    def score(self):
+        """Material balance for the side to move."""
+        return self.material[self.turn] - self.material[1 - self.turn]
+
+    def moves(self):
+        """Pseudo-legal moves for the side to move, as src | dest << 6."""
+        side = self.turn
+        pieces = self.pieces[side]
+        own = self.occ[side]
+        enemy = self.occ[1 - side]
+        occ = own | enemy
+        moves = []
+        for typ in range(6):
+            for src in bits(pieces[typ]):
+                if typ == PAWN:
+                    if side == WHITE:
+                        one = src + 8
+                        first = src < 16
+                    else:
+                        one = src - 8
+                        first = src >= 48
+                    targets = PAWN_CAPTURES[side][src] & enemy
+                    if not occ >> one & 1:
+                        targets |= 1 << one
+                        two = 2*one - src
+                        if first and not occ >> two & 1:
+                            targets |= 1 << two
+                elif typ == KNIGHT:
+                    targets = KNIGHT_MOVES[src] & ~own
+                elif typ == KING:
+                    targets = KING_MOVES[src] & ~own
+                else:
+                    targets = slide(src, occ, SLIDE_DIRS[typ]) & ~own
+                for dest in bits(targets):
+                    moves.append(src | dest << 6)
+        return moves
+
+    def make(self, move):
+        src = move & 63
+        dest = move >> 6
+        side = self.turn
+        code = self.squares[src]
+        captured = self.squares[dest]
+        h = self.hash ^ ZOBRIST_TURN ^ ZOBRIST[code][src]
+        self.history.append((move, code, captured, self.hash))
+        if captured is not None:
+            ctyp = captured - 6*(1 - side)
+            self.pieces[1 - side][ctyp] ^= 1 << dest
+            self.occ[1 - side] ^= 1 << dest
+            self.material[1 - side] -= PIECE_VALUES[ctyp]
+            h ^= ZOBRIST[captured][dest]
+        typ = code - 6*side
+        self.pieces[side][typ] ^= 1 << src
+        self.occ[side] ^= 1 << src | 1 << dest
+        if typ == PAWN and (dest < 8 or dest >= 56):
+            typ = QUEEN
+            code = side*6 + QUEEN
+            self.material[side] += PIECE_VALUES[QUEEN] - PIECE_VALUES[PAWN]
+        self.pieces[side][typ] ^= 1 << dest
+        self.squares[src] = None
+        self.squares[dest] = code
+        self.hash = h ^ ZOBRIST[code][dest]
+        self.turn = 1 - side
+
+    def unmake(self):
+        move, code, captured, self.hash = self.history.pop()
+        src = move & 63
+        dest = move >> 6
+        side = self.turn = 1 - self.turn
+        typ = code - 6*side
+        newtyp = self.squares[dest] - 6*side
+        if newtyp != typ:
+            self.material[side] -= PIECE_VALUES[newtyp] - PIECE_VALUES[typ]
+        self.pieces[side][newtyp] ^= 1 << dest
+        self.pieces[side][typ] ^= 1 << src
+        self.occ[side] ^= 1 << src | 1 << dest
+        self.squares[src] = code
+        self.squares[dest] = captured
+        if captured is not None:
+            ctyp = captured - 6*(1 - side)
+            self.pieces[1 - side][ctyp] |= 1 << dest
+            self.occ[1 - side] |= 1 << dest
+            self.material[1 - side] += PIECE_VALUES[ctyp]
+
+
+def move_coords(move):
+    return coords(move & 63), coords(move >> 6)
+
+def move_name(move):
+    (x1, y1), (x2, y2) = move_coords(move)
+    return 'abcdefgh'[x1] + str(y1 + 1) + 'abcdefgh'[x2] + str(y2 + 1)
+
+
+# FEN piece letters; castling and en passant fields are ignored since
+# chess2 doesn't have either
+FEN_PIECES = 'prnbqk'
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1'
+
+def from_fen(fen):
+    fields = fen.split()
+    ranks = fields[0].split('/')
+    if len(ranks) != 8:
+        raise ValueError('bad FEN: %r' % fen)
+    pieces = []
+    for y, rank in zip(range(7, -1, -1), ranks):
+        x = 0
+        for c in rank:
+            if c.isdigit():
+                x += int(c)
+            elif c.lower() in FEN_PIECES and x < 8:
+                side = BLACK if c.islower() else WHITE
+                pieces.append(((x, y), side, FEN_PIECES.index(c.lower())))
+                x += 1
+            else:
+                raise ValueError('bad FEN: %r' % fen)
+    turn = BLACK if len(fields) > 1 and fields[1] == 'b' else WHITE
+    return Position.from_pieces(pieces, turn)
+
+def to_fen(pos):
+    ranks = []
+    for y in range(7, -1, -1):
+        rank = ''
+        empty = 0
+        for x in range(8):
+            code = pos.squares[square(x, y)]
+            if code is None:
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            c = FEN_PIECES[code % 6]
+            rank += c if code >= 6 else c.upper()
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+    return '%s %s - - 0 1' % ('/'.join(ranks), 'wb'[pos.turn])
+
+
+def perft(pos, depth):
+    """Count move sequences of length depth. Capturing a king ends a game,
+    so those moves count as leaves."""
+    moves = pos.moves()
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    enemy_king = (1 - pos.turn)*6 + KING
+    nodes = 0
+    for move in moves:
+        if pos.squares[move >> 6] == enemy_king:
+            nodes += 1
+            continue
+        pos.make(move)
+        nodes += perft(pos, depth - 1)
+        pos.unmake()
+    return nodes
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Searcher:
+    """Iterative deepening alpha-beta with a transposition table.
+
+    The table is kept between searches, so successive moves of a game reuse
+    each other's work. Entries are (hash, depth, bound, score, move); a slot
+    is overwritten unless it holds a deeper result from the current search.
+    """
+    def __init__(self, tt_size=TT_SIZE):
+        self.tt_mask = tt_size - 1
+        self.tt = [None] * tt_size
+        self.generation = 0
+        self.nodes = 0
+
+    def clear(self):
+        self.tt = [None] * len(self.tt)
+
+    def close(self):
+        pass
+
+    def start(self, depth, time_limit=None, generation=None):
+        self.generation = generation or self.generation + 1
+        self.nodes = 0
+        self.killers = [[None, None] for _ in range(depth + 1)]
+        self.deadline = time_limit and time.perf_counter() + time_limit
+
+    def search(self, pos, depth, time_limit=None, rng=random, verbose=False):
+        """Return (move, score) for the side to move, searching to depth or
+        until time_limit seconds have passed, whichever comes first."""
+        self.start(depth, time_limit)
+        # Shuffling breaks ties between equal moves at random
+        root = pos.moves()
+        rng.shuffle(root)
+        best = None, -inf
+        if not root:
+            return best
+        # Depth 1 always runs to completion so there is a move to return
+        deadline, self.deadline = self.deadline, None
+        for d in range(1, depth + 1):
+            try:
+                result = self.search_root(pos, root, d)
+            except SearchTimeout:
+                break
+            best = result
+            self.deadline = deadline
+            # Search the best move first next time round
+            root.remove(best[0])
+            root.insert(0, best[0])
+            if verbose:
+                print('depth %d: %s -> %s: %s (%d nodes)' %
+                      (d, *move_coords(best[0]), best[1], self.nodes))
+            if best[1] >= PIECE_VALUES[KING]:
+                break
+        return best
+
+    def search_root(self, pos, root, depth):
+        alpha = -inf
+        best = None
+        for move in root:
+            if pos.squares[move >> 6] == (1 - pos.turn)*6 + KING:
+                return move, pos.score() + PIECE_VALUES[KING]*depth
+            pos.make(move)
+            try:
+                score = -self.negamax(pos, depth - 1, -inf, -alpha)
+            finally:
+                pos.unmake()
+            if best is None or score > alpha:
+                best = move
+                alpha = score
+        self.store(pos.hash, depth, EXACT, alpha, best)
+        return best, alpha
+
+    def store(self, key, depth, bound, score, move):
+        i = key & self.tt_mask
+        entry = self.tt[i]
+        if (entry is None or entry[5] != self.generation or
+                entry[1] <= depth):
+            self.tt[i] = (key, depth, bound, score, move, self.generation)
+
+    def negamax(self, pos, depth, alpha, beta):
+        self.nodes += 1
+        if self.deadline and not self.nodes % CHECK_NODES and \
+                time.perf_counter() > self.deadline:
+            raise SearchTimeout
+        if depth == 0:
+            return pos.score()
+
+        key = pos.hash
+        entry = self.tt[key & self.tt_mask]
+        tt_move = None
+        if entry is not None and entry[0] == key:
+            tt_move = entry[4]
+            if entry[1] >= depth:
+                score = entry[3]
+                bound = entry[2]
+                if (bound == EXACT or bound == LOWER and score >= beta or
+                        bound == UPPER and score <= alpha):
+                    return score
+
+        moves = self.order_moves(pos, pos.moves(), tt_move, depth)
+        squares = pos.squares
+        enemy_king = (1 - pos.turn)*6 + KING
+        orig_alpha = alpha
+        best_score = -inf
+        best_move = None
+        for move in moves:
+            if squares[move >> 6] == enemy_king:
+                # Multiply by depth to weight sooner checks higher
+                return pos.score() + PIECE_VALUES[KING]*depth
+            pos.make(move)
+            score = -self.negamax(pos, depth - 1, -beta, -alpha)
+            pos.unmake()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if squares[move >> 6] is None:
+                            killers = self.killers[depth]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                        break
+
+        if best_score <= orig_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.store(key, depth, bound, best_score, best_move)
+        return best_score
+
+    def order_moves(self, pos, moves, tt_move, depth):
+        # Hash move, then captures by most valuable victim / least valuable
+        # attacker, then killers, then the rest
+        squares = pos.squares
+        killers = self.killers[depth]
+        def key(move):
+            if move == tt_move:
+                return -1000
+            victim = squares[move >> 6]
+            if victim is not None:
+                return (-16*PIECE_VALUES[victim % 6] +
+                        PIECE_VALUES[squares[move & 63] % 6])
+            if move == killers[0]:
+                return 1
+            if move == killers[1]:
+                return 2
+            return 3
+        moves.sort(key=key)
+        return moves
+
+
+# Per-process state for ParallelSearcher workers
+_searcher = None
+_alpha = None
+
+def _init_worker(alpha, tt_size):
+    global _searcher, _alpha
+    _searcher = Searcher(tt_size)
+    _alpha = alpha
+
+def _search_move(pos, move, depth, deadline, generation):
+    # Search one root move against the best score any worker has found so
+    # far; returns (move, score, exact, nodes), score None on timeout
+    s = _searcher
+    s.start(depth, deadline and deadline - time.time(), generation)
+    if deadline and time.time() > deadline:
+        return move, None, False, 0
+    alpha = _alpha.value
+    pos.make(move)
+    try:
+        score = -s.negamax(pos, depth - 1, -inf, -alpha)
+    except SearchTimeout:
+        return move, None, False, s.nodes
+    if score > alpha:
+        with _alpha.get_lock():
+            if score > _alpha.value:
+                _alpha.value = score
+    return move, score, score > alpha, s.nodes
+
+
+class ParallelSearcher:
+    """Searcher that splits the root moves across worker processes.
+
+    Each iteration searches the previous best move first to get a bound,
+    then farms out the rest. Workers share alpha through a synchronized
+    value, so a good score found by one narrows everyone else's window.
+    Each worker keeps its own transposition table.
+    """
+    def __init__(self, workers=None, tt_size=TT_SIZE):
+        self.workers = workers or os.cpu_count()
+        self.tt_size = tt_size
+        self.generation = 0
+        self.nodes = 0
+        self.pool = None
+
+    def get_pool(self):
+        # Started on first use and kept for later moves
+        if self.pool is None:
+            self.alpha = mp.Value('d', -inf)
+            self.pool = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(self.alpha, self.tt_size))
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def search(self, pos, depth, time_limit=None, rng=random, verbose=False):
+        """Same as Searcher.search."""
+        pool = self.get_pool()
+        self.nodes = 0
+        deadline = time_limit and time.time() + time_limit
+        root = pos.moves()
+        rng.shuffle(root)
+        best = None, -inf
+        if not root:
+            return best
+        enemy_king = (1 - pos.turn)*6 + KING
+        for move in root:
+            if pos.squares[move >> 6] == enemy_king:
+                return move, pos.score() + PIECE_VALUES[KING]
+        for d in range(1, depth + 1):
+            self.generation += 1
+            self.alpha.value = -inf
+            # Depth 1 always runs to completion so there is a move to return
+            args = d, deadline if d > 1 else None, self.generation
+            first = pool.submit(_search_move, pos, root[0], *args).result()
+            futures = [pool.submit(_search_move, pos, move, *args)
+                       for move in root[1:]]
+            results = [first] + [f.result() for f in futures]
+            self.nodes += sum(r[3] for r in results)
+            if any(r[1] is None for r in results):
+                break
+            # A fail-low score is only an upper bound, so on a tie prefer
+            # the exact one
+            move, score, exact, nodes = max(results, key=lambda r: r[1:3])
+            best = move, score
+            root.remove(move)
+            root.insert(0, move)
+            if verbose:
+                print('depth %d: %s -> %s: %s (%d nodes)' %
+                      (d, *move_coords(move), score, self.nodes))
+            if score >= PIECE_VALUES[KING]:
+                break
+        return best
+
+
+def make_searcher(workers=None, tt_size=TT_SIZE):
+    """Searcher for the given number of processes, None for one per cpu."""
+    if (workers or os.cpu_count()) == 1:
+        return Searcher(tt_size)
+    return ParallelSearcher(workers, tt_size)
+
+
+BENCH_FENS = [
+    START_FEN,
+    'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w - - 4 4',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w - - 0 1',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+]
+
+def bench(fens=BENCH_FENS, perft_depth=3, search_depth=5, workers=1,
+          time_limit=None):
+    print(f'{"test":>6} {"depth":>5} {"nodes":>10} {"secs":>8} '
+          f'{"nodes/s":>10}  {"best":>5}  fen')
+    searcher = make_searcher(workers)
+    results = []
+    try:
+        for fen in fens:
+            pos = from_fen(fen)
+            tests = []
+            if perft_depth:
+                tests.append(('perft', perft_depth))
+            if search_depth:
+                tests.append(('search', search_depth))
+            for test, depth in tests:
+                best = None
+                t = time.perf_counter()
+                if test == 'perft':
+                    nodes = perft(pos, depth)
+                else:
+                    if isinstance(searcher, Searcher):
+                        searcher.clear()
+                    best, score = searcher.search(pos, depth, time_limit,
+                                                  random.Random(0))
+                    nodes = searcher.nodes
+                elapsed = time.perf_counter() - t
+                nps = nodes / elapsed if elapsed else inf
+                name = move_name(best) if best is not None else '-'
+                results.append({'test': test, 'depth': depth, 'fen': fen,
+                                'nodes': nodes, 'seconds': elapsed,
+                                'nodes_per_sec': nps, 'best': name})
+                print(f'{test:>6} {depth:>5} {nodes:>10} {elapsed:>8.3f} '
+                      f'{nps:>10.0f}  {name:>5}  {fen}')
+    finally:
+        searcher.close()
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='headless perft and search benchmarks for chess2')
+    p.add_argument('-p', '--perft', type=int, default=3, metavar='DEPTH',
+                   help='perft depth, 0 to skip')
+    p.add_argument('-s', '--search', type=int, default=5, metavar='DEPTH',
+                   help='search depth, 0 to skip')
+    p.add_argument('-j', '--jobs', type=int, default=1,
+                   help='search processes, 0 for one per cpu')
+    p.add_argument('-t', '--time', type=float, help='search time limit')
+    p.add_argument('-f', '--file', help='file of FENs, one per line')
+    p.add_argument('fens', nargs='*', metavar='FEN')
+    args = p.parse_args()
+    fens = args.fens
+    if args.file:
+        with open(args.file) as f:
+            fens += [line.strip() for line in f if line.strip()]
+    try:
+        for fen in fens:
+            from_fen(fen)
+    except ValueError as e:
+        p.error(e)
+    bench(fens or BENCH_FENS, args.perft, args.search, args.jobs or None,
+          args.time)
+
+if __name__ == '__main__':
+    main()
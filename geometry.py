@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 # Invert float or vector; return signed infinity for +-0
 def inv(x):
@@ -177,6 +178,41 @@ class Ray:
         return 'Ray(%r, %r)' % (self.o, self.d)
 
 
+def _array3(x):
+    return np.asarray([tuple(v) for v in x] if isinstance(x, (list, tuple))
+                      and x and isinstance(x[0], Vec3) else x, float)
+
+
+class RayBatch:
+    # N rays as (N, 3) origin and direction arrays
+    def __init__(self, o, d, unit=True):
+        d = _array3(d)
+        self.o = np.broadcast_to(_array3(o), d.shape).copy()
+        if unit:
+            norm = np.linalg.norm(d, axis=-1, keepdims=True)
+            d = d / np.where(norm, norm, 1)
+        self.d = d
+
+    @classmethod
+    def from_rays(cls, rays):
+        return cls([tuple(r.o) for r in rays], [tuple(r.d) for r in rays],
+                   unit=False)
+
+    def __len__(self):
+        return len(self.d)
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            return Ray(self.o[index], self.d[index], unit=False)
+        return RayBatch(self.o[index], self.d[index], unit=False)
+
+    def __call__(self, t):
+        return self.o + self.d*np.asarray(t)[..., None]
+
+    def __repr__(self):
+        return 'RayBatch(%d rays)' % len(self)
+
+
 class Sphere:
     def __init__(self, c, r):
         self.c = Vec3(c)
@@ -199,6 +235,10 @@ class Sphere:
             return (d_oc + root)/d_d
         return -1.
 
+    def intersect_many(self, rays):
+        return _spheres_t(rays.o, rays.d, _array3([self.c]),
+                          np.array([self.r]))[:, 0]
+
 
 class Plane:
     def __init__(self, n, d, unit=True):
@@ -214,6 +254,10 @@ class Plane:
         t = (self.d - ray.o.dot(self.n)) / d_n
         return t if t >= 0 else -1.
 
+    def intersect_many(self, rays):
+        return _planes_t(rays.o, rays.d, _array3([self.n]),
+                         np.array([self.d]))[:, 0]
+
 
 class Triangle:
     def __init__(self, v1, v2, v3):
@@ -240,6 +284,10 @@ class Triangle:
             return -1.
         return t
 
+    def intersect_many(self, rays):
+        return _triangles_t(rays.o, rays.d, _array3([self.v1]),
+                            _array3([self.v2]), _array3([self.v3]))[:, 0]
+
 
 class BBox:
     def __init__(self, p1, p2):
@@ -269,3 +317,346 @@ class BBox:
         if tmin > tmax or tmax < 0.: return -1.
         if tmin < 0.: return tmax # or 0
         return tmin
+
+    def intersect_many(self, rays):
+        return _bboxes_t(rays.o, rays.d, _array3([self.p1]),
+                         _array3([self.p2]))[:, 0]
+
+
+# Batched versions of the intersect methods: N rays against K primitives
+# of one type at once, giving an (N, K) array of t with -1 for misses
+
+def _dot(a, b):
+    return np.einsum('...i,...i->...', a, b)
+
+def _spheres_t(o, d, c, r):
+    oc = c[None] - o[:, None]
+    d_oc = _dot(d[:, None], oc)
+    d_d = _dot(d, d)[:, None]
+    disc = d_oc**2 - d_d*(_dot(oc, oc) - r**2)
+    root = np.sqrt(np.maximum(disc, 0))
+    t = np.where(d_oc - root >= 0, d_oc - root, d_oc + root) / d_d
+    return np.where((disc >= 0) & (d_oc + root >= 0), t, -1.)
+
+def _planes_t(o, d, n, dist):
+    d_n = d @ n.T + 1e-20
+    t = (dist - o @ n.T) / d_n
+    return np.where(t >= 0, t, -1.)
+
+def _triangles_t(o, d, v1, v2, v3):
+    n = np.cross(v2 - v1, v3 - v1)
+    d_n = d @ n.T + 1e-20
+    ov1, ov2, ov3 = (v[None] - o[:, None] for v in (v1, v2, v3))
+    dd = d[:, None]
+    inside = ((_dot(np.cross(ov1, ov2), dd) * d_n >= 0.) &
+              (_dot(np.cross(ov2, ov3), dd) * d_n >= 0.) &
+              (_dot(np.cross(ov3, ov1), dd) * d_n >= 0.))
+    t = _dot(n[None], ov1) / d_n
+    return np.where(inside & (t >= 0), t, -1.)
+
+def _bboxes_t(o, d, p1, p2):
+    dinv = (1 / (d + 1e-20))[:, None]
+    t1 = (p1[None] - o[:, None])*dinv
+    t2 = (p2[None] - o[:, None])*dinv
+    tmin = np.minimum(t1, t2).max(-1)
+    tmax = np.maximum(t1, t2).min(-1)
+    t = np.where(tmin < 0., tmax, tmin)
+    return np.where((tmin > tmax) | (tmax < 0.), -1., t)
+
+
+class Scene:
+    """Primitives packed into arrays per type for batched ray casting.
+
+    intersect tests every ray against every primitive of each type at once,
+    in chunks of rays so the (rays, primitives) arrays stay under
+    CHUNK_SIZE elements.
+    """
+    CHUNK_SIZE = 1 << 22
+
+    def __init__(self, primitives=()):
+        self.primitives = []
+        for p in primitives:
+            self.add(p)
+
+    def add(self, prim):
+        if not isinstance(prim, (Sphere, Plane, Triangle, BBox)):
+            raise TypeError('unsupported primitive: %r' % (prim,))
+        self.primitives.append(prim)
+        self._packed = None
+
+    def __len__(self):
+        return len(self.primitives)
+
+    def __repr__(self):
+        return 'Scene(%r)' % self.primitives
+
+    def pack(self):
+        # (intersect function, argument arrays, primitive indices) per type
+        if self._packed is None:
+            fields = {Sphere: (_spheres_t, ('c', 'r')),
+                      Plane: (_planes_t, ('n', 'd')),
+                      Triangle: (_triangles_t, ('v1', 'v2', 'v3')),
+                      BBox: (_bboxes_t, ('p1', 'p2'))}
+            self._packed = []
+            for typ, (func, names) in fields.items():
+                index = [i for i, p in enumerate(self.primitives)
+                         if type(p) is typ]
+                if not index:
+                    continue
+                prims = [self.primitives[i] for i in index]
+                args = [_array3([getattr(p, name) for p in prims])
+                        if isinstance(getattr(prims[0], name), Vec3) else
+                        np.array([getattr(p, name) for p in prims], float)
+                        for name in names]
+                self._packed.append((func, args, np.array(index)))
+        return self._packed
+
+    def intersect(self, rays):
+        """Nearest hit of each ray: arrays of t (-1 for a miss) and index
+        into self.primitives (-1 for a miss)."""
+        n = len(rays)
+        best_t = np.full(n, np.inf)
+        best_i = np.full(n, -1)
+        for func, args, index in self.pack():
+            step = max(1, self.CHUNK_SIZE // len(index))
+            for start in range(0, n, step):
+                chunk = slice(start, start + step)
+                t = func(rays.o[chunk], rays.d[chunk], *args)
+                t = np.where(t >= 0, t, np.inf)
+                k = t.argmin(1)
+                tk = t[np.arange(len(k)), k]
+                closer = tk < best_t[chunk]
+                best_t[chunk] = np.where(closer, tk, best_t[chunk])
+                best_i[chunk] = np.where(closer, index[k], best_i[chunk])
+        best_t[best_i < 0] = -1.
+        return best_t, best_i
+
+
+def _prim_bounds(prim):
+    if isinstance(prim, Sphere):
+        c = np.array(tuple(prim.c))
+        return c - prim.r, c + prim.r
+    if isinstance(prim, Triangle):
+        v = _array3([prim.v1, prim.v2, prim.v3])
+        return v.min(0), v.max(0)
+    if isinstance(prim, BBox):
+        p = _array3([prim.p1, prim.p2])
+        return p.min(0), p.max(0)
+    raise TypeError('unbounded primitive: %r' % (prim,))
+
+def _area(lo, hi):
+    # Surface area of boxes, 0 for empty ones (lo > hi)
+    e = np.maximum(hi - lo, 0)
+    return 2*(e[..., 0]*e[..., 1] + e[..., 1]*e[..., 2] + e[..., 2]*e[..., 0])
+
+
+class BVH:
+    """Bounding volume hierarchy over a list of primitives.
+
+    Built top down with the binned surface area heuristic and stored as
+    flat arrays in depth first order: node i has bounds lo[i], hi[i]; an
+    inner node's children are i+1 and right[i], a leaf's primitives are
+    self.order[start[i]:start[i]+count[i]]. Planes have no bounds, so they
+    are kept aside and tested against every ray.
+
+    intersect and occluded take either a Ray or a RayBatch.
+    """
+    LEAF_SIZE = 4
+    BINS = 16
+
+    def __init__(self, primitives, leaf_size=LEAF_SIZE):
+        self.primitives = list(primitives)
+        self.leaf_size = leaf_size
+        self.planes = [i for i, p in enumerate(self.primitives)
+                       if isinstance(p, Plane)]
+        bounded = np.array([i for i, p in enumerate(self.primitives)
+                            if not isinstance(p, Plane)], int)
+        bounds = [_prim_bounds(self.primitives[i]) for i in bounded]
+        lo = np.array([b[0] for b in bounds]).reshape(-1, 3)
+        hi = np.array([b[1] for b in bounds]).reshape(-1, 3)
+        self._build(bounded, lo, hi)
+        self._pack()
+
+    def __len__(self):
+        return len(self.primitives)
+
+    def __repr__(self):
+        return 'BVH(%d primitives, %d nodes)' % (len(self), len(self.lo))
+
+    def _build(self, prims, lo, hi):
+        cent = (lo + hi) / 2
+        nodes = []
+        order = []
+        stack = [(np.arange(len(prims)), -1)]
+        while stack:
+            p, parent = stack.pop()
+            i = len(nodes)
+            if parent >= 0:
+                nodes[parent][3] = i
+            node = [lo[p].min(0) if len(p) else np.zeros(3),
+                    hi[p].max(0) if len(p) else np.zeros(3),
+                    0, -1, len(order), 0]
+            nodes.append(node)
+            split = None
+            if len(p) > self.leaf_size:
+                split = self._split(p, lo, hi, cent)
+            if split is None:
+                order.extend(prims[p])
+                node[5] = len(p)
+            else:
+                left, right, node[2] = split
+                # Left child comes straight after its parent
+                stack.append((right, i))
+                stack.append((left, -1))
+        self.lo = np.array([n[0] for n in nodes])
+        self.hi = np.array([n[1] for n in nodes])
+        self.axis = np.array([n[2] for n in nodes])
+        self.right = np.array([n[3] for n in nodes])
+        self.start = np.array([n[4] for n in nodes])
+        self.count = np.array([n[5] for n in nodes])
+        self.order = np.array(order, int)
+
+    def _split(self, p, lo, hi, cent):
+        # Cheapest binned SAH split over all three axes
+        c = cent[p]
+        cmin, cmax = c.min(0), c.max(0)
+        plo, phi = lo[p], hi[p]
+        n = len(p)
+        bins = self.BINS
+        best = None
+        for axis in range(3):
+            extent = cmax[axis] - cmin[axis]
+            if extent <= 0:
+                continue
+            b = ((c[:, axis] - cmin[axis]) * (bins / extent)).astype(int)
+            np.minimum(b, bins - 1, out=b)
+            counts = np.bincount(b, minlength=bins)
+            full = counts > 0
+            sort = np.argsort(b, kind='stable')
+            starts = (np.cumsum(counts) - counts)[full]
+            blo = np.full((bins, 3), np.inf)
+            bhi = np.full((bins, 3), -np.inf)
+            blo[full] = np.minimum.reduceat(plo[sort], starts)
+            bhi[full] = np.maximum.reduceat(phi[sort], starts)
+            nleft = np.cumsum(counts)[:-1]
+            cost = (_area(np.minimum.accumulate(blo)[:-1],
+                          np.maximum.accumulate(bhi)[:-1]) * nleft +
+                    _area(np.minimum.accumulate(blo[::-1])[::-1][1:],
+                          np.maximum.accumulate(bhi[::-1])[::-1][1:]) *
+                    (n - nleft))
+            cost[(nleft == 0) | (nleft == n)] = np.inf
+            k = int(cost.argmin())
+            if cost[k] < np.inf and (best is None or cost[k] < best[0]):
+                best = cost[k], axis, b <= k
+        if best is None:
+            # All centroids coincide: just halve the list
+            return p[:n//2], p[n//2:], 0
+        cost, axis, mask = best
+        return p[mask], p[~mask], axis
+
+    def _pack(self):
+        # Leaf primitives grouped by type as arrays for the batched tests
+        prims = self.primitives
+        self._lists = (self.lo.tolist(), self.hi.tolist(), self.axis.tolist(),
+                       self.right.tolist(), self.start.tolist(),
+                       self.count.tolist(), self.order.tolist())
+        self._leaves = {}
+        for i in np.flatnonzero(self.count):
+            index = self.order[self.start[i]:self.start[i] + self.count[i]]
+            self._leaves[i] = Scene([prims[j] for j in index]).pack()
+            for group in self._leaves[i]:
+                group[2][:] = index[group[2]]
+        self._planes = (Scene([prims[j] for j in self.planes]).pack()
+                        if self.planes else [])
+        for group in self._planes:
+            group[2][:] = np.array(self.planes)[group[2]]
+
+    def intersect(self, ray):
+        """Nearest hit: (t, primitive index), or -1 for both on a miss.
+        For a RayBatch, arrays of them."""
+        if isinstance(ray, RayBatch):
+            return self._traverse_many(ray)
+        return self._traverse(ray)
+
+    def occluded(self, ray, tmax=math.inf):
+        """Whether anything is hit before distance tmax."""
+        if isinstance(ray, RayBatch):
+            return self._traverse_many(ray, True, tmax)[1] >= 0
+        return self._traverse(ray, True, tmax)[1] >= 0
+
+    def _traverse(self, ray, any_hit=False, tmax=math.inf):
+        lo, hi, axis, right, start, count, order = self._lists
+        prims = self.primitives
+        ox, oy, oz = ray.o
+        d = tuple(ray.d)
+        ix, iy, iz = (1 / (x + 1e-20) for x in d)
+        best_t, best = tmax, -1
+        for j in self.planes:
+            t = prims[j].intersect(ray)
+            if 0 <= t < best_t:
+                best_t, best = t, j
+                if any_hit:
+                    return best_t, best
+        stack = [0] if len(lo) else []
+        while stack:
+            i = stack.pop()
+            (x1, y1, z1), (x2, y2, z2) = lo[i], hi[i]
+            tx1, tx2 = (x1 - ox)*ix, (x2 - ox)*ix
+            ty1, ty2 = (y1 - oy)*iy, (y2 - oy)*iy
+            tz1, tz2 = (z1 - oz)*iz, (z2 - oz)*iz
+            tnear = max(min(tx1, tx2), min(ty1, ty2), min(tz1, tz2))
+            tfar = min(max(tx1, tx2), max(ty1, ty2), max(tz1, tz2))
+            if tnear > tfar or tfar < 0 or tnear >= best_t:
+                continue
+            n = count[i]
+            if n:
+                for j in order[start[i]:start[i] + n]:
+                    t = prims[j].intersect(ray)
+                    if 0 <= t < best_t:
+                        best_t, best = t, j
+                        if any_hit:
+                            return best_t, best
+            elif d[axis[i]] >= 0:
+                stack += (right[i], i + 1)
+            else:
+                stack += (i + 1, right[i])
+        return (best_t if best >= 0 else -1.), best
+
+    def _traverse_many(self, rays, any_hit=False, tmax=math.inf):
+        # Depth first over nodes, carrying the subset of rays still alive
+        o, d = rays.o, rays.d
+        dinv = 1 / (d + 1e-20)
+        best_t = np.full(len(rays), float(tmax))
+        best = np.full(len(rays), -1)
+
+        def test(groups, r):
+            for func, args, index in groups:
+                t = func(o[r], d[r], *args)
+                t = np.where(t >= 0, t, np.inf)
+                k = t.argmin(1)
+                tk = t[np.arange(len(r)), k]
+                hit = tk < best_t[r]
+                best_t[r[hit]] = tk[hit]
+                best[r[hit]] = index[k[hit]]
+
+        test(self._planes, np.arange(len(rays)))
+        stack = [(0, np.arange(len(rays)))] if len(self.lo) else []
+        while stack:
+            i, r = stack.pop()
+            if any_hit:
+                r = r[best[r] < 0]
+            t1 = (self.lo[i] - o[r]) * dinv[r]
+            t2 = (self.hi[i] - o[r]) * dinv[r]
+            tnear = np.minimum(t1, t2).max(1)
+            tfar = np.maximum(t1, t2).min(1)
+            r = r[(tnear <= tfar) & (tfar >= 0) & (tnear < best_t[r])]
+            if not len(r):
+                continue
+            if self.count[i]:
+                test(self._leaves[i], r)
+            elif d[r, self.axis[i]].sum() >= 0:
+                stack += ((self.right[i], r), (i + 1, r))
+            else:
+                stack += ((i + 1, r), (self.right[i], r))
+        best_t[best < 0] = -1.
+        return best_t, best
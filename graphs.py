@@ -1,4 +1,5 @@
-import collections, heapq, math
+import collections, heapq, math, array, time, argparse
+import numpy as np
 
 def _func1(f, default=None):
     if default is not None and isinstance(f, dict):
@@ -27,6 +28,8 @@ def get_path(s, t, pred):
     return path[::-1]
 
 def bfs_all(adj, s):
+    if isinstance(adj, CSRGraph):
+        return _csr_bfs(adj, adj.id(s))
     adj = _func1(adj, ())
     q = collections.deque([s])
     d = {s: 0}
@@ -43,6 +46,11 @@ def bfs_all(adj, s):
     return d, pred
 
 def bfs(adj, s, t):
+    if isinstance(adj, GridGraph):
+        return adj.bfs(s, t)
+    if isinstance(adj, CSRGraph):
+        d, pred = _csr_bfs(adj, adj.id(s), adj.id(t))
+        return _csr_result(adj, d, pred, adj.id(s), adj.id(t), -1)
     adj = _func1(adj, ())
     q = collections.deque([s])
     d = {s: 0}
@@ -62,6 +70,8 @@ def bfs(adj, s, t):
 
 
 def dijkstra_all(adj, w, s):
+    if isinstance(adj, CSRGraph):
+        return _csr_dijkstra(adj, adj.weigh(w), adj.id(s))
     adj = _func1(adj, ())
     w = _func2(w)
     q = [(0, s)]
@@ -84,6 +94,9 @@ def dijkstra_all(adj, w, s):
     return d, pred
 
 def dijkstra(adj, w, s, t):
+    if isinstance(adj, CSRGraph):
+        d, pred = _csr_dijkstra(adj, adj.weigh(w), adj.id(s), adj.id(t))
+        return _csr_result(adj, d, pred, adj.id(s), adj.id(t))
     adj = _func1(adj, ())
     w = _func2(w)
     q = [(0, s)]
@@ -123,8 +136,15 @@ l2_dist = euclidean_dist
 l_inf_dist = chebyshev_dist
 
 def a_star(adj, w, s, t, h=manhattan_dist):
+    if isinstance(adj, GridGraph):
+        return adj.a_star(s, t)
+    if isinstance(adj, CSRGraph):
+        d, pred = _csr_a_star(adj, adj.weigh(w), adj.id(s), adj.id(t), h)
+        return _csr_result(adj, d, pred, adj.id(s), adj.id(t))
     adj = _func1(adj, ())
     w = _func2(w)
+    if isinstance(h, Landmarks):
+        h = h.bound
     f = {s: h(s, t)}
     g = {s: 0}
     q = [(f[s], g[s], s)]
@@ -150,7 +170,91 @@ def a_star(adj, w, s, t, h=manhattan_dist):
     return None, None
 
 
-def max_flow(adj, cap, s, t):
+def bidirectional_dijkstra(adj, w, s, t, radj=None):
+    return bidirectional_a_star(adj, w, s, t, None, radj)
+
+def bidirectional_a_star(adj, w, s, t, h=manhattan_dist, radj=None):
+    # Searches forward from s over adj and backward from t over radj
+    # (default adj, i.e. undirected). Both use the average potential
+    # (h(v, t) - h(s, v))/2, so a vertex's keys in the two directions add
+    # up to the length of the path through it.
+    if isinstance(adj, CSRGraph):
+        s, t = adj.id(s), adj.id(t)
+        d, pred, meet = _csr_bidirectional(adj, adj.weigh(w), s, t, h)
+        if meet is None:
+            return None, None
+        path = get_path(s, meet, pred[0].tolist())
+        path += get_path(t, meet, pred[1].tolist())[-2::-1]
+        return (d[0][meet] + d[1][meet]).item(), [adj.label(v) for v in path]
+    adjs = _func1(adj, ()), _func1(adj if radj is None else radj, ())
+    w = _func2(w)
+    if isinstance(h, Landmarks):
+        h = h.bound
+    if h is None:
+        p = lambda v: 0
+    else:
+        p = lambda v: (h(v, t) - h(s, v)) / 2
+    d = {s: 0}, {t: 0}
+    pred = {s: None}, {t: None}
+    seen = set(), set()
+    q = [(p(s), s)], [(-p(t), t)]
+    mu = math.inf
+    meet = None
+    while q[0] and q[1] and q[0][0][0] + q[1][0][0] < mu:
+        side = 1 if q[1][0][0] < q[0][0][0] else 0
+        sign = -1 if side else 1
+        ku, u = heapq.heappop(q[side])
+        if u in seen[side]:
+            continue
+        seen[side].add(u)
+        du = d[side][u]
+        other = d[1 - side]
+        for v in adjs[side](u):
+            if v in seen[side]:
+                continue
+            dv = du + (w(v, u) if side else w(u, v))
+            if dv < d[side].get(v, math.inf):
+                d[side][v] = dv
+                pred[side][v] = u
+                heapq.heappush(q[side], (dv + sign*p(v), v))
+                if v in other and dv + other[v] < mu:
+                    mu = dv + other[v]
+                    meet = v
+        if u in other and du + other[u] < mu:
+            mu = du + other[u]
+            meet = u
+    if meet is None:
+        return None, None
+    path = get_path(s, meet, pred[0]) + get_path(t, meet, pred[1])[-2::-1]
+    return mu, path
+
+
+MAX_FLOW_METHODS = ('dinic', 'push_relabel', 'edmonds_karp')
+
+def max_flow(adj, cap, s, t, method='dinic', cut=False):
+    # With cut=True also returns the source side of a minimum cut: the
+    # vertices still reachable from s in the residual graph
+    if method not in MAX_FLOW_METHODS:
+        raise ValueError(f'unknown max flow method: {method!r}')
+    if isinstance(adj, CSRGraph):
+        return _csr_max_flow(adj, adj.weigh(cap, 0), adj.id(s), adj.id(t),
+                             method, cut)
+    if method != 'edmonds_karp' or cut:
+        g, capw = _flow_graph(adj, cap, s)
+        if t not in g.index:
+            return (0, {}, set(g.vertices)) if cut else (0, {})
+        maxf, f, side = _csr_max_flow(g, capw, 0, g.id(t), method, True)
+        flow = {}
+        for u, v, x in zip(g.sources().tolist(), g.targets.tolist(),
+                           f.tolist()):
+            if x:
+                u, v = g.vertices[u], g.vertices[v]
+                x += flow.get((u, v), 0)
+                flow[u, v] = x
+                flow[v, u] = -x
+        if cut:
+            return maxf, flow, {g.vertices[v] for v in np.flatnonzero(side)}
+        return maxf, flow
     adj = _func1(adj, ())
     cap = _func2(cap, default=0)
     maxf = 0
@@ -166,6 +270,30 @@ def max_flow(adj, cap, s, t):
         path = aug_path(adj, cap, flow, s, t)
     return maxf, flow
 
+def _flow_graph(adj, cap, s):
+    # The part of the network reachable from s as a CSRGraph, s being 0
+    adj = _func1(adj, ())
+    cap = _func2(cap, default=0)
+    index = {s: 0}
+    vertices = [s]
+    sources, targets = [], []
+    q = collections.deque([s])
+    while q:
+        u = q.popleft()
+        for v in adj(u):
+            if v not in index:
+                index[v] = len(vertices)
+                vertices.append(v)
+                q.append(v)
+            sources.append(index[u])
+            targets.append(index[v])
+    caps = np.array([cap(vertices[u], vertices[v])
+                     for u, v in zip(sources, targets)])
+    g = CSRGraph.from_edges(sources, targets, n=len(vertices),
+                            vertices=vertices)
+    order = np.argsort(sources, kind='stable')
+    return g, caps[order] if len(caps) else np.zeros(0)
+
 def aug_path(adj, cap, flow, s, t):
     q = collections.deque([s])
     pred = {s: None}
@@ -225,3 +353,962 @@ def moore_neighborhood(v=None, width=None, height=None):
 
 four_neighborhood = von_neumann_neighborhood
 eight_neighborhood = moore_neighborhood
+
+
+
+class CSRGraph:
+    """Directed graph in compressed sparse row form.
+
+    Vertices are the integers 0..n-1; the edges out of u are
+    targets[offsets[u]:offsets[u+1]], with matching weights. If the graph
+    was built from arbitrary vertex labels, vertices maps ids back to them
+    and s, t and paths use the labels. The algorithms above return dense
+    arrays indexed by id for these: distances (-1 or inf if unreached) and
+    predecessors (-1 for none).
+    """
+    def __init__(self, offsets, targets, weights=None, vertices=None):
+        self.offsets = np.ascontiguousarray(offsets, np.int64)
+        self.targets = np.ascontiguousarray(targets, np.int64)
+        self.weights = (None if weights is None else
+                        np.ascontiguousarray(weights, np.float64))
+        self.vertices = vertices
+        self.index = (None if vertices is None else
+                      {v: i for i, v in enumerate(vertices)})
+
+    @classmethod
+    def from_edges(cls, sources, targets, weights=None, n=None,
+                   directed=True, vertices=None):
+        sources = np.asarray(sources, np.int64)
+        targets = np.asarray(targets, np.int64)
+        if weights is not None:
+            weights = np.broadcast_to(np.asarray(weights, np.float64),
+                                      sources.shape)
+        if not directed:
+            sources, targets = (np.concatenate([sources, targets]),
+                                np.concatenate([targets, sources]))
+            if weights is not None:
+                weights = np.concatenate([weights, weights])
+        if n is None:
+            n = len(vertices) if vertices is not None else int(
+                max(sources.max(initial=-1), targets.max(initial=-1)) + 1)
+        order = np.argsort(sources, kind='stable')
+        offsets = np.zeros(n + 1, np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+        return cls(offsets, targets[order],
+                   None if weights is None else weights[order], vertices)
+
+    @classmethod
+    def from_adj(cls, adj, w=None):
+        """From a list of neighbor lists (matrix_to_adj_list) or a dict of
+        neighbor sets (edges_to_adj), weighted by w if given."""
+        if isinstance(adj, dict):
+            vertices = list(adj)
+            index = {v: i for i, v in enumerate(vertices)}
+            for nbrs in adj.values():
+                for v in nbrs:
+                    if v not in index:
+                        index[v] = len(vertices)
+                        vertices.append(v)
+            items = adj.items()
+        else:
+            vertices = index = None
+            items = enumerate(adj)
+        sources, targets = [], []
+        for u, nbrs in items:
+            for v in nbrs:
+                sources.append(u)
+                targets.append(v)
+        weights = None
+        if w is not None:
+            w = _func2(w)
+            weights = [w(u, v) for u, v in zip(sources, targets)]
+        if index is not None:
+            sources = [index[u] for u in sources]
+            targets = [index[v] for v in targets]
+        return cls.from_edges(sources, targets, weights,
+                              len(vertices) if vertices else len(adj),
+                              vertices=vertices)
+
+    @classmethod
+    def from_matrix(cls, mat):
+        """From an adjacency matrix, using its nonzero entries as weights."""
+        mat = np.asarray(mat)
+        sources, targets = np.nonzero(mat)
+        return cls.from_edges(sources, targets, mat[sources, targets],
+                              len(mat))
+
+    @property
+    def n(self):
+        return len(self.offsets) - 1
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def nedges(self):
+        return len(self.targets)
+
+    def __repr__(self):
+        return f'<CSRGraph n={self.n} nedges={self.nedges}>'
+
+    def id(self, v):
+        return v if self.index is None else self.index[v]
+
+    def label(self, i):
+        return i if self.vertices is None else self.vertices[i]
+
+    def neighbors(self, u):
+        return self.targets[self.offsets[u]:self.offsets[u+1]]
+
+    def sources(self):
+        return np.repeat(np.arange(self.n), np.diff(self.offsets))
+
+    def weigh(self, w=None, default=None):
+        """Edge weights as an array: the graph's own if w is None,
+        otherwise w evaluated on every edge's labels."""
+        if w is None:
+            if self.weights is None:
+                return np.ones(self.nedges)
+            return self.weights
+        if isinstance(w, np.ndarray) and w.shape == self.targets.shape:
+            return np.ascontiguousarray(w, np.float64)
+        w = _func2(w, default)
+        sources = map(self.label, self.sources().tolist())
+        targets = map(self.label, self.targets.tolist())
+        return np.fromiter(map(w, sources, targets), np.float64,
+                           self.nedges)
+
+    def reverse(self):
+        """The graph with every edge reversed. Its edges attribute gives
+        the index of each edge in this graph."""
+        if getattr(self, '_reverse', None) is None:
+            order = np.argsort(self.targets, kind='stable')
+            offsets = np.zeros(self.n + 1, np.int64)
+            np.cumsum(np.bincount(self.targets, minlength=self.n),
+                      out=offsets[1:])
+            self._reverse = rg = CSRGraph(
+                offsets, self.sources()[order],
+                None if self.weights is None else self.weights[order],
+                self.vertices)
+            rg.index = self.index
+            rg.edges = order
+        return self._reverse
+
+
+
+class Landmarks:
+    """ALT (A*, landmarks, triangle inequality) preprocessing.
+
+    Stores exact distances from and to a few landmark vertices. By the
+    triangle inequality d(u, v) >= d(L, v) - d(L, u) and d(u, L) - d(v, L)
+    for every landmark L, which gives an admissible and consistent
+    heuristic on any non-negatively weighted graph. Pass it as h to
+    a_star or bidirectional_a_star.
+    """
+    def __init__(self, graph, landmarks, dist_from, dist_to):
+        self.graph = graph
+        self.landmarks = np.asarray(landmarks, np.int64)
+        self.dist_from = np.asarray(dist_from, np.float64)
+        self.dist_to = np.asarray(dist_to, np.float64)
+
+    @classmethod
+    def build(cls, graph, k=16, w=None, seed=None):
+        # Farthest-point selection: each landmark is the vertex farthest
+        # from the ones picked so far (unreachable ones first)
+        weights = graph.weigh(w)
+        rg = graph.reverse()
+        rweights = weights[rg.edges]
+        rng = np.random.default_rng(seed)
+        score = _csr_dijkstra(graph, weights, int(rng.integers(graph.n)))[0]
+        landmarks, dist_from, dist_to = [], [], []
+        for i in range(min(k, graph.n)):
+            l = int(np.argmax(score))
+            landmarks.append(l)
+            dist_from.append(_csr_dijkstra(graph, weights, l)[0])
+            dist_to.append(_csr_dijkstra(rg, rweights, l)[0])
+            through = dist_from[-1] + dist_to[-1]
+            score = through if i == 0 else np.minimum(score, through)
+            score[landmarks] = -np.inf
+        return cls(graph, landmarks, dist_from, dist_to)
+
+    def save(self, file):
+        np.savez(file, landmarks=self.landmarks, dist_from=self.dist_from,
+                 dist_to=self.dist_to)
+
+    @classmethod
+    def load(cls, file, graph):
+        with np.load(file) as npz:
+            if npz['dist_from'].shape[1] != graph.n:
+                raise ValueError('landmarks were built for a different graph')
+            return cls(graph, npz['landmarks'], npz['dist_from'],
+                       npz['dist_to'])
+
+    def bound(self, u, v):
+        """Lower bound on the distance from u to v."""
+        u, v = self.graph.id(u), self.graph.id(v)
+        b = _landmark_bound(self.dist_from[:, v], self.dist_from[:, u],
+                            self.dist_to[:, u], self.dist_to[:, v])
+        return max(np.nanmax(b, initial=0), 0)
+
+    def active(self, s, t, count=4):
+        # The few landmarks giving the best bound for this query do nearly
+        # all the work, and keep the per-query setup cheap
+        b = _landmark_bound(self.dist_from[:, t], self.dist_from[:, s],
+                            self.dist_to[:, s], self.dist_to[:, t])
+        return np.argsort(-np.nan_to_num(b, nan=-np.inf))[:count]
+
+    def bounds_to(self, t, active):
+        """Lower bounds on the distance from every vertex to t."""
+        f, r = self.dist_from[active], self.dist_to[active]
+        return _reduce_bounds(_landmark_bound(
+            f[:, t, None], f, r, r[:, t, None]))
+
+    def bounds_from(self, s, active):
+        """Lower bounds on the distance from s to every vertex."""
+        f, r = self.dist_from[active], self.dist_to[active]
+        return _reduce_bounds(_landmark_bound(
+            f, f[:, s, None], r[:, s, None], r))
+
+def _landmark_bound(from_v, from_u, to_u, to_v):
+    with np.errstate(invalid='ignore'):
+        return np.fmax(from_v - from_u, to_u - to_v)
+
+def _reduce_bounds(b):
+    # nan means neither direction told us anything
+    b = np.fmax.reduce(b, axis=0)
+    b[np.isnan(b)] = 0
+    return np.maximum(b, 0, out=b)
+
+
+def _csr_result(g, d, pred, s, t, unreached=math.inf):
+    if d[t] == unreached:
+        return None, None
+    return d[t].item(), [g.label(v) for v in get_path(s, t, pred.tolist())]
+
+def _csr_bfs(g, s, t=None):
+    # Level-synchronous, expanding the whole frontier with array ops
+    offsets, targets = g.offsets, g.targets
+    d = np.full(g.n, -1, np.int64)
+    pred = np.full(g.n, -1, np.int64)
+    d[s] = 0
+    frontier = np.array([s])
+    level = 0
+    while len(frontier) and (t is None or d[t] < 0):
+        level += 1
+        starts = offsets[frontier]
+        counts = offsets[frontier + 1] - starts
+        total = counts.sum()
+        if not total:
+            break
+        ends = np.cumsum(counts)
+        edges = np.arange(total) + np.repeat(starts - (ends - counts), counts)
+        nbrs = targets[edges]
+        new = d[nbrs] < 0
+        nbrs, first = np.unique(nbrs[new], return_index=True)
+        d[nbrs] = level
+        pred[nbrs] = np.repeat(frontier, counts)[new][first]
+        frontier = nbrs
+    return d, pred
+
+def _csr_dijkstra(g, weights, s, t=None):
+    off = memoryview(g.offsets)
+    tg = memoryview(g.targets)
+    wt = memoryview(weights)
+    d = array.array('d', [math.inf]) * g.n
+    pred = array.array('q', [-1]) * g.n
+    done = bytearray(g.n)
+    d[s] = 0
+    q = [(0., s)]
+    while q:
+        du, u = heapq.heappop(q)
+        if done[u]:
+            continue
+        if u == t:
+            break
+        done[u] = 1
+        for i in range(off[u], off[u+1]):
+            v = tg[i]
+            if done[v]:
+                continue
+            dv = du + wt[i]
+            if dv < d[v]:
+                d[v] = dv
+                pred[v] = u
+                heapq.heappush(q, (dv, v))
+    return np.frombuffer(d), np.frombuffer(pred, np.int64)
+
+def _csr_potential(g, h, s, t):
+    # h as a function of vertex id
+    if isinstance(h, Landmarks):
+        return memoryview(h.bounds_to(t, h.active(s, t))).__getitem__
+    label = g.label
+    lt = label(t)
+    return lambda v: h(label(v), lt)
+
+def _csr_a_star(g, weights, s, t, h):
+    off = memoryview(g.offsets)
+    tg = memoryview(g.targets)
+    wt = memoryview(weights)
+    h = _csr_potential(g, h, s, t)
+    d = array.array('d', [math.inf]) * g.n
+    pred = array.array('q', [-1]) * g.n
+    done = bytearray(g.n)
+    d[s] = 0
+    q = [(h(s), 0., s)]
+    while q:
+        fu, gu, u = heapq.heappop(q)
+        if u == t:
+            break
+        if done[u]:
+            continue
+        done[u] = 1
+        for i in range(off[u], off[u+1]):
+            v = tg[i]
+            if done[v]:
+                continue
+            gv = gu + wt[i]
+            if gv < d[v]:
+                d[v] = gv
+                pred[v] = u
+                heapq.heappush(q, (gv + h(v), gv, v))
+    return np.frombuffer(d), np.frombuffer(pred, np.int64)
+
+def _csr_bidirectional(g, weights, s, t, h=None):
+    rg = g.reverse()
+    graphs = g, rg
+    offs = [memoryview(x.offsets) for x in graphs]
+    tgs = [memoryview(x.targets) for x in graphs]
+    wts = memoryview(weights), memoryview(weights[rg.edges])
+    d = [array.array('d', [math.inf]) * g.n for _ in graphs]
+    pred = [array.array('q', [-1]) * g.n for _ in graphs]
+    done = [bytearray(g.n), bytearray(g.n)]
+    if h is None:
+        p = lambda v: 0.
+    elif isinstance(h, Landmarks):
+        active = h.active(s, t)
+        to_t = h.bounds_to(t, active)
+        from_s = h.bounds_from(s, active)
+        # Vertices that can't be on an s-t path at all are never expanded
+        dead = np.isinf(to_t) | np.isinf(from_s)
+        done = [bytearray(dead), bytearray(dead)]
+        to_t[dead] = from_s[dead] = 0
+        p = memoryview((to_t - from_s) / 2).__getitem__
+    else:
+        label = g.label
+        ls, lt = label(s), label(t)
+        p = lambda v: (h(label(v), lt) - h(ls, label(v))) / 2
+    d[0][s] = d[1][t] = 0
+    q = [(p(s), s)], [(-p(t), t)]
+    mu = math.inf
+    meet = None
+    while q[0] and q[1] and q[0][0][0] + q[1][0][0] < mu:
+        side = 1 if q[1][0][0] < q[0][0][0] else 0
+        sign = -1 if side else 1
+        ku, u = heapq.heappop(q[side])
+        dn = done[side]
+        if dn[u]:
+            continue
+        dn[u] = 1
+        ds, do, pr = d[side], d[1 - side], pred[side]
+        off, tg, wt = offs[side], tgs[side], wts[side]
+        du = ds[u]
+        for i in range(off[u], off[u+1]):
+            v = tg[i]
+            if dn[v]:
+                continue
+            dv = du + wt[i]
+            if dv < ds[v]:
+                ds[v] = dv
+                pr[v] = u
+                heapq.heappush(q[side], (dv + sign*p(v), v))
+                if dv + do[v] < mu:
+                    mu = dv + do[v]
+                    meet = v
+        if du + do[u] < mu:
+            mu = du + do[u]
+            meet = u
+    return ([np.frombuffer(x) for x in d],
+            [np.frombuffer(x, np.int64) for x in pred], meet)
+
+
+def _residual(g, cap):
+    # Each edge i becomes arc 2i with its capacity and a reverse arc 2i+1
+    # with none, sorted by tail; rev maps every arc to its partner
+    m = g.nedges
+    tails = np.empty(2*m, np.int64)
+    heads = np.empty(2*m, np.int64)
+    tails[0::2] = heads[1::2] = g.sources()
+    heads[0::2] = tails[1::2] = g.targets
+    rcap = np.zeros(2*m, np.result_type(cap, np.int8))
+    rcap[0::2] = cap
+    order = np.argsort(tails, kind='stable')
+    pos = np.empty(2*m, np.int64)
+    pos[order] = np.arange(2*m)
+    offsets = np.zeros(g.n + 1, np.int64)
+    np.cumsum(np.bincount(tails, minlength=g.n), out=offsets[1:])
+    rev = pos[order ^ 1]
+    return offsets, heads[order], rcap[order], rev, pos[0::2]
+
+def _csr_max_flow(g, cap, s, t, method='dinic', cut=False):
+    # Returns the flow on each edge, and the source side of the cut as a
+    # boolean array if asked
+    offsets, heads, rcap, rev, fwd = _residual(g, cap)
+    off = offsets.tolist()
+    hd = heads.tolist()
+    rc = rcap.tolist()
+    rv = rev.tolist()
+    if s == t:
+        maxf = 0
+    elif method == 'dinic':
+        maxf = _dinic(g.n, off, hd, rc, rv, s, t)
+    elif method == 'push_relabel':
+        maxf = _push_relabel(g.n, off, hd, rc, rv, s, t)
+    else:
+        maxf = _edmonds_karp(g.n, off, hd, rc, rv, s, t)
+    flow = cap - np.array(rc, rcap.dtype)[fwd]
+    if not cut:
+        return maxf, flow
+    return maxf, flow, _residual_reach(g.n, off, hd, rc, s)
+
+def _residual_reach(n, off, hd, rc, s):
+    seen = bytearray(n)
+    seen[s] = 1
+    stack = [s]
+    while stack:
+        u = stack.pop()
+        for a in range(off[u], off[u+1]):
+            v = hd[a]
+            if not seen[v] and rc[a] > 0:
+                seen[v] = 1
+                stack.append(v)
+    return np.frombuffer(seen, bool)
+
+def _bfs_levels(n, off, hd, rc, s, t=None):
+    level = [-1] * n
+    level[s] = 0
+    q = collections.deque([s])
+    while q:
+        u = q.popleft()
+        lv = level[u] + 1
+        for a in range(off[u], off[u+1]):
+            v = hd[a]
+            if level[v] < 0 and rc[a] > 0:
+                level[v] = lv
+                if v == t:
+                    return level
+                q.append(v)
+    return level
+
+def _edmonds_karp(n, off, hd, rc, rv, s, t):
+    maxf = 0
+    while True:
+        pred = [-1] * n
+        pred[s] = -2
+        q = collections.deque([s])
+        while q and pred[t] == -1:
+            u = q.popleft()
+            for a in range(off[u], off[u+1]):
+                v = hd[a]
+                if pred[v] == -1 and rc[a] > 0:
+                    pred[v] = a
+                    q.append(v)
+        if pred[t] == -1:
+            return maxf
+        path = []
+        v = t
+        while v != s:
+            a = pred[v]
+            path.append(a)
+            v = hd[rv[a]]
+        cf = min(rc[a] for a in path)
+        for a in path:
+            rc[a] -= cf
+            rc[rv[a]] += cf
+        maxf += cf
+
+def _dinic(n, off, hd, rc, rv, s, t):
+    # Blocking flows along the BFS level graph, found by an iterative DFS
+    # that keeps a current-arc pointer per vertex
+    maxf = 0
+    while True:
+        level = _bfs_levels(n, off, hd, rc, s)
+        if level[t] < 0:
+            return maxf
+        cur = off[:-1]
+        stack = []
+        u = s
+        while True:
+            if u == t:
+                cf = min(rc[a] for a in stack)
+                maxf += cf
+                k = len(stack)
+                for i, a in enumerate(stack):
+                    rc[a] -= cf
+                    rc[rv[a]] += cf
+                    if not rc[a] and i < k:
+                        k = i
+                # Resume from the tail of the first saturated arc
+                del stack[k:]
+                u = hd[stack[-1]] if stack else s
+                continue
+            a = cur[u]
+            end = off[u+1]
+            lv = level[u] + 1
+            while a < end and (rc[a] <= 0 or level[hd[a]] != lv):
+                a += 1
+            cur[u] = a
+            if a < end:
+                stack.append(a)
+                u = hd[a]
+            elif u == s:
+                break
+            else:
+                # Dead end: prune it and back up
+                level[u] = -1
+                a = stack.pop()
+                u = hd[rv[a]]
+                cur[u] += 1
+
+def _push_relabel(n, off, hd, rc, rv, s, t):
+    # Highest-label push-relabel with exact initial labels and the gap
+    # heuristic. Runs both phases, so the result is a flow, not a preflow.
+    # Excess at or below eps counts as zero, since float rounding can leave
+    # crumbs that no residual arc is left to carry.
+    eps = 1e-12 * sum(rc[a] for a in range(off[s], off[s+1]))
+    height = _bfs_levels(n, off, hd, [rc[a] for a in rv], t)
+    height = [h if h >= 0 else n for h in height]
+    height[s] = n
+    excess = [0] * n
+    count = [0] * (2*n + 1)
+    for h in height:
+        count[h] += 1
+    buckets = [[] for _ in range(2*n + 1)]
+    for a in range(off[s], off[s+1]):
+        x = rc[a]
+        if x > 0:
+            v = hd[a]
+            rc[a] = 0
+            rc[rv[a]] += x
+            old = excess[v]
+            excess[v] += x
+            if old <= eps < excess[v] and v != t and v != s:
+                buckets[height[v]].append(v)
+    cur = off[:-1]
+    top = 2*n
+    while top >= 0:
+        if not buckets[top]:
+            top -= 1
+            continue
+        u = buckets[top].pop()
+        # Discharge u
+        e = excess[u]
+        hu = height[u]
+        a = cur[u]
+        end = off[u+1]
+        while e > eps and hu < 2*n:
+            if a == end:
+                old = hu
+                hu = 2*n
+                for b in range(off[u], end):
+                    if rc[b] > 0 and height[hd[b]] < hu:
+                        hu = height[hd[b]]
+                hu = min(hu + 1, 2*n)
+                count[old] -= 1
+                count[hu] += 1
+                height[u] = hu
+                a = off[u]
+                if not count[old] and old < n:
+                    # Gap: nothing between old and n can reach t any more
+                    for v in range(n):
+                        hv = height[v]
+                        if old < hv < n and v != u:
+                            count[hv] -= 1
+                            count[n + 1] += 1
+                            height[v] = n + 1
+                            if excess[v] > eps and v != s and v != t:
+                                buckets[hv].remove(v)
+                                buckets[n + 1].append(v)
+                    if hu < n:
+                        count[hu] -= 1
+                        hu = height[u] = n + 1
+                        count[hu] += 1
+                    top = max(top, n + 1)
+                continue
+            v = hd[a]
+            if rc[a] > 0 and height[v] == hu - 1:
+                x = rc[a] if rc[a] < e else e
+                rc[a] -= x
+                rc[rv[a]] += x
+                e -= x
+                old = excess[v]
+                excess[v] += x
+                if old <= eps < excess[v] and v != s and v != t:
+                    buckets[height[v]].append(v)
+                if e <= eps:
+                    break
+            a += 1
+        excess[u] = e
+        cur[u] = a
+        if hu > top:
+            top = hu
+    return excess[t]
+
+
+
+
+SQRT2 = math.sqrt(2)
+
+class GridGraph:
+    """A 2d grid of cells indexed [x, y] for fast repeated pathfinding.
+
+    cells is a boolean array (True = open) or an array of costs for
+    entering each cell (0 or inf = blocked). neighborhood is 4 (von
+    Neumann) or 8 (Moore); diagonal steps cost sqrt(2) times as much and
+    may not cut corners, i.e. both cells beside the step must be open.
+
+    Cells are stored flat with a blocked border, so neighbors are fixed
+    index offsets with no bounds checks. Search buffers are allocated once
+    and invalidated with a per-query stamp instead of being cleared.
+    """
+    def __init__(self, cells, neighborhood=4):
+        if neighborhood not in (4, 8):
+            raise ValueError('neighborhood must be 4 or 8')
+        cells = np.asarray(cells)
+        self.width, self.height = cells.shape
+        self.neighborhood = neighborhood
+        self.stride = h = self.height + 2
+        cost = np.zeros((self.width + 2, h))
+        cost[1:-1, 1:-1] = cells
+        cost[~np.isfinite(cost)] = 0
+        self.open = bytearray((cost > 0).ravel())
+        self.cost = cost.ravel().tolist()
+        self.min_cost = float(cost[cost > 0].min(initial=1))
+        self.uniform = bool((cost[cost > 0] == self.min_cost).all())
+        straight = [h, 1, -h, -1]
+        diagonal = [(h, 1), (-h, 1), (-h, -1), (h, -1)]
+        self.steps = [(d, 0, 0) for d in straight]
+        if neighborhood == 8:
+            self.steps += [(a + b, a, b) for a, b in diagonal]
+        n = len(self.cost)
+        self.g = [math.inf] * n
+        self.pred = [-1] * n
+        self.seen = [0] * n
+        self.closed = [0] * n
+        self.stamp = 0
+
+    def __repr__(self):
+        return (f'<GridGraph {self.width}x{self.height} '
+                f'neighborhood={self.neighborhood}>')
+
+    def index(self, v):
+        x, y = v
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError(f'{v} is outside the grid')
+        return (x + 1) * self.stride + y + 1
+
+    def coords(self, i):
+        x, y = divmod(i, self.stride)
+        return x - 1, y - 1
+
+    def _path(self, s, t):
+        pred = self.pred
+        path = [t]
+        while t != s:
+            t = pred[t]
+            path.append(t)
+        return [self.coords(i) for i in reversed(path)]
+
+    def bfs(self, s, t):
+        """Fewest steps from s to t, ignoring costs: (steps, path)."""
+        s, t = self.index(s), self.index(t)
+        if not (self.open[s] and self.open[t]):
+            return None, None
+        self.stamp += 1
+        stamp, seen, pred, g = self.stamp, self.seen, self.pred, self.g
+        op, steps = self.open, self.steps
+        seen[s] = stamp
+        g[s] = 0
+        q = collections.deque([s])
+        while q:
+            u = q.popleft()
+            if u == t:
+                return g[u], self._path(s, t)
+            gv = g[u] + 1
+            for d, a, b in steps:
+                v = u + d
+                if (seen[v] != stamp and op[v] and
+                        (not a or op[u + a] and op[u + b])):
+                    seen[v] = stamp
+                    g[v] = gv
+                    pred[v] = u
+                    q.append(v)
+        return None, None
+
+    def heuristic(self, u, t):
+        (x1, y1), (x2, y2) = divmod(u, self.stride), divmod(t, self.stride)
+        dx, dy = abs(x1 - x2), abs(y1 - y2)
+        if self.neighborhood == 4:
+            return (dx + dy) * self.min_cost
+        return (max(dx, dy) + (SQRT2 - 1) * min(dx, dy)) * self.min_cost
+
+    def a_star(self, s, t):
+        """Cheapest path from s to t: (cost, path)."""
+        s, t = self.index(s), self.index(t)
+        if not (self.open[s] and self.open[t]):
+            return None, None
+        self.stamp += 1
+        stamp, seen, closed = self.stamp, self.seen, self.closed
+        pred, g, cost = self.pred, self.g, self.cost
+        op, steps, hs = self.open, self.steps, self.stride
+        # Octile distance is dx + dy + (sqrt(2) - 2)*min(dx, dy)
+        mc = self.min_cost
+        diag = (SQRT2 - 2) * mc if self.neighborhood == 8 else 0
+        tx, ty = divmod(t, hs)
+        seen[s] = stamp
+        g[s] = 0
+        q = [(self.heuristic(s, t), s)]
+        while q:
+            fu, u = heapq.heappop(q)
+            if u == t:
+                return g[u], self._path(s, t)
+            if closed[u] == stamp:
+                continue
+            closed[u] = stamp
+            gu = g[u]
+            for d, a, b in steps:
+                v = u + d
+                if not op[v] or closed[v] == stamp:
+                    continue
+                if a:
+                    if not (op[u + a] and op[u + b]):
+                        continue
+                    gv = gu + cost[v] * SQRT2
+                else:
+                    gv = gu + cost[v]
+                if seen[v] != stamp or gv < g[v]:
+                    seen[v] = stamp
+                    g[v] = gv
+                    pred[v] = u
+                    dx, dy = divmod(v, hs)
+                    dx = dx - tx if dx > tx else tx - dx
+                    dy = dy - ty if dy > ty else ty - dy
+                    hv = (dx + dy) * mc + (dx if dx < dy else dy) * diag
+                    heapq.heappush(q, (gv + hv, v))
+        return None, None
+
+    def jps(self, s, t):
+        """Jump point search: same result as a_star on a uniform-cost
+        8-neighborhood grid, expanding only jump points."""
+        if self.neighborhood != 8 or not self.uniform:
+            raise ValueError('jump point search needs a uniform 8-neighbor grid')
+        s, t = self.index(s), self.index(t)
+        if not (self.open[s] and self.open[t]):
+            return None, None
+        self.stamp += 1
+        stamp, seen, closed = self.stamp, self.seen, self.closed
+        pred, g, h = self.pred, self.g, self.heuristic
+        op, hs = self.open, self.stride
+        seen[s] = stamp
+        g[s] = 0
+        pred[s] = -1
+        q = [(h(s, t), s)]
+        while q:
+            fu, u = heapq.heappop(q)
+            if u == t:
+                return g[u], self._jps_path(s, t)
+            if closed[u] == stamp:
+                continue
+            closed[u] = stamp
+            gu = g[u]
+            for a, b in self._jps_dirs(u, pred[u] if u != s else -1):
+                if b:
+                    j = self._jump_diagonal(u, a, b, t)
+                else:
+                    j = self._jump_straight(u, a, t)
+                if j < 0 or closed[j] == stamp:
+                    continue
+                gj = gu + h(u, j)
+                if seen[j] != stamp or gj < g[j]:
+                    seen[j] = stamp
+                    g[j] = gj
+                    pred[j] = u
+                    heapq.heappush(q, (gj + h(j, t), j))
+        return None, None
+
+    def _jps_dirs(self, u, p):
+        # Directions worth jumping in from u, given the previous jump point
+        # p: (a, 0) for a straight step a, (a, b) for the diagonal a + b
+        op, hs = self.open, self.stride
+        if p < 0:
+            dirs = [(d, 0) for d in (hs, -hs, 1, -1) if op[u + d]]
+            dirs += [(a, b) for a in (hs, -hs) for b in (1, -1)
+                     if op[u + a] and op[u + b]]
+            return dirs
+        (ux, uy), (px, py) = divmod(u, hs), divmod(p, hs)
+        a = (ux > px) - (ux < px)
+        b = (uy > py) - (uy < py)
+        a *= hs
+        dirs = []
+        if a and b:
+            if op[u + b]:
+                dirs.append((b, 0))
+            if op[u + a]:
+                dirs.append((a, 0))
+            if op[u + a] and op[u + b]:
+                dirs.append((a, b))
+            return dirs
+        d = a or b
+        p1, p2 = (1, -1) if a else (hs, -hs)
+        if op[u + d]:
+            dirs.append((d, 0))
+        for q in (p1, p2):
+            if op[u + q]:
+                dirs.append((q, 0))
+                if op[u + d]:
+                    dirs.append((d, q))
+        return dirs
+
+    def _jump_straight(self, i, d, t):
+        op = self.open
+        p1, p2 = (1, -1) if abs(d) != 1 else (self.stride, -self.stride)
+        while True:
+            i += d
+            if not op[i]:
+                return -1
+            if i == t:
+                return i
+            # A neighbor that opens up beside us can only be reached
+            # optimally through here
+            if (op[i + p1] and not op[i - d + p1] or
+                    op[i + p2] and not op[i - d + p2]):
+                return i
+
+    def _jump_diagonal(self, i, a, b, t):
+        op = self.open
+        while True:
+            i += a + b
+            if not op[i]:
+                return -1
+            if i == t:
+                return i
+            if (self._jump_straight(i, a, t) >= 0 or
+                    self._jump_straight(i, b, t) >= 0):
+                return i
+            if not (op[i + a] and op[i + b]):
+                return -1
+
+    def _jps_path(self, s, t):
+        # Fill in the straight runs between jump points
+        path = [t]
+        hs = self.stride
+        pred = self.pred
+        while t != s:
+            p = pred[t]
+            (tx, ty), (px, py) = divmod(t, hs), divmod(p, hs)
+            step = ((px > tx) - (px < tx)) * hs + (py > ty) - (py < ty)
+            while t != p:
+                t += step
+                path.append(t)
+        return [self.coords(i) for i in reversed(path)]
+
+    def distances(self, s):
+        """Steps from s to every cell as a (width, height) array, -1 where
+        unreachable. Expands a whole frontier at a time with array ops,
+        which suits many agents heading for one target."""
+        op = np.frombuffer(self.open, np.uint8).astype(bool)
+        d = np.full(len(op), -1, np.int64)
+        s = self.index(s)
+        if not op[s]:
+            return d.reshape(-1, self.stride)[1:-1, 1:-1]
+        d[s] = 0
+        frontier = np.array([s])
+        level = 0
+        while len(frontier):
+            level += 1
+            nbrs = []
+            for step, a, b in self.steps:
+                v = frontier + step
+                ok = op[v]
+                if a:
+                    ok &= op[frontier + a] & op[frontier + b]
+                nbrs.append(v[ok])
+            nbrs = np.unique(np.concatenate(nbrs))
+            nbrs = nbrs[d[nbrs] < 0]
+            d[nbrs] = level
+            frontier = nbrs
+        return d.reshape(-1, self.stride)[1:-1, 1:-1]
+
+
+def grid_flow_network(w, h, maxcap=100, seed=None):
+    """A w x h grid with random capacities in both directions, fed by a
+    source joined to the left column and drained by a sink joined to the
+    right one. Returns (graph, s, t)."""
+    rng = np.random.default_rng(seed)
+    idx = np.arange(w*h).reshape(h, w)
+    pairs = [(idx[:, :-1], idx[:, 1:]), (idx[:-1], idx[1:])]
+    sources = np.concatenate([a.ravel() for a, b in pairs] +
+                             [b.ravel() for a, b in pairs])
+    targets = np.concatenate([b.ravel() for a, b in pairs] +
+                             [a.ravel() for a, b in pairs])
+    s, t = w*h, w*h + 1
+    sources = np.concatenate([sources, np.full(h, s), idx[:, -1]])
+    targets = np.concatenate([targets, idx[:, 0], np.full(h, t)])
+    caps = rng.integers(1, maxcap, len(sources)).astype(float)
+    caps[-2*h:] = maxcap * 4
+    return CSRGraph.from_edges(sources, targets, caps, w*h + 2), s, t
+
+def random_flow_network(n, m, maxcap=100, seed=None, fractional=False):
+    """n vertices and m random directed edges; s = 0, t = n-1. Capacities
+    are integers unless fractional."""
+    rng = np.random.default_rng(seed)
+    sources = rng.integers(0, n, m)
+    targets = (sources + rng.integers(1, n, m)) % n
+    caps = (rng.uniform(0, maxcap, m) if fractional else
+            rng.integers(1, maxcap, m).astype(float))
+    return CSRGraph.from_edges(sources, targets, caps, n), 0, n - 1
+
+BENCH_GRIDS = (16, 32, 64)
+BENCH_RANDOM = ((1000, 5000), (5000, 25000), (20000, 100000))
+
+def bench_max_flow(grids=BENCH_GRIDS, randoms=BENCH_RANDOM,
+                   methods=MAX_FLOW_METHODS, seed=0, fractional=False):
+    # Also cross-checks that every method finds the same flow value
+    print(f'{"network":>16} {"edges":>7} {"method":>13} {"flow":>10} '
+          f'{"secs":>8}')
+    nets = [(f'grid {k}x{k}', grid_flow_network(k, k, seed=seed))
+            for k in grids]
+    nets += [(f'random {n}', random_flow_network(n, m, seed=seed,
+                                                  fractional=fractional))
+             for n, m in randoms]
+    results = []
+    for name, (g, s, t) in nets:
+        first = None
+        for method in methods:
+            start = time.perf_counter()
+            f, _ = max_flow(g, None, s, t, method)
+            elapsed = time.perf_counter() - start
+            results.append({'network': name, 'edges': g.nedges,
+                            'method': method, 'flow': f, 'seconds': elapsed})
+            print(f'{name:>16} {g.nedges:>7} {method:>13} {f:>10g} '
+                  f'{elapsed:>8.3f}')
+            if first is None:
+                first = f
+            elif abs(f - first) > 1e-9 * max(abs(first), 1):
+                print(f'{"":>16} flow mismatch: {f!r} != {first!r}')
+    return results
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='max flow benchmark')
+    p.add_argument('-g', '--grids', type=int, nargs='*', default=BENCH_GRIDS)
+    p.add_argument('-r', '--random', type=int, nargs='*', metavar='N',
+                   help='vertex counts, with 5 edges per vertex')
+    p.add_argument('-m', '--methods', nargs='+', choices=MAX_FLOW_METHODS,
+                   default=MAX_FLOW_METHODS)
+    p.add_argument('-f', '--fractional', action='store_true',
+                   help='random networks get non-integer capacities')
+    args = p.parse_args()
+    randoms = (BENCH_RANDOM if args.random is None else
+               [(n, 5*n) for n in args.random])
+    bench_max_flow(args.grids, randoms, args.methods,
+                   fractional=args.fractional)
@@ -1,75 +1,432 @@
 #!/usr/bin/env python3
-import sys, os, socket, datetime, mimetypes
+import sys, os, socket, time, json, mimetypes, threading, collections
+import email.utils, argparse, tempfile, subprocess, http.client, random
 
-CHUNKSIZE = 8192
+KEEPALIVE_TIMEOUT = 15
+CACHE_SIZE = 256
+CACHE_CHECK_INTERVAL = 1
+MAX_RANGES = 32
 
 
 def getline(file):
     return file.readline().decode().rstrip('\r\n')
 
 
-def handle_get_head(rfile, wfile, path, headers, head=False):
+def send_headers(wfile, status, headers, timing=None):
+    wfile.write('HTTP/1.1 {}\r\n'.format(status).encode())
+    for k, v in headers.items():
+        wfile.write('{}: {}\r\n'.format(k, v).encode())
+    wfile.write(b'\r\n')
+    wfile.flush()
+    if timing is not None:
+        timing['status'] = int(status.split()[0])
+        timing['bytes'] = int(headers.get('Content-Length', 0))
+        timing['first_byte'] = time.perf_counter()
+
+
+def send_error(wfile, status, keepalive, timing=None):
+    send_headers(wfile, status, {
+        'Server': 'httpserver.py',
+        'Content-Length': 0,
+        'Connection': 'keep-alive' if keepalive else 'close',
+    }, timing)
+
+
+class CachedFile:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.stat = os.stat(self.file.fileno())
+        self.size = self.stat.st_size
+        self.mtime = self.stat.st_mtime_ns
+        self.type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.etag = '"{:x}-{:x}"'.format(self.mtime, self.size)
+        self.last_modified = email.utils.formatdate(self.stat.st_mtime,
+                                                    usegmt=True)
+        self.checked = time.monotonic()
+
+
+class FileCache:
+    """LRU cache of open files with their stat results and MIME types.
+
+    Entries are rechecked against the file's mtime and size at most every
+    CACHE_CHECK_INTERVAL seconds. Evicted files close once the last request
+    using them drops its reference.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.files = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            entry = self.files.get(path)
+            if entry:
+                self.files.move_to_end(path)
+        if entry:
+            now = time.monotonic()
+            if now - entry.checked < CACHE_CHECK_INTERVAL:
+                return entry
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if (stat and stat.st_mtime_ns == entry.mtime and
+                    stat.st_size == entry.size):
+                entry.checked = now
+                return entry
+        entry = CachedFile(path)
+        with self.lock:
+            self.files[path] = entry
+            self.files.move_to_end(path)
+            while len(self.files) > self.size:
+                self.files.popitem(last=False)
+        return entry
+
+
+file_cache = FileCache()
+
+
+def parse_ranges(spec, size):
+    """Parse a Range header into a list of (start, stop) byte ranges.
+    Returns None if the header should be ignored, [] if unsatisfiable."""
+    unit, _, spec = spec.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    try:
+        for part in spec.split(','):
+            first, dash, last = part.strip().partition('-')
+            if not dash:
+                return None
+            if not first:
+                n = int(last)
+                if n < 0:
+                    return None
+                if n:
+                    ranges.append((max(size - n, 0), size))
+            else:
+                start = int(first)
+                stop = int(last) + 1 if last else max(size, start + 1)
+                if start < 0 or stop <= start:
+                    return None
+                if start < size:
+                    ranges.append((start, min(stop, size)))
+    except ValueError:
+        return None
+    return ranges if len(ranges) <= MAX_RANGES else None
+
+
+def not_modified(entry, headers):
+    if 'If-None-Match' in headers:
+        tags = [t.strip() for t in headers['If-None-Match'].split(',')]
+        return '*' in tags or entry.etag in tags or 'W/' + entry.etag in tags
+    if 'If-Modified-Since' in headers:
+        try:
+            since = email.utils.parsedate_to_datetime(
+                headers['If-Modified-Since']).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(entry.stat.st_mtime) <= since
+    return False
+
+
+def handle_get_head(conn, wfile, path, headers, head=False, keepalive=False,
+                    timing=None):
     path = path.lstrip('/')
     try:
-        file = open(path, 'rb')
+        entry = file_cache.get(path)
     except OSError as e:
         print(e)
-        wfile.write(b'HTTP/1.1 404 Not Found\r\n\r\n')
+        send_error(wfile, '404 Not Found', keepalive, timing)
+        return
+    respheaders = {
+        'Date': email.utils.formatdate(usegmt=True),
+        'Server': 'httpserver.py',
+        'Last-Modified': entry.last_modified,
+        'ETag': entry.etag,
+        'Accept-Ranges': 'bytes',
+        'Connection': 'keep-alive' if keepalive else 'close',
+    }
+    if not_modified(entry, headers):
+        send_headers(wfile, '304 Not Modified', respheaders, timing)
+        return
+    ranges = None
+    if 'Range' in headers and headers.get('If-Range', entry.etag) in (
+            entry.etag, entry.last_modified):
+        ranges = parse_ranges(headers['Range'], entry.size)
+    if ranges == []:
+        respheaders['Content-Range'] = 'bytes */{}'.format(entry.size)
+        respheaders['Content-Length'] = 0
+        send_headers(wfile, '416 Range Not Satisfiable', respheaders, timing)
+        return
+    if not ranges:
+        respheaders['Content-Length'] = entry.size
+        respheaders['Content-Type'] = entry.type
+        send_headers(wfile, '200 OK', respheaders, timing)
+        parts = [(b'', 0, entry.size)]
+    elif len(ranges) == 1:
+        start, stop = ranges[0]
+        respheaders['Content-Length'] = stop - start
+        respheaders['Content-Type'] = entry.type
+        respheaders['Content-Range'] = 'bytes {}-{}/{}'.format(
+            start, stop - 1, entry.size)
+        send_headers(wfile, '206 Partial Content', respheaders, timing)
+        parts = [(b'', start, stop)]
     else:
-        with file:
-            stat = os.stat(file.fileno())
-            wfile.write(b'HTTP/1.1 200 OK\r\n')
-            respheaders = {
-                'Date': datetime.datetime.utcnow().ctime(),
-                'Server': 'httpserver.py',
-                'Content-Length': stat.st_size,
-                'Content-Type':
-                    mimetypes.guess_type(path)[0] or 'application/octet-stream',
-                'Last-Modified':
-                    datetime.datetime.utcfromtimestamp(stat.st_mtime).ctime(),
-                'Connection': 'close',
-            }
-            for k, v in respheaders.items():
-                wfile.write('{}: {}\r\n'.format(k, v).encode())
-            wfile.write(b'\r\n')
-            if not head:
-                chunk = file.read(CHUNKSIZE)
-                while chunk:
-                    wfile.write(chunk)
-                    chunk = file.read(CHUNKSIZE)
-
-
-def handle(conn):
-    rfile = conn.makefile('rb')
-    wfile = conn.makefile('wb')
+        boundary = os.urandom(12).hex()
+        parts = [('\r\n--{}\r\nContent-Type: {}\r\n'
+                  'Content-Range: bytes {}-{}/{}\r\n\r\n'.format(
+                      boundary, entry.type, start, stop - 1, entry.size
+                  ).encode(), start, stop) for start, stop in ranges]
+        end = '\r\n--{}--\r\n'.format(boundary).encode()
+        respheaders['Content-Length'] = sum(
+            len(h) + stop - start for h, start, stop in parts) + len(end)
+        respheaders['Content-Type'] = (
+            'multipart/byteranges; boundary=' + boundary)
+        send_headers(wfile, '206 Partial Content', respheaders, timing)
+        parts.append((end, 0, 0))
+    if not head:
+        for header, start, stop in parts:
+            wfile.write(header)
+            if stop > start:
+                # Part headers must go out before the zero-copy body
+                wfile.flush()
+                conn.sendfile(entry.file, start, stop - start)
+    elif timing is not None:
+        timing['bytes'] = 0
+
+
+def handle_request(conn, rfile, wfile, timing=None):
+    """Handle one request, returning whether to keep the connection open."""
     req = getline(rfile)
-    print('{}:{}: {}'.format(*conn.getpeername(), req))
-    method, path, version = req.split()
-    headers = {}
-    line = getline(rfile)
-    while line:
-        key, value = line.split(':', 1)
-        headers[key.strip().title()] = value.strip()
+    if not req:
+        return False
+    if timing is not None:
+        timing['start'] = time.perf_counter()
+        timing['request'] = req
+    print('{}:{}: {}'.format(*conn.getpeername()[:2], req))
+    try:
+        method, path, version = req.split()
+        headers = {}
         line = getline(rfile)
+        while line:
+            key, value = line.split(':', 1)
+            headers[key.strip().title()] = value.strip()
+            line = getline(rfile)
+    except ValueError:
+        send_error(wfile, '400 Bad Request', False, timing)
+        return False
+    if timing is not None:
+        timing['parse'] = time.perf_counter()
+    connection = headers.get('Connection', '').lower()
+    keepalive = (connection == 'keep-alive' if version == 'HTTP/1.0'
+                 else connection != 'close')
     if method == 'GET':
-        handle_get_head(rfile, wfile, path, headers)
+        handle_get_head(conn, wfile, path, headers, False, keepalive, timing)
     elif method == 'HEAD':
-        handle_get_head(rfile, wfile, path, headers, True)
+        handle_get_head(conn, wfile, path, headers, True, keepalive, timing)
     else:
-        wfile.write(b'HTTP/1.1 501 Method Not Implemented\r\n\r\n')
+        # Skip the body so the next pipelined request can be read
+        length = int(headers.get('Content-Length', 0))
+        if length:
+            rfile.read(length)
+        send_error(wfile, '501 Method Not Implemented', keepalive, timing)
+    return keepalive
+
+
+class TimingLog:
+    """Writes one JSON line per request with its timings in seconds:
+    accept is from the connection's accept (or the previous request) to
+    the request line, and parse, first_byte and complete are from the
+    request line."""
 
+    def __init__(self, file):
+        self.file = open(file, 'a', buffering=1)
+        self.lock = threading.Lock()
 
-def serve(port=80):
+    def write(self, peer, accepted, timing):
+        start = timing['start']
+        parse = timing.get('parse', start)
+        first = timing.get('first_byte', parse)
+        record = {
+            'time': round(time.time(), 6),
+            'client': '{}:{}'.format(*peer[:2]),
+            'request': timing['request'],
+            'status': timing.get('status'),
+            'bytes': timing.get('bytes'),
+            'accept': round(start - accepted, 6),
+            'parse': round(parse - start, 6),
+            'first_byte': round(first - start, 6),
+            'complete': round(timing['complete'] - start, 6),
+        }
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            self.file.write(line)
+
+
+timing_log = None
+
+
+def handle(conn, accepted=None):
+    rfile = conn.makefile('rb')
+    wfile = conn.makefile('wb')
+    peer = conn.getpeername()
+    if accepted is None:
+        accepted = time.perf_counter()
+    try:
+        while True:
+            timing = {} if timing_log else None
+            keepalive = handle_request(conn, rfile, wfile, timing)
+            wfile.flush()
+            if timing:
+                timing['complete'] = time.perf_counter()
+                timing_log.write(peer, accepted, timing)
+                accepted = timing['complete']
+            if not keepalive:
+                break
+    except (OSError, ValueError) as e:
+        print(e)
+    finally:
+        rfile.close()
+        wfile.close()
+
+
+def handle_thread(conn, accepted=None):
+    with conn:
+        conn.settimeout(KEEPALIVE_TIMEOUT)
+        # Headers and sendfile bodies are separate writes, don't let Nagle
+        # hold the second back for a delayed ACK
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        handle(conn, accepted)
+
+
+def serve(port=80, threaded=True):
     with socket.socket() as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.bind(('', port))
-        sock.listen()
+        sock.listen(128)
         print('Listening on {}:{}...'.format(*sock.getsockname()))
         while True:
             conn, addr = sock.accept()
-            with conn:
-                handle(conn)
+            accepted = time.perf_counter()
+            if threaded:
+                # One thread per connection so slow clients only stall
+                # themselves
+                threading.Thread(target=handle_thread, args=(conn, accepted),
+                                 daemon=True).start()
+            else:
+                handle_thread(conn, accepted)
+
+
+BENCH_FILES = {'index.html': 2048, 'style.css': 16384, 'image.png': 262144,
+               'video.mp4': 8388608}
+
+
+def bench_requests(rng):
+    # A mix of plain, conditional, ranged, HEAD and missing requests
+    name = rng.choice(list(BENCH_FILES))
+    size = BENCH_FILES[name]
+    r = rng.random()
+    if r < 0.6:
+        return 'GET', name, {}
+    if r < 0.75:
+        return 'GET', name, {'If-Modified-Since':
+                             email.utils.formatdate(usegmt=True)}
+    if r < 0.9:
+        start = rng.randrange(size)
+        return 'GET', name, {'Range': 'bytes={}-{}'.format(
+            start, min(start + 65535, size - 1))}
+    if r < 0.97:
+        return 'HEAD', name, {}
+    return 'GET', 'missing.html', {}
+
+
+def percentile(sorted_vals, q):
+    if not sorted_vals:
+        return 0.
+    return sorted_vals[min(int(q * len(sorted_vals)), len(sorted_vals) - 1)]
+
+
+def load_test(connections=16, requests=10000, port=0, seed=0, log=None):
+    """Start a server on a temp directory of BENCH_FILES, replay a request
+    mix over concurrent keep-alive connections and print throughput and
+    latency percentiles."""
+    with tempfile.TemporaryDirectory() as root:
+        for name, size in BENCH_FILES.items():
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(os.urandom(size))
+        if not port:
+            with socket.socket() as s:
+                s.bind(('127.0.0.1', 0))
+                port = s.getsockname()[1]
+        log = log or os.path.join(root, 'timing.jsonl')
+        server = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), str(port),
+             '-l', os.path.abspath(log)],
+            cwd=root, stdout=subprocess.DEVNULL)
+        try:
+            for i in range(100):
+                try:
+                    socket.create_connection(('127.0.0.1', port)).close()
+                    break
+                except OSError:
+                    time.sleep(0.05)
+            latencies = [[] for i in range(connections)]
+            counts = [requests // connections + (i < requests % connections)
+                      for i in range(connections)]
+
+            def client(i):
+                rng = random.Random(seed + i)
+                conn = http.client.HTTPConnection('127.0.0.1', port)
+                for j in range(counts[i]):
+                    method, name, headers = bench_requests(rng)
+                    t = time.perf_counter()
+                    conn.request(method, '/' + name, headers=headers)
+                    conn.getresponse().read()
+                    latencies[i].append(time.perf_counter() - t)
+                conn.close()
+
+            threads = [threading.Thread(target=client, args=(i,))
+                       for i in range(connections)]
+            t = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - t
+        finally:
+            server.terminate()
+            server.wait()
+        lat = sorted(x for l in latencies for x in l)
+        print('{} requests over {} connections in {:.2f}s: {:.0f} req/s'
+              .format(len(lat), connections, elapsed, len(lat) / elapsed))
+        print('latency ms: p50 {:.2f}  p90 {:.2f}  p99 {:.2f}  max {:.2f}'
+              .format(*(1000 * percentile(lat, q) for q in (.5, .9, .99, 1))))
+        with open(log) as f:
+            records = [json.loads(line) for line in f]
+        for key in ('parse', 'first_byte', 'complete'):
+            vals = sorted(r[key] for r in records)
+            print('server {} ms: p50 {:.2f}  p99 {:.2f}'.format(
+                key, 1000 * percentile(vals, .5), 1000 * percentile(vals, .99)))
 
 
 if __name__ == '__main__':
-    port = int(sys.argv[1]) if len(sys.argv) > 1 else 80
-    serve(port)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('port', type=int, nargs='?')
+    parser.add_argument('-s', '--serial', action='store_true',
+                        help='handle one connection at a time')
+    parser.add_argument('-l', '--timing-log',
+                        help='append per-request timings as JSON lines')
+    parser.add_argument('-b', '--bench', action='store_true',
+                        help='run a local load test instead of serving')
+    parser.add_argument('-c', '--connections', type=int, default=16)
+    parser.add_argument('-n', '--requests', type=int, default=10000)
+    args = parser.parse_args()
+    if args.bench:
+        load_test(args.connections, args.requests, args.port or 0,
+                  log=args.timing_log)
+    else:
+        if args.timing_log:
+            timing_log = TimingLog(args.timing_log)
+        serve(args.port or 80, not args.serial)
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
-import sys, os
 import pygame as pg
 import numpy as np
 import argparse
+from lifeengine import make_engine, load_board, parsetxt, parseimg, \
+    ENGINES, ENGINE
 
 FPS = 60
 SPEEDS = [2, 10, 30, 60]
@@ -26,40 +27,11 @@ BIGSCRL = 100
 class Life:
     def __init__(self, seed=None, w=None, h=None, xoff=None, yoff=None, *,
                  ssize=None, pixel=PIXEL, wrap=False, speed=SPEED,
-                 pause=False):
-        if seed is None:
-            seed = SEED_FACTOR
-        elif isinstance(seed, str):
-            try:
-                seed = float(seed)
-            except ValueError:
-                pass
-        if isinstance(seed, float):
-            w, h = w or WIDTH, h or HEIGHT
-            self.board = np.random.random((w, h)) < seed
-        else:
-            if isinstance(seed, str):
-                if os.path.splitext(seed)[1] in ('.png', '.bmp'):
-                    seed = parseimg(seed)
-                else:
-                    seed = parsetxt(seed)
-            self.board = np.asarray(seed, bool)
-            if w and h:
-                temp = self.board
-                w0, h0 = temp.shape
-                # w, h = max(w, w0), max(h, h0)
-                self.board = np.zeros((w, h), bool)
-                if xoff is None:
-                    xoff = (w - w0) // 2
-                elif xoff < 0:
-                    xoff += w
-                if yoff is None:
-                    yoff = (h - h0) // 2
-                elif yoff < 0:
-                    yoff += h
-                xoff = min(max(0, xoff), w)
-                yoff = min(max(0, yoff), h)
-                self.board[xoff: xoff+w0, yoff: yoff+h0] = temp[:w-xoff, :h-yoff]
+                 pause=False, engine=ENGINE, gens=1):
+        board = load_board(seed, w, h, xoff, yoff, density=SEED_FACTOR,
+                           size=(WIDTH, HEIGHT))
+        self.engine = make_engine(board, wrap, engine)
+        self.board = self.engine.board
         self.width, self.height = self.board.shape
         self.scrollx = 0
         self.scrolly = 0
@@ -67,6 +39,7 @@ class Life:
         self.px = pixel
         self.wrap = wrap
         self.paused = pause
+        self.gens = gens
 
         pg.init()
 
@@ -176,15 +149,8 @@ class Life:
         pg.display.set_mode((px*sw, px*sh), pg.RESIZABLE)
 
     def tick(self):
-        #neighbors = convolve2d(self.board, [[1,1,1],[1,0,1],[1,1,1]], 'same')
-        padded = np.pad(self.board, 1, 'wrap' if self.wrap else 'constant')
-        neighbors = np.zeros_like(self.board, int)
-        for di, dj in [(-1, -1), (-1, 0), (-1, 1), (0, 1),
-                       (1, 1),   (1, 0),  (1, -1), (0, -1)]:
-            neighbors += padded[1+di : self.width+1+di,
-                                1+dj : self.height+1+dj]
-        self.board[neighbors != 2] = False
-        self.board[neighbors == 3] = True
+        self.engine.step(self.gens)
+        self.board = self.engine.board
 
     def display(self):
         pixels = np.full((self.swidth, self.sheight, 3), BGCOLOR, dtype=np.uint8)
@@ -199,37 +165,27 @@ class Life:
         pg.display.flip()
 
 
-def parsetxt(file):
-    if isinstance(file, str):
-        file = open(file) if file != '-' else sys.stdin
-    lines = [line.rstrip('\n') for line in file]
-    width = max(map(len, lines)) if lines else 0
-    seed = [[c != ' ' for c in row.ljust(width)] for row in lines]
-    return np.array(seed, bool, ndmin=2).T.copy()
-
-def parseimg(file):
-    from PIL import Image
-    im = Image.open(file).convert('L')
-    return (np.array(im) < 128).T.copy()
-
-
 def run(seed=None, w=None, h=None, xoff=0, yoff=0, ssize=None, pixel=4,
-        wrap=False, speed=SPEED, pause=False):
+        wrap=False, speed=SPEED, pause=False, engine=ENGINE, gens=1):
     Life(seed, w, h, xoff, yoff, ssize=ssize, pixel=pixel, wrap=wrap,
-         speed=speed, pause=pause).run()
+         speed=speed, pause=pause, engine=engine, gens=gens).run()
 
 
 if __name__ == '__main__':
     p = argparse.ArgumentParser(
-        usage='%(prog)s [-h] [-s W H] [-x PIXEL] [-w] [-p] '
-        '[file] [w h] [xoff yoff]')
+        usage='%(prog)s [-h] [-s W H] [-x PIXEL] [-w] [-p] [-e ENGINE] '
+        '[-g GENS] [file] [w h] [xoff yoff]')
     p.add_argument('-s', '--ssize', metavar=('W', 'H'), type=int, nargs=2)
     p.add_argument('-x', '--pixel', type=int, default=PIXEL)
     p.add_argument('-w', '--wrap', action='store_true')
     p.add_argument('-S', '--speed', type=int, default=SPEED)
     p.add_argument('-p', '--pause', action='store_true')
+    p.add_argument('-e', '--engine', choices=ENGINES, default=ENGINE)
+    p.add_argument('-g', '--gens', type=int, default=1)
     p.add_argument('args', nargs='*', metavar='file, w, h, xoff, yoff')
     ns = p.parse_args()
+    if ns.wrap and ns.engine == 'hashlife':
+        p.error('hashlife does not support --wrap')
     args = ns.args
 
     file, w, h, xoff, yoff = None, None, None, None, None
@@ -244,6 +200,7 @@ if __name__ == '__main__':
         w, h = map(int, args[-2:])
     try:
         run(file, w, h, xoff, yoff, ssize=ns.ssize, pixel=ns.pixel,
-            wrap=ns.wrap, speed=ns.speed, pause=ns.pause)
+            wrap=ns.wrap, speed=ns.speed, pause=ns.pause, engine=ns.engine,
+            gens=ns.gens)
     finally:
         pg.display.quit()
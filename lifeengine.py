@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+import sys, os, time, itertools
+import numpy as np
+import argparse
+
+SEED_FACTOR = .09
+WIDTH = 500
+HEIGHT = 500
+
+OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, 1),
+           (1, 1),   (1, 0),  (1, -1), (0, -1)]
+
+class NaiveEngine:
+    def __init__(self, board, wrap=False):
+        self.board = np.array(board, bool)
+        self.wrap = wrap
+
+    def step(self, n=1):
+        w, h = self.board.shape
+        for _ in range(n):
+            padded = np.pad(self.board, 1, 'wrap' if self.wrap else 'constant')
+            neighbors = np.zeros_like(self.board, int)
+            for di, dj in OFFSETS:
+                neighbors += padded[1+di : w+1+di, 1+dj : h+1+dj]
+            self.board[neighbors != 2] = False
+            self.board[neighbors == 3] = True
+
+
+class NumpyEngine:
+    # All buffers are allocated up front; a step only writes into them
+    def __init__(self, board, wrap=False):
+        board = np.asarray(board, bool)
+        w, h = board.shape
+        self.wrap = wrap
+        self.padded = np.zeros((w+2, h+2), np.uint8)
+        self.cells = self.padded[1:-1, 1:-1]
+        self.cells[...] = board
+        self.board = self.cells.view(bool)
+        self.rowsum = np.empty((w, h+2), np.uint8)
+        self.count = np.empty((w, h), np.uint8)
+        self.born = np.empty((w, h), bool)
+        self.kept = np.empty((w, h), bool)
+
+    def step(self, n=1):
+        P, R, C = self.padded, self.rowsum, self.count
+        for _ in range(n):
+            if self.wrap:
+                P[0, 1:-1] = P[-2, 1:-1]
+                P[-1, 1:-1] = P[1, 1:-1]
+                P[:, 0] = P[:, -2]
+                P[:, -1] = P[:, 1]
+            # 3x3 box sum, separably; it includes the cell itself
+            np.add(P[:-2], P[1:-1], out=R)
+            np.add(R, P[2:], out=R)
+            np.add(R[:, :-2], R[:, 1:-1], out=C)
+            np.add(C, R[:, 2:], out=C)
+            # alive next iff sum == 3, or sum == 4 and alive now
+            np.equal(C, 3, out=self.born)
+            np.equal(C, 4, out=self.kept)
+            np.logical_and(self.kept, self.board, out=self.kept)
+            np.logical_or(self.born, self.kept, out=self.board)
+
+
+class PackedEngine:
+    # Columns are packed along y into uint64 words, 64 cells per word, and
+    # neighbor counts are computed with bitwise full adders
+    def __init__(self, board, wrap=False):
+        board = np.asarray(board, bool)
+        self.width, self.height = w, h = board.shape
+        self.wrap = wrap
+        self.nwords = nw = max(-(-h // 64), 1)
+        self.lastbit = np.uint64((h - 1) % 64)
+        self.mask = np.uint64((1 << (h % 64 or 64)) - 1)
+        self.words = np.zeros((w, nw), np.uint64)
+        self.board = board
+        self.north = np.empty((w, nw), np.uint64)
+        self.south = np.empty((w, nw), np.uint64)
+        self.lo = np.zeros((w+2, nw), np.uint64)
+        self.hi = np.zeros((w+2, nw), np.uint64)
+        self.tmp = [np.empty((w, nw), np.uint64) for _ in range(5)]
+
+    @property
+    def board(self):
+        bytes_ = self.words.astype('<u8').view(np.uint8)
+        bits = np.unpackbits(bytes_, axis=1, count=self.height,
+                             bitorder='little')
+        return bits.view(bool)
+
+    @board.setter
+    def board(self, board):
+        bytes_ = np.packbits(board, axis=1, bitorder='little')
+        padded = np.zeros((self.width, self.nwords * 8), np.uint8)
+        padded[:, :bytes_.shape[1]] = bytes_
+        self.words[...] = padded.view('<u8')
+
+    def step(self, n=1):
+        W, N, S = self.words, self.north, self.south
+        lo, hi = self.lo, self.hi
+        t0, t1, t2, t3, t4 = self.tmp
+        one, top = np.uint64(1), np.uint64(63)
+        for _ in range(n):
+            # Neighbor at y-1 is the next lower bit, carried across words,
+            # and the neighbor at y+1 is the next higher bit
+            np.left_shift(W, one, out=N)
+            np.right_shift(W[:, :-1], top, out=t0[:, 1:])
+            np.bitwise_or(N[:, 1:], t0[:, 1:], out=N[:, 1:])
+            np.right_shift(W, one, out=S)
+            np.left_shift(W[:, 1:], top, out=t0[:, :-1])
+            np.bitwise_or(S[:, :-1], t0[:, :-1], out=S[:, :-1])
+            if self.wrap:
+                N[:, 0] |= (W[:, -1] >> self.lastbit) & one
+                S[:, -1] |= (W[:, 0] & one) << self.lastbit
+
+            # Sum of each vertical triple as two bit planes, lo + 2*hi
+            self._fulladd(N, W, S, lo[1:-1], hi[1:-1], t0)
+            if self.wrap:
+                lo[0], lo[-1] = lo[-2], lo[1]
+                hi[0], hi[-1] = hi[-2], hi[1]
+
+            # Adding the three columns gives the 3x3 sum (including the cell
+            # itself) as s + 2*c + 2*d + 4*e, which is s + 2*u + 4*f + 8*g
+            # with u = c ^ d, f = (c & d) ^ e and g = (c & d) & e
+            s, c, d, e = t0, t1, t2, t3
+            self._fulladd(lo[:-2], lo[1:-1], lo[2:], s, c, t4)
+            self._fulladd(hi[:-2], hi[1:-1], hi[2:], d, e, t4)
+            np.bitwise_and(c, d, out=t4)
+            np.bitwise_xor(c, d, out=c)                 # u
+            np.bitwise_xor(e, t4, out=d)                # f
+            np.bitwise_or(e, t4, out=e)                 # f | g
+            # Born or kept where the sum is 3: s & u & ~(f | g)
+            np.bitwise_and(s, c, out=N)
+            np.invert(e, out=e)
+            np.bitwise_and(N, e, out=N)
+            # Kept where the sum is 4 and alive: ~(s | u) & f & alive
+            np.bitwise_or(s, c, out=S)
+            np.invert(S, out=S)
+            np.bitwise_and(S, d, out=S)
+            np.bitwise_and(S, W, out=S)
+            np.bitwise_or(N, S, out=W)
+            W[:, -1] &= self.mask
+
+    @staticmethod
+    def _fulladd(a, b, c, s, carry, tmp):
+        # carry = majority(a, b, c) = c ^ ((a ^ c) & (b ^ c))
+        np.bitwise_xor(a, c, out=carry)
+        np.bitwise_xor(b, c, out=tmp)
+        np.bitwise_and(carry, tmp, out=carry)
+        np.bitwise_xor(carry, c, out=carry)
+        np.bitwise_xor(a, b, out=s)
+        np.bitwise_xor(s, c, out=s)
+
+
+class Node:
+    __slots__ = ('k', 'a', 'b', 'c', 'd', 'n')
+
+    # a b  quadrants of a level k node, which covers 2**k x 2**k cells;
+    # c d  rows are x and columns are y, as in the board arrays
+    def __init__(self, k, a, b, c, d, n):
+        self.k, self.a, self.b, self.c, self.d, self.n = k, a, b, c, d, n
+
+    def __repr__(self):
+        return f'Node(k={self.k}, n={self.n})'
+
+ON = Node(0, None, None, None, None, 1)
+OFF = Node(0, None, None, None, None, 0)
+
+class HashlifeEngine:
+    # The universe is unbounded: the board is only a window onto it, and
+    # cells that leave the window keep evolving. Once the interning table
+    # grows past max_nodes it is pruned between steps.
+    MAX_NODES = 1 << 22
+
+    def __init__(self, board, wrap=False, max_nodes=MAX_NODES):
+        if wrap:
+            raise ValueError('hashlife does not support wrapping')
+        self.max_nodes = max_nodes
+        self.table = {}
+        self.cache = {}
+        self.empties = [OFF]
+        self.generation = 0
+        self.board = board
+
+    def join(self, a, b, c, d):
+        key = a, b, c, d
+        node = self.table.get(key)
+        if node is None:
+            node = Node(a.k + 1, a, b, c, d, a.n + b.n + c.n + d.n)
+            self.table[key] = node
+        return node
+
+    def empty(self, k):
+        while len(self.empties) <= k:
+            e = self.empties[-1]
+            self.empties.append(self.join(e, e, e, e))
+        return self.empties[k]
+
+    def centre(self, m):
+        # Embed m in the middle of an empty node one level up
+        e = self.empty(m.k - 1)
+        return self.join(self.join(e, e, e, m.a), self.join(e, e, m.b, e),
+                         self.join(e, m.c, e, e), self.join(m.d, e, e, e))
+
+    @staticmethod
+    def is_padded(m):
+        # All cells lie in the middle quarter of m
+        return (m.a.n == m.a.d.d.n and m.b.n == m.b.c.c.n and
+                m.c.n == m.c.b.b.n and m.d.n == m.d.a.a.n)
+
+    def life_4x4(self, m):
+        grid = [[m.a.a, m.a.b, m.b.a, m.b.b],
+                [m.a.c, m.a.d, m.b.c, m.b.d],
+                [m.c.a, m.c.b, m.d.a, m.d.b],
+                [m.c.c, m.c.d, m.d.c, m.d.d]]
+        out = []
+        for i in (1, 2):
+            for j in (1, 2):
+                total = sum(grid[i+di][j+dj].n
+                            for di in (-1, 0, 1) for dj in (-1, 0, 1))
+                out.append(ON if total == 3 or total == 4 and grid[i][j].n
+                           else OFF)
+        return self.join(*out)
+
+    def successor(self, m, j):
+        # Centre of m advanced by 2**j generations, for j <= m.k - 2
+        if m.n == 0:
+            return m.a
+        key = m, j
+        s = self.cache.get(key)
+        if s is not None:
+            return s
+        if m.k == 2:
+            s = self.life_4x4(m)
+        else:
+            join, succ = self.join, self.successor
+            a, b, c, d = m.a, m.b, m.c, m.d
+            c1 = succ(join(a.a, a.b, a.c, a.d), j)
+            c2 = succ(join(a.b, b.a, a.d, b.c), j)
+            c3 = succ(join(b.a, b.b, b.c, b.d), j)
+            c4 = succ(join(a.c, a.d, c.a, c.b), j)
+            c5 = succ(join(a.d, b.c, c.b, d.a), j)
+            c6 = succ(join(b.c, b.d, d.a, d.b), j)
+            c7 = succ(join(c.a, c.b, c.c, c.d), j)
+            c8 = succ(join(c.b, d.a, c.d, d.c), j)
+            c9 = succ(join(d.a, d.b, d.c, d.d), j)
+            if j < m.k - 2:
+                s = join(join(c1.d, c2.c, c4.b, c5.a),
+                         join(c2.d, c3.c, c5.b, c6.a),
+                         join(c4.d, c5.c, c7.b, c8.a),
+                         join(c5.d, c6.c, c8.b, c9.a))
+            else:
+                s = join(succ(join(c1, c2, c4, c5), j),
+                         succ(join(c2, c3, c5, c6), j),
+                         succ(join(c4, c5, c7, c8), j),
+                         succ(join(c5, c6, c8, c9), j))
+        self.cache[key] = s
+        return s
+
+    def collect(self):
+        # Evict memoized results and every node the root no longer uses
+        self.cache.clear()
+        table = {}
+        stack = [self.root]
+        while stack:
+            m = stack.pop()
+            if m.k == 0:
+                continue
+            key = m.a, m.b, m.c, m.d
+            if key not in table:
+                table[key] = m
+                stack.extend(key)
+        self.table = table
+        self.empties = [OFF]
+
+    def step(self, n=1):
+        self.generation += n
+        j = 0
+        while n:
+            if n & 1:
+                if len(self.table) > self.max_nodes:
+                    self.collect()
+                # Growing at most one cell per generation, a pattern in the
+                # middle quarter stays inside the returned centre
+                while self.root.k < j + 3 or not self.is_padded(self.root):
+                    self.root = self.centre(self.root)
+                    self.x -= 1 << (self.root.k - 2)
+                    self.y -= 1 << (self.root.k - 2)
+                self.x += 1 << (self.root.k - 2)
+                self.y += 1 << (self.root.k - 2)
+                self.root = self.successor(self.root, j)
+            n >>= 1
+            j += 1
+
+    @property
+    def board(self):
+        board = np.zeros((self.width, self.height), bool)
+        self._fill(board, self.root, self.x, self.y)
+        return board
+
+    @board.setter
+    def board(self, board):
+        board = np.asarray(board, bool)
+        self.width, self.height = board.shape
+        k = max(max(board.shape) - 1, 1).bit_length()
+        self.x = self.y = 0
+        self.root = self._build(board, k)
+
+    def _build(self, board, k):
+        if not board.any():
+            return self.empty(k)
+        if k == 0:
+            return ON
+        h = 1 << (k - 1)
+        return self.join(self._build(board[:h, :h], k - 1),
+                         self._build(board[:h, h:], k - 1),
+                         self._build(board[h:, :h], k - 1),
+                         self._build(board[h:, h:], k - 1))
+
+    def _fill(self, board, m, x, y):
+        size = 1 << m.k
+        if (m.n == 0 or x >= board.shape[0] or y >= board.shape[1] or
+                x + size <= 0 or y + size <= 0):
+            return
+        if m.k == 0:
+            board[x, y] = True
+            return
+        h = size >> 1
+        self._fill(board, m.a, x, y)
+        self._fill(board, m.b, x, y + h)
+        self._fill(board, m.c, x + h, y)
+        self._fill(board, m.d, x + h, y + h)
+
+
+ENGINES = {'naive': NaiveEngine, 'numpy': NumpyEngine, 'packed': PackedEngine,
+           'hashlife': HashlifeEngine}
+ENGINE = 'numpy'
+
+def make_engine(board, wrap=False, engine=ENGINE):
+    if isinstance(engine, str):
+        engine = ENGINES[engine]
+    return engine(board, wrap)
+
+
+def parsetxt(file):
+    if isinstance(file, str):
+        file = open(file) if file != '-' else sys.stdin
+    lines = [line.rstrip('\n') for line in file]
+    width = max(map(len, lines)) if lines else 0
+    seed = [[c != ' ' for c in row.ljust(width)] for row in lines]
+    return np.array(seed, bool, ndmin=2).T.copy()
+
+def parseimg(file):
+    from PIL import Image
+    im = Image.open(file).convert('L')
+    return (np.array(im) < 128).T.copy()
+
+def load_board(seed=None, w=None, h=None, xoff=None, yoff=None, *,
+               density=SEED_FACTOR, size=(WIDTH, HEIGHT)):
+    if seed is None:
+        seed = density
+    elif isinstance(seed, str):
+        try:
+            seed = float(seed)
+        except ValueError:
+            pass
+    if isinstance(seed, float):
+        w, h = w or size[0], h or size[1]
+        return np.random.random((w, h)) < seed
+    if isinstance(seed, str):
+        if os.path.splitext(seed)[1] in ('.png', '.bmp'):
+            seed = parseimg(seed)
+        elif os.path.splitext(seed)[1] == '.npy':
+            seed = np.load(seed)
+        else:
+            seed = parsetxt(seed)
+    board = np.asarray(seed, bool)
+    if w and h:
+        temp = board
+        w0, h0 = temp.shape
+        board = np.zeros((w, h), bool)
+        if xoff is None:
+            xoff = (w - w0) // 2
+        elif xoff < 0:
+            xoff += w
+        if yoff is None:
+            yoff = (h - h0) // 2
+        elif yoff < 0:
+            yoff += h
+        xoff = min(max(0, xoff), w)
+        yoff = min(max(0, yoff), h)
+        board[xoff: xoff+w0, yoff: yoff+h0] = temp[:w-xoff, :h-yoff]
+    return board
+
+def save_board(board, file):
+    if os.path.splitext(file)[1] == '.npy':
+        np.save(file, board)
+    else:
+        # Live cells are black, so parseimg reads snapshots back as seeds
+        from PIL import Image
+        Image.fromarray(np.where(board.T, 0, 255).astype(np.uint8)).save(file)
+
+
+def simulate(seed=None, gens=100, w=None, h=None, xoff=None, yoff=None, *,
+             wrap=False, engine=ENGINE, every=None, snapshot=None,
+             verbose=False):
+    """Run gens generations without a display.
+
+    If snapshot is given it is formatted with the generation number every
+    `every` generations (and at the end), e.g. 'out/gen{:06d}.png'.
+    """
+    board = load_board(seed, w, h, xoff, yoff)
+    eng = make_engine(board, wrap, engine)
+    every = every or gens
+    if snapshot:
+        save_board(eng.board, snapshot.format(0))
+    start = time.perf_counter()
+    elapsed = 0
+    done = 0
+    while done < gens:
+        n = min(every, gens - done)
+        eng.step(n)
+        done += n
+        elapsed = time.perf_counter() - start
+        if snapshot:
+            save_board(eng.board, snapshot.format(done))
+            # Don't count disk writes against the simulation
+            start = time.perf_counter() - elapsed
+        if verbose:
+            print(f'gen {done}: {done / elapsed:.1f} gens/s', file=sys.stderr)
+    board = eng.board
+    return {'engine': engine, 'width': board.shape[0],
+            'height': board.shape[1], 'generations': gens,
+            'seconds': elapsed, 'gens_per_sec': gens / elapsed if elapsed else
+            float('inf'), 'population': int(board.sum())}
+
+BENCH_SIZES = (256, 1024, 4096)
+BENCH_DENSITIES = (.1, .3, .5)
+
+def bench(sizes=BENCH_SIZES, densities=BENCH_DENSITIES, wraps=(False, True),
+          engines=('numpy', 'packed'), gens=20):
+    print(f'{"engine":>8} {"size":>6} {"density":>7} {"wrap":>5} '
+          f'{"gens/s":>10} {"Mcells/s":>10}')
+    results = []
+    for engine, size, density, wrap in itertools.product(
+            engines, sizes, densities, wraps):
+        try:
+            r = simulate(float(density), gens, size, size, wrap=wrap,
+                         engine=engine)
+        except ValueError:
+            continue
+        r.update(density=density, wrap=wrap)
+        results.append(r)
+        print(f'{engine:>8} {size:>6} {density:>7} {wrap!s:>5} '
+              f'{r["gens_per_sec"]:>10.1f} '
+              f'{r["gens_per_sec"] * size * size / 1e6:>10.1f}')
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='headless Game of Life simulation and benchmarks')
+    p.add_argument('-n', '--gens', type=int)
+    p.add_argument('-e', '--engine', choices=ENGINES, default=ENGINE)
+    p.add_argument('-w', '--wrap', action='store_true')
+    p.add_argument('-k', '--every', type=int)
+    p.add_argument('-o', '--snapshot', metavar='PATTERN',
+                   help="e.g. 'gen{:06d}.npy' or 'gen{:06d}.png'")
+    p.add_argument('-v', '--verbose', action='store_true')
+    p.add_argument('-b', '--bench', action='store_true')
+    p.add_argument('--sizes', type=int, nargs='+', default=BENCH_SIZES)
+    p.add_argument('--densities', type=float, nargs='+',
+                   default=BENCH_DENSITIES)
+    p.add_argument('--engines', nargs='+', choices=ENGINES,
+                   default=['numpy', 'packed'])
+    p.add_argument('args', nargs='*', metavar='file, w, h, xoff, yoff')
+    ns = p.parse_args()
+    if ns.bench:
+        bench(ns.sizes, ns.densities, engines=ns.engines, gens=ns.gens or 20)
+        return
+    if ns.wrap and ns.engine == 'hashlife':
+        p.error('hashlife does not support --wrap')
+    args = ns.args
+    file, w, h, xoff, yoff = None, None, None, None, None
+    if len(args) == 4 or len(args) > 5:
+        p.error('wrong number of arguments')
+    if len(args) == 5:
+        xoff, yoff = map(int, args[3:])
+        del args[3:]
+    if len(args) in (1, 3):
+        file = args[0]
+    if len(args) in (2, 3):
+        w, h = map(int, args[-2:])
+    r = simulate(file, ns.gens or 100, w, h, xoff, yoff, wrap=ns.wrap,
+                 engine=ns.engine, every=ns.every, snapshot=ns.snapshot,
+                 verbose=ns.verbose)
+    print(f'{r["generations"]} generations of {r["width"]}x{r["height"]} '
+          f'in {r["seconds"]:.3f}s: {r["gens_per_sec"]:.1f} gens/s, '
+          f'population {r["population"]}')
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import sys, copy, argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import Normalize, LogNorm
@@ -10,6 +12,12 @@ SMOOTHRAD = 8
 CYCLIC_CMAP = 'twilight'
 CYCLIC_PERIOD = 2
 
+TILESIZE = 256
+PERIOD_EPS = 1e-12
+CACHE_BYTES = 256 << 20
+COARSE = 4
+POLL_INTERVAL = 100
+
 
 class CyclicNorm(Normalize):
     def __init__(self, period=1, offset=0):
@@ -48,20 +56,256 @@ def mandelbrot(bounds=(-2, 1, -1.2, 1.2), size=(1201, 961),
     return np.ma.array(z, mask=mask), np.ma.array(iters, mask=mask)
 
 
+def in_interior(c):
+    # Main cardioid and period-2 bulb
+    x, y = c.real, c.imag
+    q = (x - .25)**2 + y**2
+    return (q * (q + x - .25) <= y**2 / 4) | ((x + 1)**2 + y**2 <= 1/16)
+
+
+def mandelbrot_tile(xs, ys, maxiters=60, radius=2, interior=True):
+    """Iterate only the still-live points of one tile, compacted.
+
+    Returns (z, iters, mask) as plain arrays, with the same meaning as the
+    masked arrays returned by mandelbrot().
+    """
+    c = (xs[None, :] + 1j * ys[:, None]).ravel()
+    z = np.zeros(c.shape, complex)
+    iters = np.full(c.shape, maxiters)
+    mask = np.ones(c.shape, bool)
+    live = np.arange(c.size)
+    if interior:
+        live = live[~in_interior(c)]
+    cl = c[live]
+    zl = cl.copy()
+    zold = np.full(zl.shape, np.nan, complex)
+    rad2 = radius**2
+    period = 1
+    for i in range(1, maxiters):
+        escaped = zl.real**2 + zl.imag**2 > rad2
+        if interior:
+            # Brent-style periodicity check: points that come back to the
+            # saved orbit value never escape. The value is refreshed at
+            # each power of two, so a cycle of any length is caught once
+            # the window grows past it.
+            cycled = abs(zl - zold) < PERIOD_EPS
+            if i == period:
+                zold = zl.copy()
+                period *= 2
+        else:
+            cycled = None
+        if escaped.any():
+            idx = live[escaped]
+            z[idx] = zl[escaped]
+            iters[idx] = i
+            mask[idx] = False
+            keep = ~escaped
+            if cycled is not None:
+                keep &= ~cycled
+        elif cycled is not None and cycled.any():
+            keep = ~cycled
+        else:
+            zl = zl**2 + cl
+            continue
+        live, zl, cl, zold = live[keep], zl[keep], cl[keep], zold[keep]
+        if not live.size:
+            break
+        zl = zl**2 + cl
+    shape = len(ys), len(xs)
+    return z.reshape(shape), iters.reshape(shape), mask.reshape(shape)
+
+
+class TileCache:
+    """LRU cache of rendered tiles, bounded by total array size."""
+    def __init__(self, maxbytes=CACHE_BYTES):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.tiles = OrderedDict()
+
+    def get(self, key):
+        result = self.tiles.get(key)
+        if result is not None:
+            self.tiles.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        if key in self.tiles:
+            return
+        self.tiles[key] = result
+        self.nbytes += sum(a.nbytes for a in result)
+        while self.nbytes > self.maxbytes and len(self.tiles) > 1:
+            _, old = self.tiles.popitem(last=False)
+            self.nbytes -= sum(a.nbytes for a in old)
+
+    def clear(self):
+        self.tiles.clear()
+        self.nbytes = 0
+
+tile_cache = TileCache()
+
+def tile_key(xs, ys, maxiters, radius, interior):
+    # Bounds are quantized to a fraction of a pixel so a view reached again
+    # by zooming back out matches despite rounding
+    dx = (xs[-1] - xs[0]) / max(len(xs) - 1, 1) or 1
+    dy = (ys[-1] - ys[0]) / max(len(ys) - 1, 1) or 1
+    return (round(xs[0] / dx * 1000), round(ys[0] / dy * 1000),
+            float(f'{dx:.9g}'), float(f'{dy:.9g}'), len(xs), len(ys),
+            maxiters, radius, interior)
+
+
+def _render_tile(args):
+    return mandelbrot_tile(*args)
+
+_pool = None
+
+def get_pool(workers=None):
+    # Kept around so interactive zooms don't pay the startup cost again
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(workers)
+    return _pool
+
+
+def split_tiles(bounds, size, tile=TILESIZE):
+    x0, x1, y0, y1 = bounds
+    xs = np.linspace(x0, x1, size[0])
+    ys = np.linspace(y0, y1, size[1])
+    tiles = [(slice(j, j + tile), slice(i, i + tile))
+             for j in range(0, size[1], tile) for i in range(0, size[0], tile)]
+    return xs, ys, tiles
+
+
+def mandelbrot_tiled(bounds=(-2, 1, -1.2, 1.2), size=(1201, 961),
+                     maxiters=60, radius=2, tile=TILESIZE, workers=None,
+                     interior=True, cache=tile_cache):
+    xs, ys, tiles = split_tiles(bounds, size, tile)
+    args = [(xs[si], ys[sj], maxiters, radius, interior) for sj, si in tiles]
+    keys = [tile_key(*a) for a in args]
+    results = [cache.get(k) if cache is not None else None for k in keys]
+    missing = [i for i, r in enumerate(results) if r is None]
+    todo = [args[i] for i in missing]
+    if workers == 1 or len(todo) <= 1:
+        computed = map(_render_tile, todo)
+    else:
+        computed = get_pool(workers).map(_render_tile, todo)
+    for i, r in zip(missing, computed):
+        results[i] = r
+        if cache is not None:
+            cache.put(keys[i], r)
+    z = np.empty((size[1], size[0]), complex)
+    iters = np.empty((size[1], size[0]), int)
+    mask = np.empty((size[1], size[0]), bool)
+    for (sj, si), (zt, it, mt) in zip(tiles, results):
+        z[sj, si], iters[sj, si], mask[sj, si] = zt, it, mt
+    return np.ma.array(z, mask=mask), np.ma.array(iters, mask=mask)
+
+
+class ProgressiveRender:
+    """Show a subsampled image at once, then fill in full-resolution tiles
+    from the process pool as they finish, without blocking the GUI."""
+    def __init__(self, bounds, size, maxiters, radius, smooth,
+                 tile=TILESIZE, workers=None, coarse=COARSE, cache=tile_cache):
+        self.image = None
+        self.smooth = smooth
+        self.cache = cache
+        xs, ys, tiles = split_tiles(bounds, size, tile)
+        shape = size[1], size[0]
+        self.z = np.zeros(shape, complex)
+        self.iters = np.zeros(shape, int)
+        self.mask = np.zeros(shape, bool)
+
+        self.pending = []
+        pool = None
+        for sj, si in tiles:
+            args = xs[si], ys[sj], maxiters, radius, True
+            key = tile_key(*args)
+            result = cache.get(key)
+            if result is None:
+                pool = pool or get_pool(workers)
+                self.pending.append((sj, si, key, pool.submit(
+                    mandelbrot_tile, *args)))
+            else:
+                self.z[sj, si], self.iters[sj, si], self.mask[sj, si] = result
+
+        if self.pending:
+            # Fill the missing tiles from a coarse render, upsampled
+            zc, ic, mc = mandelbrot_tile(xs[::coarse], ys[::coarse],
+                                         maxiters, radius)
+            up = lambda a: a.repeat(coarse, 0).repeat(coarse, 1)[:shape[0],
+                                                                  :shape[1]]
+            zc, ic, mc = up(zc), up(ic), up(mc)
+            for sj, si, _, _ in self.pending:
+                self.z[sj, si] = zc[sj, si]
+                self.iters[sj, si] = ic[sj, si]
+                self.mask[sj, si] = mc[sj, si]
+
+    def attach(self, image):
+        self.image = image
+        self.timer = image.figure.canvas.new_timer(interval=POLL_INTERVAL)
+        self.timer.add_callback(self.poll)
+        if self.pending:
+            self.timer.start()
+
+    def data(self):
+        z = np.ma.array(self.z, mask=self.mask)
+        iters = np.ma.array(self.iters, mask=self.mask)
+        return smooth_color(z, iters) if self.smooth else iters
+
+    def poll(self):
+        done = [p for p in self.pending if p[3].done()]
+        if not done:
+            return
+        for p in done:
+            sj, si, key, future = p
+            result = future.result()
+            self.cache.put(key, result)
+            self.z[sj, si], self.iters[sj, si], self.mask[sj, si] = result
+            self.pending.remove(p)
+        self.image.set_data(self.data())
+        if not self.pending:
+            self.timer.stop()
+            self.image.autoscale()
+        self.image.figure.canvas.draw_idle()
+
+    def cancel(self):
+        if self.image is not None:
+            self.timer.stop()
+        for *_, future in self.pending:
+            future.cancel()
+        self.pending = []
+
+_render = None
+
+
 def smooth_color(z, iters):
     return iters + 1 - np.ma.log2(np.ma.log2(abs(z)))
 
 
 def draw_mandelbrot(bounds=(-2, 1, -1.2, 1.2), size=(1201, 961),
                     maxiters=80, smooth=True, cyclic=False, radius=None,
-                    cmap=None, interp='nearest'):
+                    cmap=None, interp='nearest', tiled=True, workers=None,
+                    progressive=False):
+    global _render
     params.update(bounds=bounds, size=size, maxiters=maxiters, smooth=smooth,
-                  cyclic=cyclic, radius=radius, cmap=cmap, interp=interp)
+                  cyclic=cyclic, radius=radius, cmap=cmap, interp=interp,
+                  tiled=tiled, workers=workers, progressive=progressive)
+    if _render is not None:
+        _render.cancel()
+        _render = None
     x0, x1, y0, y1 = bounds
     radius = radius or (SMOOTHRAD if smooth else 2)
-    z, iters = mandelbrot(bounds, size, maxiters, radius)
-    if smooth:
-        iters = smooth_color(z, iters)
+    if progressive and tiled:
+        _render = ProgressiveRender(bounds, size, maxiters, radius, smooth,
+                                    workers=workers)
+        iters = _render.data()
+    else:
+        if tiled:
+            z, iters = mandelbrot_tiled(bounds, size, maxiters, radius,
+                                        workers=workers)
+        else:
+            z, iters = mandelbrot(bounds, size, maxiters, radius)
+        if smooth:
+            iters = smooth_color(z, iters)
     norm = LogNorm()
     if cyclic:
         norm = CyclicLogNorm(CYCLIC_PERIOD)
@@ -71,8 +315,10 @@ def draw_mandelbrot(bounds=(-2, 1, -1.2, 1.2), size=(1201, 961),
     dx = (x1 - x0) / (2 * (size[0] - 1))
     dy = (y1 - y0) / (2 * (size[1] - 1))
     plt.cla()
-    plt.imshow(iters, cmap=cmap, interpolation=interp, norm=norm,
-               origin='lower', extent=(x0-dx, x1+dx, y0-dy, y1+dy))
+    image = plt.imshow(iters, cmap=cmap, interpolation=interp, norm=norm,
+                       origin='lower', extent=(x0-dx, x1+dx, y0-dy, y1+dy))
+    if _render is not None:
+        _render.attach(image)
     plt.tight_layout()
     plt.draw()
     plt.show()
@@ -112,6 +358,14 @@ if __name__ == '__main__':
     p.add_argument('-c', '--cmap')
     p.add_argument('-t', '--interp', default='nearest',
                    help='default: %(default)s')
+    p.add_argument('-j', '--jobs', type=int,
+                   help='worker processes (default: CPU count)')
+    p.add_argument('-N', '--naive', dest='tiled', action='store_false',
+                   help='render without tiling or interior checks')
+    p.add_argument('-P', '--noprogressive', dest='progressive',
+                   action='store_false',
+                   help='wait for the full render instead of refining a '
+                   'coarse preview')
     args = p.parse_args()
     try:
         import zoom_scroll
@@ -121,4 +375,5 @@ if __name__ == '__main__':
     plt.connect('button_press_event', on_click)
     draw_mandelbrot(bounds=args.bounds, size=args.size, maxiters=args.iters,
                     radius=args.radius, smooth=args.smooth, cyclic=args.cyclic,
-                    cmap=args.cmap, interp=args.interp)
+                    cmap=args.cmap, interp=args.interp, tiled=args.tiled,
+                    workers=args.jobs, progressive=args.progressive)
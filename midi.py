@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import sys, os, struct, enum, time, re, math, collections, warnings
+import array, heapq, bisect
 import collections.abc as cabc
 import numpy as np
 
@@ -96,6 +97,9 @@ META_TEXT_EVENTS = {
 
 DEFAULT_TEMPO = 500_000
 
+# How long before a deadline MidiPlayer.wait_until stops sleeping and spins
+SPIN_TIME = 0.002
+
 
 ############################
 # MIDI File Classes/Parser #
@@ -194,37 +198,9 @@ class MidiFile:
         else:
             buffer = file.read()
 
-        self.tracks = []
-        ntracks = 0
-        header_found = False
-
-        if len(buffer) == 0:
-            raise ValueError('failed to parse midi file: file is empty')
-
-        chunk_head_fmt = struct.Struct('>4sI')
-        header_data_fmt = struct.Struct('>HHh')
-        i = 0
-        while i < len(buffer):
-            typ, length = chunk_head_fmt.unpack_from(buffer, i)
-            i += chunk_head_fmt.size
-            if typ == b'MThd':
-                if header_found:
-                    raise ValueError('failed to parse midi file: multiple header chunks found')
-                header_found = True
-                fmt, ntracks, div = header_data_fmt.unpack_from(buffer, i)
-                if div & 0x8000:
-                    div = SmpteDivision(-(div >> 8), div & 0xff)
-                self.format, self.division = fmt, div
-            elif not header_found:
-                raise ValueError('failed to parse midi file: no header chunk found')
-            elif typ == b'MTrk':
-                self.tracks.append(parse_track_data(buffer, i, length))
-            else:
-                warnings.warn(f'unknown chunk type: {typ}')
-            i += length
-
-        if len(self.tracks) != ntracks:
-            warnings.warn(f'found {len(self.tracks)} tracks, expected {ntracks}')
+        self.format, self.division, chunks = parse_chunks(buffer)
+        self.tracks = [parse_track_data(buffer, i, length)
+                       for i, length in chunks]
 
 def _as_midi_file(file):
     if isinstance(file, MidiFile):
@@ -298,6 +274,341 @@ def metaevent_data(typ, data):
     return data
 
 
+#############################
+# Columnar MIDI Event Store #
+#############################
+
+class MidiColumns:
+    """All events of a midi file as parallel NumPy arrays, merged by tick.
+
+    status holds the raw status byte (with channel). For midi events data1
+    and data2 are the data bytes; for meta events data1 is the meta type.
+    Sysex and meta payloads are not copied: offset and length index into
+    buffer, a memoryview of the file contents.
+    """
+    FIELDS = ('tick', 'track', 'status', 'data1', 'data2', 'offset', 'length')
+
+    def __init__(self, buffer, columns, division=480, format=1, ntracks=0):
+        self.buffer = memoryview(buffer)
+        for name in self.FIELDS:
+            setattr(self, name, columns[name])
+        self.division = division
+        self.format = format
+        self.ntracks = ntracks
+
+    @classmethod
+    def read(cls, file):
+        if isinstance(file, str):
+            with open(file, 'rb') as file:
+                buffer = file.read()
+        elif isinstance(file, (bytes, bytearray, memoryview)):
+            buffer = file
+        else:
+            buffer = file.read()
+        fmt, division, chunks = parse_chunks(buffer)
+        tracks = [parse_track_columns(buffer, i, length)
+                  for i, length in chunks]
+        for t, cols in enumerate(tracks):
+            cols['track'] = np.full(len(cols['tick']), t, np.uint16)
+        return cls(buffer, merge_track_columns(tracks), division, fmt,
+                   len(tracks))
+
+    def __len__(self):
+        return len(self.tick)
+
+    def __repr__(self):
+        return (f'<MidiColumns nevents={len(self)} ntracks={self.ntracks} '
+                f'division={self.division} format={self.format}>')
+
+    def payload(self, i):
+        off = self.offset[i]
+        return self.buffer[off: off + self.length[i]]
+
+    def event(self, i):
+        # Rebuild the tuple form used by MidiFile for a single event
+        status = int(self.status[i])
+        if status in (SysEx, SysExEsc):
+            return (MidiStatus(status), bytes(self.payload(i)))
+        elif status == Meta:
+            typ = int(self.data1[i])
+            try:
+                typ = MetaEvent(typ)
+            except ValueError:
+                typ = HexInt(typ)
+            return (Meta, typ, metaevent_data(typ, bytes(self.payload(i))))
+        n = N_DATA_BYTES[status & STATUS_MASK]
+        return (MidiStatusByte(status), int(self.data1[i]),
+                int(self.data2[i]))[:n + 1]
+
+    def events(self):
+        return AbsMidiEvents((self.event(i), int(t))
+                             for i, t in enumerate(self.tick))
+
+    def midi_mask(self):
+        return self.status < NonMidi
+
+    def note_on_mask(self):
+        return (self.status & STATUS_MASK == NoteOn) & (self.data2 > 0)
+
+    def tempo_map(self):
+        # (tick, tempo) of every SetTempo event, in order
+        idx = np.flatnonzero((self.status == Meta) &
+                             (self.data1 == MetaEvent.SetTempo))
+        tempos = [int.from_bytes(self.payload(i), 'big') for i in idx]
+        return self.tick[idx], np.array(tempos, np.int64)
+
+    def seconds(self):
+        """Timestamp of every event in seconds, following tempo changes."""
+        if isinstance(self.division, SmpteDivision):
+            return self.tick / (self.division.fps * self.division.tpf)
+        ticks, tempos = self.tempo_map()
+        ticks = np.concatenate([[0], ticks])
+        tempos = np.concatenate([[DEFAULT_TEMPO], tempos])
+        spt = tempos / (self.division * 1000_000)
+        starts = np.concatenate([[0], np.cumsum(np.diff(ticks) * spt[:-1])])
+        # Events at a tempo change's tick still use the old tempo, which
+        # gives the same time either way
+        seg = np.searchsorted(ticks, self.tick, 'right') - 1
+        return starts[seg] + (self.tick - ticks[seg]) * spt[seg]
+
+
+def parse_chunks(buffer):
+    """Return (format, division, [(offset, length) of each MTrk chunk])."""
+    if len(buffer) == 0:
+        raise ValueError('failed to parse midi file: file is empty')
+    chunk_head_fmt = struct.Struct('>4sI')
+    header_data_fmt = struct.Struct('>HHh')
+    chunks = []
+    header = None
+    ntracks = 0
+    i = 0
+    while i < len(buffer):
+        typ, length = chunk_head_fmt.unpack_from(buffer, i)
+        i += chunk_head_fmt.size
+        if typ == b'MThd':
+            if header is not None:
+                raise ValueError('failed to parse midi file: multiple header chunks found')
+            fmt, ntracks, div = header_data_fmt.unpack_from(buffer, i)
+            if div & 0x8000:
+                div = SmpteDivision(-(div >> 8), div & 0xff)
+            header = fmt, div
+        elif header is None:
+            raise ValueError('failed to parse midi file: no header chunk found')
+        elif typ == b'MTrk':
+            chunks.append((i, length))
+        else:
+            warnings.warn(f'unknown chunk type: {typ}')
+        i += length
+    if len(chunks) != ntracks:
+        warnings.warn(f'found {len(chunks)} tracks, expected {ntracks}')
+    return (*header, chunks)
+
+
+def parse_track_columns(buffer, offset=0, length=None):
+    # Same grammar as parse_track_data, but appends plain ints to typed
+    # arrays instead of building a tuple and enum per event
+    i = offset
+    end = offset + length if length is not None else len(buffer)
+    dts, statuses = array.array('q'), array.array('B')
+    data1s, data2s = array.array('B'), array.array('B')
+    payloads = []
+    add_dt, add_status = dts.append, statuses.append
+    add_data1, add_data2 = data1s.append, data2s.append
+    running_status = None
+    nbytes = [N_DATA_BYTES.get(s & STATUS_MASK, 0) for s in range(256)]
+    while i < end:
+        b = buffer[i]
+        if b < 0x80:
+            add_dt(b)
+            i += 1
+        else:
+            dt, i = parse_vlq(buffer, i)
+            add_dt(dt)
+        status = buffer[i]
+        i += 1
+        if status == 0xff or status == 0xf0 or status == 0xf7:
+            typ = 0
+            if status == 0xff:
+                typ = buffer[i]
+                i += 1
+            n, i = parse_vlq(buffer, i)
+            payloads.append((len(statuses), i, n))
+            add_status(status)
+            add_data1(typ)
+            add_data2(0)
+            i += n
+            continue
+        if status < 0x80:
+            if running_status is None:
+                raise ValueError('invalid running status')
+            status = running_status
+            i -= 1
+        running_status = status
+        add_status(status)
+        add_data1(buffer[i])
+        if nbytes[status] == 2:
+            add_data2(buffer[i+1])
+            i += 2
+        else:
+            add_data2(0)
+            i += 1
+    offsets = np.zeros(len(statuses), np.int64)
+    lengths = np.zeros(len(statuses), np.int64)
+    if payloads:
+        idx, offs, lens = np.array(payloads, np.int64).T
+        offsets[idx] = offs
+        lengths[idx] = lens
+    return {'tick': np.cumsum(np.frombuffer(dts, np.int64)),
+            'status': np.frombuffer(statuses, np.uint8),
+            'data1': np.frombuffer(data1s, np.uint8),
+            'data2': np.frombuffer(data2s, np.uint8),
+            'offset': offsets, 'length': lengths}
+
+
+def merge_track_columns(tracks):
+    """k-way merge of per-track columns by tick, keeping track order for
+    ties (the same order as MidiFile.merged_events).
+
+    A heap holds the head tick of each track; each pop takes the whole run
+    of that track's events that comes before the next track's head.
+    """
+    if not tracks:
+        return {name: np.array([], np.int64) for name in MidiColumns.FIELDS}
+    heap = [(int(cols['tick'][0]), t, 0)
+            for t, cols in enumerate(tracks) if len(cols['tick'])]
+    heapq.heapify(heap)
+    runs = []
+    while heap:
+        tick, t, start = heapq.heappop(heap)
+        ticks = tracks[t]['tick']
+        if heap:
+            ntick, nt, _ = heap[0]
+            # Ties go to the lower track number
+            side = 'right' if t < nt else 'left'
+            stop = int(np.searchsorted(ticks, ntick, side))
+        else:
+            stop = len(ticks)
+        stop = max(stop, start + 1)
+        runs.append((t, start, stop))
+        if stop < len(ticks):
+            heapq.heappush(heap, (int(ticks[stop]), t, stop))
+    return {name: np.concatenate([tracks[t][name][a:b] for t, a, b in runs])
+            for name in MidiColumns.FIELDS}
+
+
+class CompiledSchedule:
+    """Playback-ready midi and sysex messages with absolute timestamps.
+
+    Messages are packed back to back in data, message i being
+    data[offsets[i]:offsets[i+1]]. Sysex messages already include their
+    0xf0 prefix. groups holds the index of the first message of each run
+    sharing a timestamp, followed by len(self).
+    """
+    def __init__(self, times, status, data, offsets, duration):
+        self.times = times
+        self.status = status
+        self.data = data
+        self.offsets = offsets
+        self.duration = duration
+        self.groups = np.concatenate([
+            np.flatnonzero(np.diff(times, prepend=-1)), [len(times)]])
+
+    @classmethod
+    def compile(cls, file):
+        mc = file if isinstance(file, MidiColumns) else MidiColumns.read(file)
+        seconds = mc.seconds()
+        duration = float(seconds[-1]) if len(seconds) else 0.
+        sel = np.flatnonzero((mc.status < NonMidi) | (mc.status == SysEx) |
+                             (mc.status == SysExEsc))
+        status = mc.status[sel]
+        nbytes = np.zeros(256, np.int64)
+        for st, n in N_DATA_BYTES.items():
+            nbytes[st: st + 16] = n
+        sysex = status >= NonMidi
+        lengths = np.where(sysex, mc.length[sel] + (status == SysEx),
+                           1 + nbytes[status])
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        data = np.zeros(offsets[-1], np.uint8)
+        starts = offsets[:-1]
+        midi = ~sysex
+        data[starts[midi]] = status[midi]
+        data[starts[midi] + 1] = mc.data1[sel][midi]
+        two = midi & (nbytes[status] == 2)
+        data[starts[two] + 2] = mc.data2[sel][two]
+        for i in np.flatnonzero(sysex):
+            payload = mc.payload(sel[i])
+            start = starts[i]
+            if status[i] == SysEx:
+                data[start] = SysEx
+                start += 1
+            data[start: start + len(payload)] = payload
+        return cls(seconds[sel], status, data, offsets, duration)
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        return (f'<CompiledSchedule nmessages={len(self)} '
+                f'duration={fmt_time(self.duration)}>')
+
+    def message(self, i):
+        return self.data[self.offsets[i]: self.offsets[i+1]].tobytes()
+
+    def event(self, i):
+        # Message i as the event tuple MidiFile parsing produces
+        msg = self.message(i)
+        st = int(self.status[i])
+        if st == SysEx:
+            return (MidiStatus(st), msg[1:])
+        if st == SysExEsc:
+            return (MidiStatus(st), msg)
+        return (MidiStatusByte(st), *msg[1:])
+
+    def seek(self, ts):
+        # Index of the first message at or after ts
+        return int(np.searchsorted(self.times, ts, 'left'))
+
+    def save(self, file, source=None):
+        key = np.array(_source_key(source) if source else [-1, -1])
+        np.savez(file, times=self.times, status=self.status, data=self.data,
+                 offsets=self.offsets, duration=self.duration, source=key)
+
+    @classmethod
+    def load(cls, file, source=None):
+        """Load a saved schedule, or return None if it is out of date with
+        respect to the source midi file."""
+        with np.load(file) as npz:
+            if source and list(npz['source']) != _source_key(source):
+                return None
+            return cls(npz['times'], npz['status'], npz['data'],
+                       npz['offsets'], float(npz['duration']))
+
+def _source_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+SCHEDULE_SUFFIX = '.sched.npz'
+
+def load_schedule(file, cache=True):
+    """Compiled schedule for a midi file, cached next to it on disk."""
+    if not isinstance(file, str) or not cache:
+        return CompiledSchedule.compile(file)
+    cache_file = file + SCHEDULE_SUFFIX
+    if os.path.exists(cache_file):
+        try:
+            sched = CompiledSchedule.load(cache_file, file)
+        except (OSError, ValueError, KeyError):
+            sched = None
+        if sched is not None:
+            return sched
+    sched = CompiledSchedule.compile(file)
+    try:
+        sched.save(cache_file, file)
+    except OSError:
+        pass
+    return sched
+
+
 ########################
 # MIDI Event Utilities #
 ########################
@@ -603,11 +914,26 @@ class MidiPlayer:
     def time(self):
         return time.perf_counter()
 
+    def wait_until(self, deadline):
+        # Sleep most of the way, then spin so messages go out on their
+        # deadline rather than whenever the OS wakes us up
+        remaining = deadline - self.time()
+        if remaining > SPIN_TIME:
+            time.sleep(remaining - SPIN_TIME)
+        while self.time() < deadline:
+            pass
+
     def play_midi(self, file=None, events=None, volume=1, tempo_scale=1,
                   start=0, loop=False, sysex=False, print_progress=True,
-                  print_events=False):
+                  print_events=False, cache=True):
         if events is None:
-            events = _as_midi_file(file).schedule_events(sysex=True, meta=True)
+            if isinstance(file, MidiFile):
+                events = file.schedule_events(sysex=True, meta=True)
+            else:
+                self.play_schedule(
+                    load_schedule(file, cache), volume, tempo_scale, start,
+                    loop, sysex, print_progress, print_events)
+                return
         if print_events:
             print_progress = False
         tottime = events[-1][1] / tempo_scale
@@ -652,6 +978,75 @@ class MidiPlayer:
         if print_progress:
             print(f'\r{fmt_time(last_ts)}/{fmt_time(tottime)}')
 
+    def play_schedule(self, sched, volume=1, tempo_scale=1, start=0,
+                      loop=False, sysex=False, print_progress=True,
+                      print_events=False):
+        if print_events:
+            print_progress = False
+        times = (sched.times / tempo_scale).tolist()
+        groups = sched.groups.tolist()
+        status = sched.status.tolist()
+        # Controller and program changes before the start point still
+        # apply; notes don't
+        setup = np.flatnonzero(~np.isin(sched.status & STATUS_MASK,
+                                        (NoteOn, NoteOff)))
+        tottime = sched.duration / tempo_scale
+        notes_on = set()
+        try:
+            do_loop = True
+            while do_loop:
+                first = sched.seek(start * tempo_scale)
+                for i in setup[:np.searchsorted(setup, first)].tolist():
+                    if print_events:
+                        print(sched.event(i))
+                    if status[i] < NonMidi:
+                        self.send_message(sched.message(i))
+                    elif sysex:
+                        self.send_sysex(sched.message(i))
+                g = bisect.bisect_left(groups, first)
+                last_ts = 0
+                t0 = self.time() - start
+                for a, b in zip(groups[g:-1], groups[g+1:]):
+                    ts = times[a]
+                    # Print before waiting to hide delay
+                    if print_progress and last_ts >= start:
+                        print(f'\r{fmt_time(last_ts)}/{fmt_time(tottime)}',
+                              end='', flush=True)
+                    elif print_events:
+                        for i in range(a, b):
+                            print(sched.event(i))
+                    self.wait_until(t0 + ts)
+                    # Everything sharing a timestamp goes out together
+                    for i in range(a, b):
+                        st, msg = status[i], sched.message(i)
+                        if st >= NonMidi:
+                            if sysex:
+                                self.send_sysex(msg)
+                            continue
+                        kind = st & STATUS_MASK
+                        if kind == NoteOn and msg[2]:
+                            if volume != 1:
+                                msg = bytes([st, msg[1],
+                                             min(int(msg[2]*volume), 127)])
+                            notes_on.add((st & CHANNEL_MASK, msg[1]))
+                        elif kind in (NoteOn, NoteOff):
+                            notes_on.discard((st & CHANNEL_MASK, msg[1]))
+                        self.send_message(msg)
+                    last_ts = ts
+                # Hold trailing rests up to the end of the track
+                self.wait_until(t0 + tottime)
+                last_ts = tottime
+                do_loop = loop
+                start = 0
+            self.wait(.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for ch, note in notes_on:
+                self.note_off(note, channel=ch)
+        if print_progress:
+            print(f'\r{fmt_time(last_ts)}/{fmt_time(tottime)}')
+
     def play_note(self, note, duration=1.0, velocity=127, channel=0,
                   instrument=None):
         if instrument is not None:
@@ -819,12 +1214,12 @@ def parse_time(string):
 
 def play_midi(file=None, events=None, volume=1, tempo_scale=1, start=0,
               loop=False, sysex=False, print_progress=True, print_events=False,
-              output=None):
+              output=None, cache=True):
     with MidiPlayer(output) as player:
         player.play_midi(
             file=file, events=events, volume=volume, tempo_scale=tempo_scale,
             start=start, loop=loop, sysex=sysex, print_progress=print_progress,
-            print_events=print_events)
+            print_events=print_events, cache=cache)
 
 
 def play_notes(notes, duration=0.5, delay=0.0, velocity=127, time_scale=1,
@@ -890,6 +1285,119 @@ def dump_info(mf: MidiFile):
               f'{len(track)} events')
 
 
+########################
+# MIDI Corpus Scanning #
+########################
+
+SCAN_FIELDS = ['path', 'size', 'mtime', 'format', 'division', 'tracks',
+               'events', 'notes', 'duration', 'tempo_changes', 'min_tempo',
+               'max_tempo', 'min_note', 'max_note', 'channels']
+
+# Exceptions a truncated or corrupt file can raise from the parser
+PARSE_ERRORS = (ValueError, KeyError, IndexError, ZeroDivisionError,
+                struct.error)
+
+def file_stats(file):
+    mf = MidiFile(file)
+    events = mf.schedule_events(meta=True)
+    tempos = [e[2] for e, _ in filter_events(events, MetaEvent.SetTempo)]
+    notes = [e[1] for e, _ in filter_events(events, note_on=True)]
+    channels = {get_channel(e) for e, _ in events if is_midi(e)}
+    bpms = [tempo_to_bpm(t) for t in tempos or [DEFAULT_TEMPO]]
+    return {
+        'format': mf.format,
+        'division': str(mf.division),
+        'tracks': len(mf.tracks),
+        'events': len(events),
+        'notes': len(notes),
+        'duration': round(events[-1][1], 3) if events else 0,
+        'tempo_changes': len(tempos),
+        'min_tempo': round(min(bpms), 2),
+        'max_tempo': round(max(bpms), 2),
+        'min_note': min(notes, default=''),
+        'max_note': max(notes, default=''),
+        'channels': len(channels),
+    }
+
+def _scan_file(path):
+    try:
+        return path, file_stats(path), None
+    except PARSE_ERRORS + (OSError,) as e:
+        return path, None, f'{type(e).__name__}: {e}'
+
+def find_midi_files(root, exts=('.mid', '.midi', '.smf')):
+    if os.path.isfile(root):
+        yield root
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(exts):
+                yield os.path.join(dirpath, name)
+
+def scan_corpus(root, cache_file=None, workers=None, progress=False):
+    """Collect file_stats for every midi file under root in a process pool.
+
+    Returns (rows, errors) where errors maps paths of malformed files to
+    their error message. If cache_file is given, results for files whose
+    size and mtime are unchanged are reused from it, and it is updated.
+    """
+    import json
+    from concurrent.futures import ProcessPoolExecutor
+    cache = {}
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+    entries = {}
+    todo = []
+    errors = {}
+    for path in find_midi_files(root):
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            errors[path] = f'{type(e).__name__}: {e}'
+            continue
+        key = [st.st_size, st.st_mtime]
+        cached = cache.get(path)
+        if cached and cached['key'] == key:
+            entries[path] = cached
+        else:
+            entries[path] = {'key': key}
+            todo.append(path)
+    if todo:
+        with ProcessPoolExecutor(workers) as pool:
+            results = pool.map(_scan_file, todo, chunksize=16)
+            for n, (path, stats, error) in enumerate(results, 1):
+                entries[path].update(stats=stats, error=error)
+                if progress:
+                    print(f'\r{n}/{len(todo)}', end='', file=sys.stderr,
+                          flush=True)
+        if progress:
+            print(file=sys.stderr)
+    if cache_file:
+        with open(cache_file, 'w') as f:
+            json.dump(entries, f)
+    rows = []
+    for path, entry in entries.items():
+        if entry['error']:
+            errors[path] = entry['error']
+        else:
+            size, mtime = entry['key']
+            rows.append({'path': path, 'size': size, 'mtime': mtime,
+                         **entry['stats']})
+    return rows, errors
+
+def write_scan_csv(rows, file=None):
+    import csv
+    file = file or sys.stdout
+    if isinstance(file, str):
+        with open(file, 'w', newline='') as f:
+            return write_scan_csv(rows, f)
+    writer = csv.DictWriter(file, SCAN_FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
 def main():
     import argparse
     p = argparse.ArgumentParser()
@@ -910,7 +1418,21 @@ def main():
     p.add_argument('-i', '--info', action='store_true')
     p.add_argument('-A', '--all-notes-off', action='store_true')
     p.add_argument('-l', '--list-outputs', action='store_true')
+    p.add_argument('--scan', metavar='DIR',
+                   help='write per-file stats for a directory tree as CSV')
+    p.add_argument('--csv', metavar='FILE', help='scan output (default: stdout)')
+    p.add_argument('--cache', metavar='FILE', help='incremental scan cache')
+    p.add_argument('-j', '--jobs', type=int)
+    p.add_argument('-C', '--no-sched-cache', dest='sched_cache',
+                   action='store_false', help="don't cache the compiled schedule next to the file")
     args = p.parse_args()
+    if args.scan:
+        rows, errors = scan_corpus(args.scan, args.cache, args.jobs,
+                                   progress=sys.stderr.isatty())
+        write_scan_csv(rows, args.csv)
+        for path, error in errors.items():
+            print(f'skipped {path}: {error}', file=sys.stderr)
+        return
     set_backend(args.backend)
     if args.list_outputs:
         for o in list_outputs():
@@ -931,7 +1453,7 @@ def main():
             args.file, volume=args.volume, tempo_scale=args.tempo_scale,
             start=args.start, loop=args.loop, sysex=args.sysex,
             print_progress=args.progress, print_events=args.print_events,
-            output=args.output)
+            output=args.output, cache=args.sched_cache)
 
 if __name__ == '__main__':
     main()
@@ -1,12 +1,19 @@
+import os
 import enum
+import mmap
 import struct
+from array import array
 from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
 from collections.abc import Iterable, Sequence
 from more_itertools import peekable
 from typing import TypeAlias
 
 UINT64_MASK = (1 << 64) - 1
 
+BLOCK_SIZE = 1 << 20
+DECODE_CHUNK = 10000
+
 
 class WireType(enum.IntEnum):
     VARINT = 0  # int32, int64, uint32, uint64, sint32, sint64, bool, enum
@@ -25,6 +32,8 @@ FieldValueArgs: TypeAlias = Value | tuple[Value, WireType]
 
 FieldArgs: TypeAlias = tuple[int, Value] | tuple[int, Value, WireType]
 
+Buffer = (bytes, bytearray, memoryview)
+
 
 def bslice(bts: Iterable[int], n: int):
     slc = bytes(bts[:n] if isinstance(bts, Sequence) else islice(bts, n))
@@ -201,17 +210,135 @@ def decode_field(bts: Iterable[int], with_wire_type=False):
 
 
 def encode_message(fields: MessageLike):
-    bts = bytearray()
+    plan = []
+    bts = bytearray(plan_message(fields, plan))
+    _write_plan(plan, bts, 0)
+    return bytes(bts)
+
+
+def encode_message_into(fields: MessageLike, buf: bytearray, pos=0):
+    """Encode into an existing buffer at pos, growing it if needed, and
+    return the end position."""
+    plan = []
+    end = pos + plan_message(fields, plan)
+    if len(buf) < end:
+        buf.extend(bytes(end - len(buf)))
+    return _write_plan(plan, buf, pos)
+
+
+def varint_size(x: int):
+    return ((x & UINT64_MASK).bit_length() + 6) // 7 or 1
+
+
+def plan_message(fields: MessageLike, plan: list):
+    """Flatten a message into plan as (tag, wire type, value) entries and
+    return its encoded size. Strings are encoded and nested messages are
+    replaced by their size, followed by their own entries."""
+    size = 0
     if isinstance(fields, dict):
         fields = fields.items()
     for num, *args in fields:
         if len(args) == 1 and isinstance(args[0], tuple):
             args = args[0]
-        bts.extend(encode_field(num, *args))
-    return bytes(bts)
+        value = args[0]
+        wire_type = args[1] if len(args) > 1 else None
+        if wire_type is None:
+            wire_type = (WireType.VARINT if isinstance(value, int)
+                         else WireType.I64 if isinstance(value, float)
+                         else WireType.LEN)
+        tag = (num << 3) | wire_type
+        size += (tag.bit_length() + 6) // 7 or 1
+        if wire_type == WireType.VARINT:
+            size += ((value & UINT64_MASK).bit_length() + 6) // 7 or 1
+        elif wire_type == WireType.LEN:
+            if isinstance(value, (list, dict)):
+                i = len(plan)
+                plan.append(None)
+                n = plan_message(value, plan)
+                plan[i] = (tag, wire_type, n)
+                size += varint_size(n) + n
+                continue
+            if isinstance(value, str):
+                value = value.encode()
+            size += varint_size(len(value)) + len(value)
+        elif wire_type == WireType.I64:
+            size += 8
+        elif wire_type == WireType.I32:
+            size += 4
+        elif wire_type == WireType.SGROUP:
+            plan.append((tag, wire_type, None))
+            size += plan_message(value, plan)
+            tag = (num << 3) | WireType.EGROUP
+            plan.append((tag, WireType.EGROUP, None))
+            size += varint_size(tag)
+            continue
+        else:
+            raise ValueError(f'invalid wire type: {wire_type}')
+        plan.append((tag, wire_type, value))
+    return size
+
+
+def _write_varint(buf: bytearray, pos: int, x: int):
+    x &= UINT64_MASK
+    while x > 0x7f:
+        buf[pos] = x & 0x7f | 0x80
+        x >>= 7
+        pos += 1
+    buf[pos] = x
+    return pos + 1
+
+
+def _write_plan(plan: list, buf: bytearray, pos: int):
+    pack_into = struct.pack_into
+    for tag, wire_type, value in plan:
+        if tag < 0x80:
+            buf[pos] = tag
+            pos += 1
+        else:
+            pos = _write_varint(buf, pos, tag)
+        if wire_type == 0:
+            if 0 <= value < 0x80:
+                buf[pos] = value
+                pos += 1
+            else:
+                pos = _write_varint(buf, pos, value)
+        elif wire_type == 2:
+            if isinstance(value, int):
+                # Nested message size, its fields follow
+                pos = _write_varint(buf, pos, value)
+                continue
+            n = len(value)
+            if n < 0x80:
+                buf[pos] = n
+                pos += 1
+            else:
+                pos = _write_varint(buf, pos, n)
+            buf[pos:pos + n] = value
+            pos += n
+        elif wire_type == 1:
+            if isinstance(value, float):
+                pack_into('<d', buf, pos, value)
+            else:
+                pack_into('<Q', buf, pos, value & UINT64_MASK)
+            pos += 8
+        elif wire_type == 5:
+            if isinstance(value, float):
+                pack_into('<f', buf, pos, value)
+            else:
+                pack_into('<I', buf, pos, value & 0xffffffff)
+            pos += 4
+    return pos
+
+
+def _copy_views(fields):
+    return [(num, bytes(val) if isinstance(val, memoryview)
+             else _copy_views(val) if isinstance(val, list) else val, *rest)
+            for num, val, *rest in fields]
 
 
 def decode_message(bts: Iterable[int], with_wire_types=False, group=None):
+    if isinstance(bts, Buffer) and group is None:
+        return _copy_views(decode_buffer(bts, with_wire_types=with_wire_types))
     bts = peekable(iter(bts))
     fields = []
     while bts:
@@ -224,3 +351,326 @@ def decode_message(bts: Iterable[int], with_wire_types=False, group=None):
     if group:
         raise ValueError(f'missing end group: {group}')
     return fields
+
+
+def decode_varint_at(buf: Sequence[int], pos=0):
+    """Decode a varint at buf[pos], returning (value, end position)."""
+    try:
+        b = buf[pos]
+        if b < 0x80:
+            return b, pos + 1
+        x = b & 0x7f
+        shift = 7
+        while True:
+            pos += 1
+            b = buf[pos]
+            x |= (b & 0x7f) << shift
+            if b < 0x80:
+                return x & UINT64_MASK, pos + 1
+            shift += 7
+    except IndexError:
+        raise ValueError('not enough bytes for varint') from None
+
+
+def decode_buffer(buf, pos=0, end=None, with_wire_types=False, group=None):
+    """Decode a message from a bytes-like object without copying.
+
+    LEN values are returned as memoryviews into buf; use MessageView or
+    decode_buffer on them to decode nested messages.
+    """
+    fields, pos = _decode_buffer(memoryview(buf).cast('B'), pos, end,
+                                 with_wire_types, group)
+    return fields
+
+
+def _decode_buffer(mv: memoryview, pos, end, with_wire_types, group):
+    if end is None:
+        end = len(mv)
+    try:
+        return _decode_fields(mv, pos, end, with_wire_types, group)
+    except IndexError:
+        raise ValueError('not enough bytes') from None
+
+
+def _decode_fields(mv: memoryview, pos, end, with_wire_types, group):
+    fields = []
+    append = fields.append
+    while pos < end:
+        tag = mv[pos]
+        if tag < 0x80:
+            pos += 1
+        else:
+            tag, pos = decode_varint_at(mv, pos)
+        num = tag >> 3
+        wire_type = tag & 0x7
+        if wire_type == 0:
+            value = mv[pos]
+            if value < 0x80:
+                pos += 1
+            else:
+                value, pos = decode_varint_at(mv, pos)
+        elif wire_type == 2:
+            n = mv[pos]
+            if n < 0x80:
+                pos += 1
+            else:
+                n, pos = decode_varint_at(mv, pos)
+            if pos + n > end:
+                raise ValueError(f'not enough bytes: {end - pos} < {n}')
+            value = mv[pos:pos + n]
+            pos += n
+        elif wire_type == 1:
+            if pos + 8 > end:
+                raise ValueError(f'not enough bytes: {end - pos} < 8')
+            value = int.from_bytes(mv[pos:pos + 8], 'little')
+            pos += 8
+        elif wire_type == 5:
+            if pos + 4 > end:
+                raise ValueError(f'not enough bytes: {end - pos} < 4')
+            value = int.from_bytes(mv[pos:pos + 4], 'little')
+            pos += 4
+        elif wire_type == 3:
+            value, pos = _decode_fields(mv, pos, end, with_wire_types, num)
+        elif wire_type == 4:
+            if num != group:
+                raise ValueError(f'invalid end group: {num}')
+            return fields, pos
+        else:
+            raise ValueError(f'invalid wire type: {wire_type}')
+        if pos > end:
+            raise ValueError('not enough bytes for varint')
+        if with_wire_types:
+            append((num, value, WireType(wire_type)))
+        else:
+            append((num, value))
+    if group:
+        raise ValueError(f'missing end group: {group}')
+    return fields, pos
+
+
+class MessageView(Sequence):
+    """A message decoded lazily from a buffer.
+
+    Fields are parsed on first access, as (num, value, wire_type). LEN
+    values stay memoryviews into the original buffer until asked for as a
+    string, bytes or a nested MessageView.
+    """
+
+    def __init__(self, buf):
+        self.buf = memoryview(buf).cast('B')
+        self._fields = None
+
+    @property
+    def fields(self):
+        if self._fields is None:
+            self._fields = decode_buffer(self.buf, with_wire_types=True)
+        return self._fields
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __getitem__(self, i):
+        return self.fields[i]
+
+    def __repr__(self):
+        return f'MessageView({bytes(self.buf)!r})'
+
+    def get_all(self, num: int):
+        return [val for n, val, wtype in self.fields if n == num]
+
+    def get(self, num: int, default=None):
+        # Last value wins, as in protobuf
+        for n, val, wtype in reversed(self.fields):
+            if n == num:
+                return val
+        return default
+
+    def bytes(self, num: int, default=None):
+        val = self.get(num)
+        return default if val is None else bytes(val)
+
+    def str(self, num: int, default=None):
+        val = self.get(num)
+        return default if val is None else str(val, 'utf-8')
+
+    def message(self, num: int, default=None):
+        val = self.get(num)
+        return default if val is None else MessageView(val)
+
+    def messages(self, num: int):
+        return [MessageView(val) for val in self.get_all(num)]
+
+    def tobytes(self):
+        return bytes(self.buf)
+
+
+def _open(file, mode='rb'):
+    if isinstance(file, (str, os.PathLike)):
+        return open(file, mode), True
+    return file, False
+
+
+def write_delimited(file, msgs: Iterable[MessageLike | bytes]):
+    """Write messages to a file, each prefixed with its varint length.
+    Returns the number of messages written."""
+    file, close = _open(file, 'wb')
+    buf = bytearray()
+    count = 0
+    try:
+        for msg in msgs:
+            if isinstance(msg, (list, dict)):
+                plan = []
+                n = plan_message(msg, plan)
+                pos = len(buf)
+                buf.extend(bytes(varint_size(n) + n))
+                _write_plan(plan, buf, _write_varint(buf, pos, n))
+            else:
+                buf += encode_varint(len(msg))
+                buf += msg
+            count += 1
+            if len(buf) >= BLOCK_SIZE:
+                file.write(buf)
+                buf.clear()
+        file.write(buf)
+    finally:
+        if close:
+            file.close()
+    return count
+
+
+def iter_delimited(file, decode=False, block_size=BLOCK_SIZE):
+    """Iterate over the length-delimited messages in a file, as bytes or,
+    with decode, as decoded fields. The file is read in blocks into one
+    reused buffer."""
+    file, close = _open(file)
+    buf = bytearray(block_size)
+    mv = memoryview(buf)
+    start = end = 0
+    try:
+        while True:
+            # Yield every complete message in the buffer
+            n = 0
+            while start < end:
+                try:
+                    n, pos = decode_varint_at(mv[:end], start)
+                except ValueError:
+                    n = 0
+                    break
+                if pos + n > end:
+                    break
+                if decode:
+                    yield _copy_views(decode_buffer(mv[pos:pos + n]))
+                else:
+                    yield bytes(mv[pos:pos + n])
+                start = pos + n
+                n = 0
+            # Keep the partial message, growing the buffer if it won't fit
+            need = max(n + 10, block_size)
+            if need > len(buf):
+                mv.release()
+                buf = buf[start:end] + bytearray(need - (end - start))
+                mv = memoryview(buf)
+            else:
+                mv[:end - start] = mv[start:end]
+            end -= start
+            start = 0
+            read = file.readinto(mv[end:])
+            if not read:
+                if end:
+                    raise ValueError(f'truncated message: {end} bytes left')
+                return
+            end += read
+    finally:
+        mv.release()
+        if close:
+            file.close()
+
+
+class DelimitedFile(Sequence):
+    """Random access to a length-delimited message file through mmap.
+
+    Message offsets and lengths are indexed on open; items are memoryviews
+    into the mapping. Items and MessageViews stay valid after close, which
+    leaves the mapping open until the last of them is gone.
+    """
+
+    def __init__(self, file):
+        self.file, self._close = _open(file)
+        self.name = getattr(self.file, 'name', None)
+        size = os.fstat(self.file.fileno()).st_size
+        self.mmap = (mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                     if size else b'')
+        self.buf = memoryview(self.mmap)
+        self.offsets = array('q')
+        self.lengths = array('q')
+        self._index()
+
+    def _index(self):
+        buf = self.buf
+        size = len(buf)
+        pos = 0
+        offsets, lengths = self.offsets, self.lengths
+        while pos < size:
+            n, pos = decode_varint_at(buf, pos)
+            if pos + n > size:
+                raise ValueError(f'truncated message at {pos}')
+            offsets.append(pos)
+            lengths.append(n)
+            pos += n
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        off = self.offsets[i]
+        return self.buf[off:off + self.lengths[i]]
+
+    def message(self, i):
+        return MessageView(self[i])
+
+    def decode(self, start=0, stop=None, workers=None, chunk_size=DECODE_CHUNK):
+        """Decode messages [start:stop], fanning chunks of them out to a
+        process pool if workers is given (0 for one per cpu)."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if workers is None or not self.name:
+            return [_copy_views(decode_buffer(self[i]))
+                    for i in range(start, stop)]
+        chunks = [(self.name, self.offsets[i:i + chunk_size],
+                   self.lengths[i:i + chunk_size])
+                  for i in range(start, stop, chunk_size)]
+        with ProcessPoolExecutor(workers or None) as pool:
+            return [msg for msgs in pool.map(_decode_chunk, *zip(*chunks))
+                    for msg in msgs] if chunks else []
+
+    def close(self):
+        self.buf.release()
+        if self.mmap:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # Views are still out; they keep the mapping alive and it
+                # closes when they are collected
+                pass
+            self.mmap = b''
+        if self._close:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_mapped = {}
+
+def _decode_chunk(name, offsets, lengths):
+    # Each worker maps the file once and reuses it for later chunks
+    if name not in _mapped:
+        with open(name, 'rb') as f:
+            _mapped[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buf = memoryview(_mapped[name])
+    return [_copy_views(decode_buffer(buf[off:off + n]))
+            for off, n in zip(offsets, lengths)]
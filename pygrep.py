@@ -1,5 +1,116 @@
 #!/usr/bin/env python3
-import sys, re, argparse, collections, getfiles
+import sys, os, re, mmap, stat, argparse, itertools, collections, getfiles
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+BINARY_CHECK = 8192
+
+# Constructs that can match a newline, which would let a whole-file search
+# see past the end of a line, and \A and \Z, which anchor to the file
+# rather than the line
+NEWLINE_RE = re.compile(r'\\[snWDAZxuUN0-7]|\[\^|\(\?[a-zA-Z]*s|\n')
+# Regex ops that match the same on UTF-8 bytes as on decoded text; '.',
+# classes, \b and case folding all see bytes, not characters, and so do
+# repeats of them
+BYTE_SAFE_OPS = ('LITERAL', 'SUBPATTERN', 'BRANCH', 'AT_BEGINNING', 'AT_END')
+NON_ASCII_RE = re.compile(rb'[\x80-\xff]')
+
+NEVER_MATCH = '(?!)'
+GLOBAL_FLAGS_RE = re.compile(r'(?:\(\?[aiLmsux]+\))+')
+
+# Shortest required literal worth scanning for before running the regex
+MIN_LITERAL = 3
+# Skip the prefilter if the literal is on more than 1/LITERAL_DENSITY of
+# the lines in the first LITERAL_SAMPLE bytes
+LITERAL_SAMPLE = 65536
+LITERAL_DENSITY = 16
+
+REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT,
+           getattr(sre_parse, 'POSSESSIVE_REPEAT', None))
+
+
+def literal_trie(words):
+    """Compile fixed strings into a regex walking their trie, the goto
+    function of an Aho-Corasick automaton. Shared prefixes are tested once,
+    so thousands of strings don't backtrack through thousands of
+    alternatives."""
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[''] = None
+
+    def edges(node):
+        # Chains of single children collapse into one escaped run
+        for c, child in sorted(node.items()):
+            if not c:
+                continue
+            run = [c]
+            while len(child) == 1 and '' not in child:
+                (c, child), = child.items()
+                run.append(c)
+            yield re.escape(''.join(run)), child
+
+    # Build bottom up with an explicit stack, since recursing per trie
+    # level overflows on long words
+    built = {}
+    stack = [(trie, None)]
+    while stack:
+        node, out = stack.pop()
+        if out is None:
+            out = list(edges(node))
+            stack.append((node, out))
+            stack.extend((child, None) for run, child in out)
+            continue
+        alts = [run + built.pop(id(child)) for run, child in out]
+        end = '' in node
+        if not alts:
+            regex = ''
+        elif len(alts) == 1 and not end:
+            regex = alts[0]
+        else:
+            regex = '(?:' + '|'.join(alts) + ')' + ('?' if end else '')
+        built[id(node)] = regex
+    return built[id(trie)]
+
+
+def required_literal(pattern, flags=0):
+    """Return the longest literal string every match of pattern must
+    contain, or None. A literal prefix is left out since the regex engine
+    already scans for that itself."""
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return None
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+    literals = []
+
+    def walk(items):
+        run = []
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                run.append(chr(av))
+                continue
+            if run:
+                literals.append(''.join(run))
+                run = []
+            if op is sre_parse.SUBPATTERN and not av[1] & re.IGNORECASE:
+                walk(av[3])
+            elif op in REPEATS and av[0] >= 1:
+                walk(av[2])
+        if run:
+            literals.append(''.join(run))
+
+    walk(parsed)
+    if parsed and parsed[0][0] is sre_parse.LITERAL:
+        del literals[0]
+    literal = max(literals, key=len, default='')
+    return literal if len(literal) >= MIN_LITERAL else None
 
 DEF_KWARGS = {
     'match_files': False,
@@ -16,8 +127,75 @@ DEF_KWARGS = {
     'before_context': None,
     'after_context': None,
     'context': 0,
+    'jobs': None,
 }
 
+def has_backrefs(pattern):
+    def walk(items):
+        for item in items:
+            if isinstance(item, tuple) and len(item) == 2 and \
+                    item[0] in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+                return True
+            if isinstance(item, (tuple, list, sre_parse.SubPattern)) and \
+                    walk(item):
+                return True
+        return False
+
+    return walk(sre_parse.parse(pattern))
+
+
+def scope_flags(pattern):
+    """Turn leading global flags like (?i) into a group scoped to pattern,
+    so it can be joined with others."""
+    m = GLOBAL_FLAGS_RE.match(pattern)
+    if not m:
+        return '(?:{})'.format(pattern)
+    flags = ''.join(sorted(set(re.sub(r'[(?)]', '', m.group()))))
+    # A verbose comment would otherwise swallow the closing paren
+    end = '\n)' if 'x' in flags else ')'
+    return '(?{}:{}{}'.format(flags, pattern[m.end():], end)
+
+
+def byte_safe(pattern):
+    """Whether a compiled str pattern matches non-ASCII UTF-8 text the same
+    way as a bytes pattern: only literals, groups, alternation, repeats of
+    those and line anchors, no case folding, and no empty matches."""
+    if pattern.flags & re.IGNORECASE or pattern.match(''):
+        return False
+
+    def safe(items):
+        for op, av in items:
+            if op in REPEATS:
+                if not safe(av[2]):
+                    return False
+                continue
+            if op is sre_parse.AT:
+                op = av
+            if str(op) not in BYTE_SAFE_OPS:
+                return False
+            if op is sre_parse.SUBPATTERN and (av[1] & re.IGNORECASE or
+                                               not safe(av[3])):
+                return False
+            if op is sre_parse.BRANCH and not all(map(safe, av[1])):
+                return False
+        return True
+
+    return safe(sre_parse.parse(pattern.pattern, pattern.flags))
+
+
+def bytes_pattern(pattern):
+    """The bytes version of a str pattern for whole-file search, or None
+    if it can't be searched that way."""
+    if not pattern.pattern.isascii() or NEWLINE_RE.search(pattern.pattern):
+        return None
+    try:
+        return re.compile(pattern.pattern.encode(),
+                          pattern.flags & ~re.UNICODE | re.MULTILINE)
+    except re.error:
+        # Escapes like \u or \N{...} only exist in str patterns
+        return None
+
+
 def grep(pattern, *files, **kwargs):
     if isinstance(pattern, argparse.Namespace):
         args = pattern
@@ -28,91 +206,242 @@ def grep(pattern, *files, **kwargs):
         kwargs2.update(kwargs)
         args = argparse.Namespace(pattern=pattern, files=files, **kwargs2)
 
-    files = getfiles.getfiles(files)
     flags = args.ignore_case and re.IGNORECASE
 
-    if args.fixed:
-        pattern = re.escape(pattern)
+    patterns = [pattern] if isinstance(pattern, str) else list(pattern)
+    if not patterns:
+        # An empty pattern list matches nothing
+        pattern = NEVER_MATCH
+    elif args.fixed:
+        pattern = literal_trie(patterns)
+    elif len(patterns) == 1:
+        pattern = patterns[0]
+    else:
+        # Joining renumbers groups, which would break backreferences
+        if any(map(has_backrefs, patterns)):
+            raise re.error('backreferences are not supported with multiple '
+                           'patterns')
+        pattern = '|'.join(map(scope_flags, patterns))
     if args.line:
         pattern = r'^(?:' + pattern + r')$'
     if args.word:
         pattern = r'\b(?:' + pattern + r')\b'
 
     pattern = re.compile(pattern, flags)
+    literal = required_literal(pattern.pattern, pattern.flags)
 
     before = after = args.context
     if args.before_context is not None:
         before = args.before_context
     if args.after_context is not None:
         after = args.after_context
-    before_buff = collections.deque(maxlen=before)
 
     if args.match_files or args.no_match_files:
         args.count, args.with_filename = False, False
 
+    bpattern = (not before and not after and not args.invert and files and
+                '-' not in files and bytes_pattern(pattern))
+    if bpattern:
+        # Fast path: search whole mmapped files in a process pool
+        ascii_only = not byte_safe(pattern)
+        paths = getfiles.expandpaths(files)
+        jobs = getattr(args, 'jobs', None)
+        fixed = itertools.repeat(bpattern), itertools.repeat(args), \
+            itertools.repeat(ascii_only), \
+            itertools.repeat(literal and literal.encode())
+        with getfiles.stdout_encoding():
+            if jobs == 1 or len(paths) < 2:
+                results = map(grep_mmap, paths, *fixed)
+                grep_results(paths, results, pattern, args, literal)
+            else:
+                with ProcessPoolExecutor(jobs) as pool:
+                    results = pool.map(grep_mmap, paths, *fixed, chunksize=8)
+                    grep_results(paths, results, pattern, args, literal)
+        return
+
     with getfiles.stdout_encoding():
+        for file in getfiles.getfiles(files):
+            grep_file(file, pattern, args, before, after, literal)
+
+
+def grep_results(paths, results, pattern, args, literal=None):
+    for path, result in zip(paths, results):
+        if result is None:
+            for file in getfiles.getfiles([path]):
+                grep_file(file, pattern, args, 0, 0, literal)
+        elif isinstance(result, str):
+            print(result, file=sys.stderr)
+        elif result:
+            sys.stdout.flush()
+            sys.stdout.buffer.write(result)
+    sys.stdout.flush()
+
+
+def grep_mmap(path, pattern, args, ascii_only=False, literal=None):
+    """Search a whole file with a bytes pattern, computing line numbers
+    only for hits. Returns the output as bytes, an error message, or None
+    if the file needs the line by line search (also for non-ASCII files
+    with ascii_only)."""
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            # Pipes and /proc files report a size of 0 but aren't empty;
+            # truly empty files are just as quick to read line by line
+            if not stat.S_ISREG(st.st_mode) or not st.st_size:
+                return None
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return None
+    except OSError as e:
+        return '{}: {}'.format(getfiles.PROGNAME, e)
+    try:
+        if buf.find(b'\0', 0, BINARY_CHECK) >= 0:
+            # Binary files never match, but still count for -L and -c
+            return grep_buffer(b'', os.fsencode(path), pattern, args)
+        # Universal newlines change what the pattern sees
+        if buf.find(b'\r') >= 0:
+            return None
+        if ascii_only and NON_ASCII_RE.search(buf):
+            return None
+        return grep_buffer(buf, os.fsencode(path), pattern, args, literal)
+    finally:
+        buf.close()
+
+
+def grep_buffer(buf, name, pattern, args, literal=None):
+    out = []
+    print_filename = args.with_filename
+    if literal:
+        sample = buf[:LITERAL_SAMPLE]
+        if sample.count(literal) * LITERAL_DENSITY > sample.count(b'\n'):
+            literal = None
+    count = 0
+    lno = 0
+    counted = 0
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        if literal:
+            # Only lines holding the required literal can match
+            i = buf.find(literal, pos)
+            if i < 0:
+                break
+            start = buf.rfind(b'\n', 0, i) + 1
+            stop = pos = buf.find(b'\n', i) + 1 or end
+            m = pattern.search(buf, start, stop)
+            if not m:
+                continue
+        else:
+            m = pattern.search(buf, pos)
+            if not m:
+                break
+            start = buf.rfind(b'\n', 0, m.start()) + 1
+            if start == end:
+                break
+            stop = pos = buf.find(b'\n', start) + 1 or end
+        if m.end() > stop:
+            # The match ran past the end of its line, try the line alone
+            m = pattern.search(buf, start, stop)
+            if not m:
+                continue
+
+        if args.match_files:
+            return name + b'\n'
+        if args.no_match_files:
+            return b''
+
+        if print_filename:
+            out.append(b'\n-- ' + name + b' --\n')
+            print_filename = False
+
+        if args.count:
+            count += 1
+            continue
+
+        lno += buf[counted:start].count(b'\n')
+        counted = start
+        prefix = b'%3d:' % lno if args.line_number else b''
+
+        if args.only_match:
+            out.append(b'\n'.join(prefix + m.group()
+                                  for m in pattern.finditer(buf, start, stop)))
+            out.append(b'\n')
+        else:
+            out.append(prefix + buf[start:stop])
+
+    if args.no_match_files:
+        out.append(name + b'\n')
+    if args.count:
+        out.append(b'%d\n' % count)
+    return b''.join(out)
+
+
+def grep_file(file, pattern, args, before, after, literal=None):
+    before_buff = collections.deque(maxlen=before)
+    if args.count:
+        count = 0
+
+    print_filename = args.with_filename
+    after_limit = 0
+
+    for lno, line in enumerate(file):
+        match = pattern.search(line) if not literal or literal in line else None
+        if args.only_match:
+            matches = pattern.finditer(line)
+        if (match and not args.invert) or (not match and args.invert):
+            if args.match_files:
+                print(file.name)
+                break
+            if args.no_match_files:
+                break
+
+            if print_filename:
+                print('\n-- {} --'.format(file.name))
+                print_filename = False
 
-        for file in files:
             if args.count:
-                count = 0
+                count += 1
+                continue
 
-            print_filename = args.with_filename
+            print(''.join(before_buff), end='')
             before_buff.clear()
-            after_limit = 0
-
-            for lno, line in enumerate(file):
-                match = pattern.search(line)
-                if args.only_match:
-                    matches = pattern.finditer(line)
-                if (match and not args.invert) or (not match and args.invert):
-                    if args.match_files:
-                        print(file.name)
-                        break
-                    if args.no_match_files:
-                        break
-
-                    if print_filename:
-                        print('\n-- {} --'.format(file.name))
-                        print_filename = False
-
-                    if args.count:
-                        count += 1
-                        continue
-
-                    print(''.join(before_buff), end='')
-                    before_buff.clear()
-
-                    prefix = '{:3}:'.format(lno) if args.line_number else ''
-
-                    if args.only_match:
-                        print('\n'.join(prefix + m.group() for m in matches))
-                    else:
-                        print(prefix + line, end='')
-
-                    after_limit = after
-
-                elif after_limit:
-                    if args.line_number:
-                        line = '{:3}-{}'.format(lno, line)
-                    print(line, end='')
-                    after_limit -= 1
-
-                else:
-                    if args.line_number:
-                        line = '{:3}-{}'.format(lno, line)
-                    before_buff.append(line)
 
+            prefix = '{:3}:'.format(lno) if args.line_number else ''
+
+            if args.only_match:
+                print('\n'.join(prefix + m.group() for m in matches))
             else:
-                if args.no_match_files: print(file.name)
+                print(prefix + line, end='')
 
-            if args.count:
-                print(count)
+            after_limit = after
+
+        elif after_limit:
+            if args.line_number:
+                line = '{:3}-{}'.format(lno, line)
+            print(line, end='')
+            after_limit -= 1
+
+        else:
+            if args.line_number:
+                line = '{:3}-{}'.format(lno, line)
+            before_buff.append(line)
+
+    else:
+        if args.no_match_files: print(file.name)
+
+    if args.count:
+        print(count)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('pattern')
+    parser.add_argument('pattern', nargs='?')
     parser.add_argument('files', nargs='*')
+    parser.add_argument('-e', '--regexp', action='append', dest='patterns',
+                        help='pattern to match, may be repeated')
+    parser.add_argument('-f', '--file', action='append', dest='pattern_files',
+                        help='read patterns from a file, one per line')
     parser.add_argument('-l', '--match-files', action='store_true')
     parser.add_argument('-L', '--no-match-files', action='store_true')
     parser.add_argument('-o', '--only-match', action='store_true')
@@ -127,5 +456,20 @@ if __name__ == '__main__':
     parser.add_argument('-B', '--before-context', type=int)
     parser.add_argument('-A', '--after-context', type=int)
     parser.add_argument('-C', '--context', type=int, default=0)
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='worker processes for multi-file search')
     args = parser.parse_args()
-    grep(args)
+    if args.patterns or args.pattern_files:
+        # The first positional is then a file
+        if args.pattern is not None:
+            args.files.insert(0, args.pattern)
+        args.pattern = args.patterns or []
+        for path in args.pattern_files or ():
+            with open(path) as f:
+                args.pattern += f.read().splitlines()
+    elif args.pattern is None:
+        parser.error('no pattern given')
+    try:
+        grep(args)
+    except re.error as e:
+        parser.error(e)
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
-import sys, os, time
+import time
 import curses
-import numpy as np
 import argparse
+from lifeengine import make_engine, load_board, parsetxt, parseimg, \
+    ENGINES, ENGINE
 
 FPS = 60
 SPEEDS = [2, 10, 30, 60]
@@ -18,40 +19,11 @@ BIGSCRL = 50
 
 class Life:
     def __init__(self, screen, seed=None, w=None, h=None, xoff=None, yoff=None,
-                 wrap=False, speed=SPEED, pause=False):
-        if seed is None:
-            seed = SEED_FACTOR
-        elif isinstance(seed, str):
-            try:
-                seed = float(seed)
-            except ValueError:
-                pass
-        if isinstance(seed, float):
-            w, h = w or WIDTH, h or HEIGHT
-            self.board = np.random.random((w, h)) < seed
-        else:
-            if isinstance(seed, str):
-                if os.path.splitext(seed)[1] in ('.png', '.bmp'):
-                    seed = parseimg(seed)
-                else:
-                    seed = parsetxt(seed)
-            self.board = np.asarray(seed, bool)
-            if w and h:
-                temp = self.board
-                w0, h0 = temp.shape
-                # w, h = max(w, w0), max(h, h0)
-                self.board = np.zeros((w, h), bool)
-                if xoff is None:
-                    xoff = (w - w0) // 2
-                elif xoff < 0:
-                    xoff += w
-                if yoff is None:
-                    yoff = (h - h0) // 2
-                elif yoff < 0:
-                    yoff += h
-                xoff = min(max(0, xoff), w)
-                yoff = min(max(0, yoff), h)
-                self.board[xoff: xoff+w0, yoff: yoff+h0] = temp[:w-xoff, :h-yoff]
+                 wrap=False, speed=SPEED, pause=False, engine=ENGINE):
+        board = load_board(seed, w, h, xoff, yoff, density=SEED_FACTOR,
+                           size=(WIDTH, HEIGHT))
+        self.engine = make_engine(board, wrap, engine)
+        self.board = self.engine.board
         self.width, self.height = self.board.shape
         self.scrollx = 0
         self.scrolly = 0
@@ -137,15 +109,8 @@ class Life:
                 self.display()
 
     def tick(self):
-        # neighbors = convolve2d(self.board, [[1,1,1],[1,0,1],[1,1,1]], 'same')
-        padded = np.pad(self.board, 1, 'wrap' if self.wrap else 'constant')
-        neighbors = np.zeros_like(self.board, int)
-        for di, dj in [(-1, -1), (-1, 0), (-1, 1), (0, 1),
-                       (1, 1),   (1, 0),  (1, -1), (0, -1)]:
-            neighbors += padded[1+di : self.width+1+di,
-                                1+dj : self.height+1+dj]
-        self.board[neighbors != 2] = False
-        self.board[neighbors == 3] = True
+        self.engine.step()
+        self.board = self.engine.board
 
     def display(self):
         # self.screen.clear()
@@ -160,35 +125,24 @@ class Life:
         self.screen.refresh()
 
 
-def parsetxt(file):
-    if isinstance(file, str):
-        file = open(file) if file != '-' else sys.stdin
-    lines = [line.rstrip('\n') for line in file]
-    width = max(map(len, lines)) if lines else 0
-    seed = [[c != ' ' for c in row.ljust(width)] for row in lines]
-    return np.array(seed, bool, ndmin=2).T.copy()
-
-def parseimg(file):
-    from PIL import Image
-    im = Image.open(file).convert('L')
-    return (np.array(im) < 128).T.copy()
-
-
 def run(stdscr, seed=None, w=None, h=None, xoff=0, yoff=0,
-        wrap=False, speed=SPEED, pause=False):
-    Life(stdscr, seed, w, h, xoff, yoff, wrap=wrap, speed=speed, pause=pause
-         ).run()
+        wrap=False, speed=SPEED, pause=False, engine=ENGINE):
+    Life(stdscr, seed, w, h, xoff, yoff, wrap=wrap, speed=speed, pause=pause,
+         engine=engine).run()
 
 
 if __name__ == '__main__':
     p = argparse.ArgumentParser(
-        usage='%(prog)s [-h] [-w] [-p] '
+        usage='%(prog)s [-h] [-w] [-p] [-e ENGINE] '
         '[file] [w h] [xoff yoff]')
     p.add_argument('-w', '--wrap', action='store_true')
     p.add_argument('-s', '--speed', type=int, default=SPEED)
     p.add_argument('-p', '--pause', action='store_true')
+    p.add_argument('-e', '--engine', choices=ENGINES, default=ENGINE)
     p.add_argument('args', nargs='*', metavar='file, w, h, xoff, yoff')
     ns = p.parse_args()
+    if ns.wrap and ns.engine == 'hashlife':
+        p.error('hashlife does not support --wrap')
     args = ns.args
 
     file, w, h, xoff, yoff = None, None, None, None, None
@@ -202,4 +156,5 @@ if __name__ == '__main__':
     if len(args) in (2, 3):
         w, h = map(int, args[-2:])
     curses.wrapper(run, file, w, h, xoff, yoff,
-                   wrap=ns.wrap, speed=ns.speed, pause=ns.pause)
+                   wrap=ns.wrap, speed=ns.speed, pause=ns.pause,
+                   engine=ns.engine)